@@ -0,0 +1,48 @@
+"""Benchmark decoding submission pages with each installed JSON backend
+
+Pages are generated like the mock server's, decoded from bytes the way
+`Connection.decode_json` does, next to the previous stdlib decode of
+`response.text`.
+
+    python -m benchmarks.bench_codec --records 1000 --fields 40
+"""
+import argparse
+import json
+import timeit
+
+from benchmarks.mock_server import make_form, make_submissions
+from onapie import codec
+
+
+def run(records=1000, fields=40, number=20):
+    page = json.dumps(make_submissions(make_form(1, fields),
+                                       records)).encode('utf-8')
+    decoders = {'json (text)': lambda: json.loads(page.decode('utf-8'))}
+    for name, backend in codec.CODECS.items():
+        decoders[name] = (lambda loads: lambda: loads(page))(backend.loads)
+
+    results = {'page_bytes': len(page), 'records': records, 'backends': {}}
+    for name, decode in sorted(decoders.items()):
+        seconds = min(timeit.repeat(decode, number=number,
+                                    repeat=3)) / number
+        results['backends'][name] = {
+            'seconds_per_page': seconds,
+            'mb_per_second': len(page) / seconds / 2 ** 20,
+            'records_per_second': records / seconds,
+        }
+    results['default'] = codec.default.name
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--fields', type=int, default=40)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.records, args.fields, args.number), indent=2,
+                     sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark downloading submissions with each response encoding
+
+Streams every submission of a form from the mock server, which compresses
+responses with the encoding the client prefers, and reports the time taken,
+the bytes received over the wire and the bytes decoded. Pass `--bandwidth`
+to serve responses at a fixed rate, as a remote server over a slow link
+would; on localhost compression only costs CPU.
+
+    python -m benchmarks.bench_compression --bandwidth 2000000
+"""
+import argparse
+import json
+import time
+
+from benchmarks.mock_server import API_TOKEN, ENCODERS, MockOnaServer
+from onapie.client import Client
+from onapie.metrics import MetricsCollector
+from onapie.transport import httpx
+from onapie.utils import ConnectionRegistry
+
+ENCODINGS = [('identity', False, 'requests'), ('gzip', 'gzip', 'requests'),
+             ('br', 'br', 'requests'), ('zstd', 'zstd', 'httpx')]
+
+
+def run_encoding(url, compression, transport):
+    metrics = MetricsCollector()
+    client = Client(url, api_token=API_TOKEN, registry=ConnectionRegistry(),
+                    transport=transport, compression=compression)
+    client.conn.add_hook(metrics)
+
+    start = time.time()
+    records = sum(1 for _ in client.conn.iter_json('/api/v1/data/1'))
+    elapsed = time.time() - start
+
+    client.conn.close()
+    summary = metrics.summary()['GET /api/v1/data/{id}']
+    return {'seconds': elapsed, 'records': records,
+            'bytes': summary['bytes'], 'wire_bytes': summary['wire_bytes'],
+            'compression_ratio': summary['compression_ratio']}
+
+
+def run(submissions=50000, bandwidth=None):
+    results = {}
+    with MockOnaServer(forms=1, submissions=submissions, compress=True,
+                       bandwidth=bandwidth) as server:
+        for name, compression, transport in ENCODINGS:
+            if compression and compression not in ENCODERS or \
+                    transport == 'httpx' and httpx is None:
+                continue
+            results[name] = run_encoding(server.url, compression, transport)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--submissions', type=int, default=50000)
+    parser.add_argument('--bandwidth', type=int, default=None,
+                        help='Bytes per second')
+    args = parser.parse_args()
+    print(json.dumps(run(args.submissions, args.bandwidth), indent=2,
+                     sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Benchmark flattening submissions with repeats into tables
+
+Compares `Flattener`, which compiles the form into the xpaths read into
+each table once, against walking the form's groups and repeats for every
+submission, and against decoding the same submissions from JSON for
+scale. Submissions have a repeat of household members, each with a nested
+repeat of visits.
+
+    python -m benchmarks.bench_flatten --records 100000 --members 3
+"""
+import argparse
+import json
+import random
+import time
+
+from onapie import codec
+from onapie.flatten import Flattener
+from onapie.ona_schema import OnaForm, OnaSchemaNode
+
+
+def make_schema(fields=20, member_fields=8, visit_fields=4):
+    """A form of `fields` questions in two groups, with a repeat of
+    `member_fields` questions holding a repeat of `visit_fields`"""
+    def questions(prefix, count):
+        return [{'name': '{}{}'.format(prefix, i), 'type': 'text'}
+                for i in range(count)]
+
+    half = fields // 2
+    return {'name': 'bench', 'id_string': 'bench', 'children': [
+        {'name': 'intro', 'type': 'group',
+         'children': questions('q', half)},
+        {'name': 'more', 'type': 'group',
+         'children': questions('r', fields - half)},
+        {'name': 'members', 'type': 'repeat',
+         'children': questions('m', member_fields) + [
+             {'name': 'visits', 'type': 'repeat',
+              'children': questions('v', visit_fields)}]},
+    ]}
+
+
+def make_records(form, count, members=3, visits=2, seed=0):
+    rnd = random.Random(seed)
+    values = ['value {}'.format(i) for i in range(100)]
+
+    def fill(children):
+        item = {}
+        for field in children:
+            if field.get(OnaSchemaNode.TYPE) == OnaSchemaNode.REPEAT:
+                continue
+            if field.get(OnaSchemaNode.TYPE) == 'group':
+                item.update(fill(field[OnaSchemaNode.CHILDREN]))
+            else:
+                item[field[OnaSchemaNode.XPATH]] = rnd.choice(values)
+        return item
+
+    repeat = form['members']
+    nested = form['members/visits']
+    records = []
+    for i in range(1, count + 1):
+        record = fill(form.children)
+        record['_id'] = i
+        record['_submission_time'] = '2015-01-01T10:00:00'
+        record['members'] = []
+        for _ in range(members):
+            member = fill(repeat[OnaSchemaNode.CHILDREN])
+            member['members/visits'] = [
+                fill(nested[OnaSchemaNode.CHILDREN]) for _ in range(visits)]
+            record['members'].append(member)
+        records.append(record)
+    return records
+
+
+def walk(form, records):
+    """Flatten by walking the form for every submission, as consumers
+    lining values up against `OnaForm` fields by hand do"""
+    tables = {}
+
+    def visit(item, children, row, data_id):
+        for field in children:
+            field_type = field.get(OnaSchemaNode.TYPE)
+            xpath = field[OnaSchemaNode.XPATH]
+            if field_type == 'group':
+                visit(item, field[OnaSchemaNode.CHILDREN], row, data_id)
+            elif field_type == OnaSchemaNode.REPEAT:
+                for repetition in item.get(xpath) or []:
+                    child = {'_id': data_id}
+                    visit(repetition, field[OnaSchemaNode.CHILDREN], child,
+                          data_id)
+                    tables.setdefault(xpath, []).append(child)
+            elif field_type != 'note':
+                row[xpath] = item.get(xpath)
+
+    rows = tables['bench'] = []
+    for record in records:
+        row = {'_id': record.get('_id'),
+               '_submission_time': record.get('_submission_time')}
+        visit(record, form.children, row, row['_id'])
+        rows.append(row)
+    return tables
+
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def time_decode(records):
+    content = json.dumps(records).encode('utf-8')
+    return timed(lambda: codec.loads(content))[0]
+
+
+def run(records=100000, members=3, visits=2):
+    form = OnaForm(make_schema())
+    data = make_records(form, records, members, visits)
+    decode_seconds = time_decode(data)
+    walk_seconds, walked = timed(lambda: walk(form, data))
+    del walked
+    compile_seconds, flattener = timed(lambda: Flattener(form))
+    flatten_seconds, tables = timed(lambda: flattener.flatten(data))
+
+    return {
+        'records': records,
+        'rows': dict((table, len(rows)) for table, rows in tables.items()),
+        'decode_seconds': decode_seconds,
+        'walk_seconds': walk_seconds,
+        'compile_seconds': compile_seconds,
+        'flatten_seconds': flatten_seconds,
+        'speedup': walk_seconds / flatten_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--members', type=int, default=3)
+    parser.add_argument('--visits', type=int, default=2)
+    args = parser.parse_args()
+    print(json.dumps(run(args.records, args.members, args.visits), indent=2,
+                     sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
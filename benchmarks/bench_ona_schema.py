@@ -0,0 +1,149 @@
+"""Benchmark OnaForm construction and field lookups
+
+Compares the indexed OnaForm against the previous implementation, which
+built every node twice and could only find fields by name or type by
+walking all of them.
+
+    python -m benchmarks.bench_ona_schema --fields 3000 --depth 6
+"""
+import argparse
+import json
+import timeit
+import tracemalloc
+
+from onapie.ona_schema import OnaForm, OnaSchemaNode
+
+
+class LegacyOnaSchemaNode(dict):
+
+    def __init__(self, schema, parents=None):
+        super(LegacyOnaSchemaNode, self).__init__(schema)
+        parents = parents or []
+        xpath = "/".join(parents)
+        if len(parents) < 1:
+            xpath += "{}"
+        else:
+            xpath += "/{}"
+        self['xpath'] = xpath.format(self['name'])
+
+
+def legacy_parse_children(children, parents=None):
+    parents = parents or []
+    nodes = {}
+    for child in children:
+        node = LegacyOnaSchemaNode(child, parents)
+        nodes[node['xpath']] = LegacyOnaSchemaNode(child, parents)
+        if 'children' in node:
+            new_parents = parents[:]
+            new_parents.append(node['name'])
+            nodes.update(legacy_parse_children(node['children'],
+                                               new_parents))
+    return nodes
+
+
+FIELD_TYPES = ['text', 'integer', 'decimal', 'date', 'geopoint']
+
+
+def make_schema(fields=3000, depth=6, choices=5):
+    """A synthetic form of `fields` questions spread over `depth` levels of
+    nested repeat groups, every fifth question a select one"""
+    per_level = max(1, fields // depth)
+    counter = [0]
+
+    def level(remaining_depth):
+        children = []
+        for _ in range(per_level):
+            counter[0] += 1
+            i = counter[0]
+            if i % 5 == 0:
+                children.append({
+                    'name': 'q{}'.format(i), 'type': 'select one',
+                    'label': 'Question {}'.format(i),
+                    'children': [{'name': 'c{}'.format(c),
+                                  'label': 'Choice {}'.format(c)}
+                                 for c in range(choices)]})
+            else:
+                children.append({
+                    'name': 'q{}'.format(i), 'label': 'Question {}'.format(i),
+                    'type': FIELD_TYPES[i % len(FIELD_TYPES)]})
+        if remaining_depth > 1:
+            children.append({'name': 'repeat{}'.format(remaining_depth),
+                             'type': 'repeat',
+                             'children': level(remaining_depth - 1)})
+        return children
+
+    return {'name': 'bench', 'id_string': 'bench',
+            'children': level(depth)}
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def run(fields=3000, depth=6, number=20):
+    schema = make_schema(fields, depth)
+    children = schema[OnaSchemaNode.CHILDREN]
+    legacy = legacy_parse_children(children)
+    form = OnaForm(schema)
+    xpaths = [node[OnaSchemaNode.XPATH] for node in form.fields()]
+    names = [node[OnaSchemaNode.NAME] for node in form.fields()][::10]
+
+    def legacy_by_name():
+        for name in names:
+            [n for n in legacy.values() if n['name'] == name]
+
+    def legacy_by_type():
+        for field_type in FIELD_TYPES:
+            [n for n in legacy.values() if n.get('type') == field_type]
+
+    def by_name():
+        for name in names:
+            form.fields_by_name(name)
+
+    def by_type():
+        for field_type in FIELD_TYPES:
+            form.fields_by_type(field_type)
+
+    return {
+        'fields': len(xpaths),
+        'legacy_nodes': len(legacy),
+        'construct_seconds': {
+            'legacy': measure(lambda: legacy_parse_children(children),
+                              number),
+            'onaform': measure(lambda: OnaForm(schema), number)},
+        'construct_peak_bytes': {
+            'legacy': peak_memory(
+                lambda: legacy_parse_children(children))[0],
+            'onaform': peak_memory(lambda: OnaForm(schema))[0]},
+        'xpath_lookup_seconds': {
+            'legacy': measure(lambda: [legacy[x] for x in xpaths], number),
+            'onaform': measure(lambda: [form[x] for x in xpaths], number)},
+        'name_lookup_seconds': {
+            'legacy': measure(legacy_by_name, 1),
+            'onaform': measure(by_name, number)},
+        'type_lookup_seconds': {
+            'legacy': measure(legacy_by_type, number),
+            'onaform': measure(by_type, number)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--fields', type=int, default=3000)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.fields, args.depth, args.number), indent=2))
+
+
+if __name__ == '__main__':
+    main()
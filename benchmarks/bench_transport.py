@@ -0,0 +1,77 @@
+"""Benchmark many small concurrent requests over each transport
+
+Fires `data.get(pk, dataid)` calls from a thread pool at the mock server,
+which answers HTTP/1.1 and HTTP/2 (h2c) on one port, and reports latency
+percentiles and how many connections the server accepted. Pass
+`--connect-delay` to charge every new connection a handshake's worth of
+round trips, as a remote server over TLS would.
+
+    python -m benchmarks.bench_transport --requests 1000 --concurrency 50
+"""
+import argparse
+import json
+import time
+
+from benchmarks.mock_server import API_TOKEN, MockOnaServer
+from onapie.client import Client
+from onapie.metrics import percentile
+from onapie.transport import TRANSPORTS, httpx
+from onapie.utils import ConnectionRegistry, iter_concurrently
+
+
+def timed_get(client, dataid):
+    start = time.time()
+    client.data.get(1, dataid)
+    return time.time() - start
+
+
+def run_transport(url, transport, requests, concurrency):
+    client = Client(url, api_token=API_TOKEN, registry=ConnectionRegistry(),
+                    transport=transport, pool_maxsize=concurrency)
+    # Resolve the catalog first so only data requests are measured
+    client.data
+    connections = client.conn.decode_json(
+        client.conn.get('/mock/connections'))['connections']
+
+    start = time.time()
+    results = list(iter_concurrently(
+        lambda dataid: timed_get(client, dataid), range(1, requests + 1),
+        concurrency))
+    elapsed = time.time() - start
+
+    latencies = [r.result for r in results if r.error is None]
+    opened = client.conn.decode_json(client.conn.get(
+        '/mock/connections'))['connections'] - connections
+    client.conn.close()
+    return {
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed,
+        'errors': sum(1 for r in results if r.error is not None),
+        'connections_opened': opened,
+        'latency_seconds': dict(
+            ('p{}'.format(p), percentile(latencies, p))
+            for p in (50, 90, 99)),
+    }
+
+
+def run(requests=1000, concurrency=50, connect_delay=0.0):
+    transports = ['requests'] + (['httpx', 'http2'] if httpx else [])
+    with MockOnaServer(forms=1, submissions=requests,
+                       connect_delay=connect_delay) as server:
+        return dict((name, run_transport(server.url, name, requests,
+                                         concurrency))
+                    for name in transports if name in TRANSPORTS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--connect-delay', type=float, default=0.0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.requests, args.concurrency,
+                         args.connect_delay), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
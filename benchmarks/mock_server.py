@@ -0,0 +1,493 @@
+"""A stand-in OnaData API serving synthetic forms, submissions and exports
+
+Responses are generated once up front so the server costs as little as
+possible while a benchmark runs. HTTP/1.1 and HTTP/2 with prior knowledge
+(h2c) are served on the same port, the latter needs the h2 package. Run it
+on its own to poke at it:
+
+    python -m benchmarks.mock_server --port 8000 --submissions 10000
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+from collections import OrderedDict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # NOQA
+    from socketserver import ThreadingMixIn  # NOQA
+    from urllib.parse import urlparse, parse_qs  # NOQA
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # NOQA
+    from SocketServer import ThreadingMixIn  # NOQA
+    from urlparse import urlparse, parse_qs  # NOQA
+
+
+API_TOKEN = 'benchmark-token'
+H2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+FIELD_TYPES = ['text', 'integer', 'decimal', 'date', 'select one',
+               'geopoint']
+CHOICES = ['yes', 'no', 'maybe', 'unknown']
+
+
+def make_form(pk, fields=20, groups=2):
+    """A form JSON of `fields` questions spread over `groups` groups"""
+    children = []
+    per_group = max(1, fields // max(groups, 1))
+    for group in range(groups):
+        questions = []
+        for i in range(per_group):
+            field_type = FIELD_TYPES[(group * per_group + i) %
+                                     len(FIELD_TYPES)]
+            question = {'name': 'q{}'.format(i), 'type': field_type,
+                        'label': 'Question {}'.format(i)}
+            if field_type == 'select one':
+                question['children'] = [{'name': c, 'label': c.title()}
+                                        for c in CHOICES]
+            questions.append(question)
+        children.append({'name': 'group{}'.format(group), 'type': 'group',
+                         'label': 'Group {}'.format(group),
+                         'children': questions})
+    return {'name': 'form{}'.format(pk), 'id_string': 'form{}'.format(pk),
+            'title': 'Form {}'.format(pk), 'type': 'survey',
+            'children': children}
+
+
+def _value(field_type, rnd):
+    if field_type == 'integer':
+        return str(rnd.randint(0, 100))
+    if field_type == 'decimal':
+        return '{:.2f}'.format(rnd.uniform(0, 1000))
+    if field_type == 'date':
+        return '2015-{:02d}-{:02d}'.format(rnd.randint(1, 12),
+                                           rnd.randint(1, 28))
+    if field_type == 'select one':
+        return rnd.choice(CHOICES)
+    if field_type == 'geopoint':
+        return '{:.6f} {:.6f} 1700 5'.format(rnd.uniform(-5, 5),
+                                             rnd.uniform(30, 40))
+    return 'text value {}'.format(rnd.randint(0, 10 ** 6))
+
+
+def make_submissions(form, count, seed=0):
+    """`count` submissions matching the fields of `form`"""
+    rnd = random.Random(seed)
+    fields = [('{}/{}'.format(group['name'], question['name']),
+               question['type'])
+              for group in form['children']
+              for question in group['children']]
+    records = []
+    for i in range(1, count + 1):
+        record = {'_id': i, '_uuid': '{:032x}'.format(i),
+                  '_submission_time': '2015-01-01T10:{:02d}:{:02d}'.format(
+                      (i // 60) % 60, i % 60),
+                  '_date_modified': '2015-01-01T10:{:02d}:{:02d}'.format(
+                      (i // 60) % 60, i % 60),
+                  '_tags': [], '_notes': []}
+        for xpath, field_type in fields:
+            record[xpath] = _value(field_type, rnd)
+        records.append(record)
+    return records
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections aren't interesting
+        pass
+
+
+class MockOnaData(object):
+    """Canned OnaData API state
+
+    .. attribute:: forms
+
+        Number of forms served, with pks 1..forms
+
+    .. attribute:: submissions
+
+        Submissions per form
+
+    .. attribute:: export_bytes
+
+        Size of the CSV/XLS export served for each form
+
+    .. attribute:: export_seconds
+
+        How long the export job of the last form takes to build, earlier
+        forms' jobs finish proportionally sooner
+
+    .. attribute:: connect_delay
+
+        Seconds each new connection waits before its first response, to
+        stand in for the TCP and TLS handshakes of a remote server
+
+    .. attribute:: compress
+
+        Compress responses with the first encoding the client accepts out
+        of zstd, br, gzip and deflate, as a server behind nginx would
+
+    .. attribute:: bandwidth
+
+        Optional. Bytes per second each HTTP/1.1 response is written at, to
+        stand in for a slow link
+    """
+
+    def __init__(self, forms=3, submissions=10000, fields=20,
+                 export_bytes=10 * 1024 * 1024, export_seconds=2.0,
+                 connect_delay=0.0, compress=False, bandwidth=None, seed=0):
+        self.forms = {}
+        self.submissions = {}
+        self.data = {}
+        for pk in range(1, forms + 1):
+            form = make_form(pk, fields)
+            self.forms[pk] = form
+            self.submissions[pk] = make_submissions(form, submissions,
+                                                    seed + pk)
+            self.data[pk] = json.dumps(self.submissions[pk]).encode('utf-8')
+        line = b','.join([b'value'] * 20) + b'\n'
+        self.export = (line * (export_bytes // len(line) + 1))[:export_bytes]
+        self.export_seconds = export_seconds
+        self.jobs = {}
+        self.uploaded_bytes = 0
+        self.connections = 0
+        self.connect_delay = connect_delay
+        self.compress = compress
+        self.bandwidth = bandwidth
+        self._compressed = {}
+        self._lock = threading.Lock()
+
+    def export_job(self, pk, data_format, job_uuid=None):
+        """Start or poll an export job, returns the API response"""
+        if job_uuid is None:
+            job_uuid = uuid.uuid4().hex
+            self.jobs[job_uuid] = time.time() + \
+                self.export_seconds * pk / len(self.forms)
+            return {'job_uuid': job_uuid, 'job_status': 'PENDING'}
+        if job_uuid not in self.jobs:
+            return {'job_status': 'FAILURE', 'error': 'Unknown job'}
+        if time.time() < self.jobs[job_uuid]:
+            return {'job_status': 'STARTED'}
+        return {'job_status': 'SUCCESS',
+                'export_url': '/api/v1/export/{}.{}'.format(pk, data_format)}
+
+    def catalog(self, base_url):
+        return {'forms': base_url + '/api/v1/forms',
+                'data': base_url + '/api/v1/data',
+                'stats': base_url + '/api/v1/stats',
+                'user': base_url + '/api/v1/user'}
+
+    def respond(self, method, target, headers, body_length=0):
+        """Route a request, returns `(status, headers, body)`
+
+        .. attribute:: headers
+
+            The request headers, keyed by lower case name
+        """
+        status, response_headers, body = self.route(method, target, headers,
+                                                    body_length)
+        if self.compress and status == 200 and len(body) > 1024:
+            accepted = [e.split(';')[0].strip() for e in headers.get(
+                'accept-encoding', '').split(',')]
+            for encoding in ENCODERS:
+                if encoding in accepted:
+                    body = self.compressed(encoding, body)
+                    response_headers = dict(
+                        response_headers, **{'Content-Encoding': encoding})
+                    break
+        return status, response_headers, body
+
+    def compressed(self, encoding, body):
+        """Compress a body, remembering the result for the canned
+        responses which are served over and over"""
+        key = (encoding, body)
+        with self._lock:
+            if key not in self._compressed:
+                if len(self._compressed) > 64:
+                    self._compressed.clear()
+                self._compressed[key] = ENCODERS[encoding](body)
+            return self._compressed[key]
+
+    def route(self, method, target, headers, body_length=0):
+        if method == 'POST':
+            with self._lock:
+                self.uploaded_bytes += body_length
+            return json_response({'formid': len(self.forms) + 1}, 201)
+        if method == 'DELETE':
+            return 204, {}, b''
+
+        url = urlparse(target)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        path = url.path.rstrip('/')
+        base = 'http://{}'.format(headers.get('host', headers.get(
+            ':authority')))
+
+        if path == '/api/v1':
+            return json_response(self.catalog(base))
+        if path == '/api/v1/user':
+            return json_response({'api_token': API_TOKEN})
+        if path == '/api/v1/forms':
+            return json_response([
+                {'formid': pk, 'id_string': form['id_string']}
+                for pk, form in sorted(self.forms.items())])
+
+        match = re.match(r'^/api/v1/forms/(\d+)(/form\.json|'
+                         r'\.(csv|xls))?$', path)
+        if match and int(match.group(1)) in self.forms:
+            pk = int(match.group(1))
+            if match.group(2) == '/form.json':
+                return json_response(self.forms[pk], headers={'ETag': '"v1"'})
+            if match.group(3):
+                return self.export_response(headers)
+            return json_response({'formid': pk, 'num_of_submissions': len(
+                self.submissions[pk])})
+
+        match = re.match(r'^/api/v1/forms/(\d+)/export_async$', path)
+        if match and int(match.group(1)) in self.forms:
+            return json_response(self.export_job(
+                int(match.group(1)), params.get('format'),
+                params.get('job_uuid')))
+
+        if re.match(r'^/api/v1/export/\d+\.\w+$', path):
+            return self.export_response(headers)
+
+        match = re.match(r'^/api/v1/data/(\d+)(?:/(\d+))?$', path)
+        if match and int(match.group(1)) in self.forms:
+            pk = int(match.group(1))
+            if match.group(2):
+                records = self.submissions[pk]
+                index = int(match.group(2)) - 1
+                if not 0 <= index < len(records):
+                    return json_response({'detail': 'Not found.'}, 404)
+                return json_response(records[index])
+            if 'page' not in params:
+                return json_response(self.data[pk])
+            page = int(params['page'])
+            page_size = int(params.get('page_size', 1000))
+            records = self.submissions[pk][
+                (page - 1) * page_size:page * page_size]
+            if not records and page > 1:
+                return json_response({'detail': 'Invalid page.'}, 404)
+            return json_response(records)
+
+        match = re.match(r'^/api/v1/stats/(\d+)$', path)
+        if match:
+            return json_response({'group0/q1': {'mean': 50}})
+
+        if path == '/mock/connections':
+            return json_response({'connections': self.connections})
+
+        return json_response({'detail': 'Not found.'}, 404)
+
+    def export_response(self, headers):
+        range_header = headers.get('range')
+        if range_header:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            return 206, {'Content-Type': 'text/csv',
+                         'Content-Range': 'bytes {}-{}/{}'.format(
+                             start, len(self.export) - 1,
+                             len(self.export))}, self.export[start:]
+        return 200, {'Content-Type': 'text/csv'}, self.export
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def handler(self):
+        state = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                state.connected()
+                if state.connect_delay:
+                    time.sleep(state.connect_delay)
+                preface = self.connection.recv(
+                    len(H2_PREFACE), socket.MSG_PEEK | socket.MSG_WAITALL)
+                if preface == H2_PREFACE:
+                    return serve_h2(self.connection, state)
+                BaseHTTPRequestHandler.handle(self)
+
+            def dispatch(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                remaining = length
+                while remaining:
+                    remaining -= len(self.rfile.read(min(remaining,
+                                                         64 * 1024)))
+                status, headers, body = state.respond(
+                    self.command, self.path, dict(
+                        (k.lower(), v) for k, v in self.headers.items()),
+                    length)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not state.bandwidth:
+                    self.wfile.write(body)
+                    return
+                chunk_size = 16 * 1024
+                for i in range(0, len(body), chunk_size):
+                    self.wfile.write(body[i:i + chunk_size])
+                    time.sleep(chunk_size / float(state.bandwidth))
+
+            do_GET = do_POST = do_DELETE = dispatch
+
+        return Handler
+
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+ENCODERS = OrderedDict()
+try:
+    import zstandard
+    ENCODERS['zstd'] = zstandard.ZstdCompressor().compress
+except ImportError:
+    pass
+try:
+    import brotli
+    ENCODERS['br'] = lambda data: brotli.compress(data, quality=5)
+except ImportError:
+    pass
+ENCODERS['gzip'] = gzip_compress
+ENCODERS['deflate'] = zlib.compress
+
+
+def json_response(body, status=200, headers=None):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    return status, headers, body
+
+
+def serve_h2(sock, state):
+    """Answer HTTP/2 requests sent with prior knowledge (h2c) on a socket,
+    streams are multiplexed and their responses interleaved"""
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(
+        client_side=False, header_encoding='utf-8'))
+    conn.initiate_connection()
+    sock.sendall(conn.data_to_send())
+    requests = {}
+    bodies = OrderedDict()
+    while True:
+        data = sock.recv(65535)
+        if not data:
+            return
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                requests[event.stream_id] = [dict(event.headers), 0]
+            elif isinstance(event, h2.events.DataReceived):
+                requests[event.stream_id][1] += len(event.data)
+                conn.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                headers, length = requests.pop(event.stream_id)
+                status, response_headers, body = state.respond(
+                    headers[':method'], headers[':path'], headers, length)
+                conn.send_headers(event.stream_id, [
+                    (':status', str(status)),
+                    ('content-length', str(len(body)))] + [
+                        (k.lower(), v) for k, v in response_headers.items()])
+                bodies[event.stream_id] = body
+            elif isinstance(event, h2.events.StreamReset):
+                bodies.pop(event.stream_id, None)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                sock.sendall(conn.data_to_send())
+                return
+
+        # Send as much of every body as the flow control windows allow
+        for stream_id, body in list(bodies.items()):
+            while body:
+                size = min(len(body), conn.local_flow_control_window(
+                    stream_id), conn.max_outbound_frame_size)
+                if size <= 0:
+                    break
+                conn.send_data(stream_id, body[:size])
+                body = body[size:]
+            if body:
+                bodies[stream_id] = body
+            else:
+                conn.end_stream(stream_id)
+                del bodies[stream_id]
+        sock.sendall(conn.data_to_send())
+
+
+def serve(port=0, ready=None, **kwargs):
+    """Serve a `MockOnaData` forever, putting the bound port on `ready`"""
+    server = ThreadingHTTPServer(('127.0.0.1', port),
+                                 MockOnaData(**kwargs).handler())
+    if ready is not None:
+        ready.put(server.server_port)
+    server.serve_forever()
+
+
+class MockOnaServer(object):
+    """Runs the mock API in a child process so it neither competes for the
+    GIL nor shows up in memory measurements of the client
+
+    Example:
+    .. code-block:: python
+
+       with MockOnaServer(submissions=50000) as server:
+           client = Client(server.url, api_token=API_TOKEN)
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.process = None
+        self.url = None
+
+    def __enter__(self):
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve, args=(0, ready), kwargs=self.kwargs)
+        self.process.daemon = True
+        self.process.start()
+        self.url = 'http://127.0.0.1:{}'.format(ready.get(timeout=120))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--forms', type=int, default=3)
+    parser.add_argument('--submissions', type=int, default=10000)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--export-bytes', type=int,
+                        default=10 * 1024 * 1024)
+    parser.add_argument('--export-seconds', type=float, default=2.0)
+    parser.add_argument('--compress', action='store_true')
+    parser.add_argument('--bandwidth', type=int, default=None)
+    args = parser.parse_args()
+    serve(args.port, forms=args.forms, submissions=args.submissions,
+          fields=args.fields, export_bytes=args.export_bytes,
+          export_seconds=args.export_seconds, compress=args.compress,
+          bandwidth=args.bandwidth)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""Run the onapie benchmark suite against a local mock OnaData server
+
+Every scenario is repeated `--repeat` times and reported with throughput,
+latency percentiles and the peak memory traced while running it once more
+under tracemalloc. Results are written as JSON so runs can be compared:
+
+    python -m benchmarks.run --submissions 20000 --output baseline.json
+    python -m benchmarks.run --only data_get,forms_export
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_ona_schema import make_schema
+from benchmarks.mock_server import API_TOKEN, MockOnaServer
+from onapie.aggregate import LocalStats
+from onapie.client import Client
+from onapie.metrics import MetricsCollector, percentile
+from onapie.ona_schema import OnaForm
+from onapie.sync import IndexedSQLiteStore
+from onapie.utils import ConnectionRegistry
+
+
+class Scenario(object):
+    """A named benchmark, `func(context)` runs it once and returns the
+    number of `unit`s it processed"""
+
+    def __init__(self, name, func, unit):
+        self.name = name
+        self.func = func
+        self.unit = unit
+
+
+def client_startup(context):
+    client = Client(context['url'], api_token=API_TOKEN,
+                    registry=ConnectionRegistry())
+    client.conn.session.close()
+    return 1
+
+
+def client_first_call(context):
+    client = Client(context['url'], api_token=API_TOKEN,
+                    registry=ConnectionRegistry())
+    client.forms.get(1)
+    client.conn.session.close()
+    return 1
+
+
+def data_get(context):
+    return len(context['client'].data.get(1))
+
+
+def data_iter(context):
+    return sum(1 for _ in context['client'].data.iter(
+        1, page_size=context['page_size']))
+
+
+def data_iter_parallel(context):
+    if 'form' not in context:
+        context['form'] = OnaForm(context['client'].forms.get(1, 'json'))
+    return sum(1 for _ in context['client'].data.iter_parallel(
+        1, context['form'], context['page_size'], output='tuples'))
+
+
+def data_iter_flat(context):
+    if 'form' not in context:
+        context['form'] = OnaForm(context['client'].forms.get(1, 'json'))
+    form = context['form']
+    return sum(len(tables[form.name]) for tables in
+               context['client'].data.iter_parallel(
+                   1, form, context['page_size'], output='flat'))
+
+
+def forms_get(context):
+    context['client'].forms.get(1, 'json')
+    return 1
+
+
+def forms_export(context):
+    return len(context['client'].forms.export(1, 'csv'))
+
+
+def forms_export_to(context):
+    return context['client'].forms.export_to(
+        1, 'csv', os.path.join(context['tmp'], 'export.csv'))
+
+
+def forms_export_many(context):
+    client = context['client']
+    pks = [form['formid'] for form in client.forms.list()]
+    results = list(client.forms.export_many(
+        pks, 'csv', context['tmp'], poll_interval=0.25))
+    for result in results:
+        if result.error is not None:
+            raise result.error
+    return len(results)
+
+
+def store_find(context):
+    store = context.get('store')
+    if store is None:
+        client = context['client']
+        store = context['store'] = IndexedSQLiteStore(':memory:')
+        store.register(1, OnaForm(client.forms.get(1, 'json')),
+                       index=['group0/q1'])
+        store.refresh(client.data, 1, page_size=context['page_size'])
+    return len(store.find(1, {'group0/q1': {'$gt': 90}}))
+
+
+def stats_local(context):
+    stats = context.get('stats')
+    if stats is None:
+        client = context['client']
+        stats = context['stats'] = LocalStats(
+            OnaForm(client.forms.get(1, 'json')))
+        stats.refresh(client.data, 1, page_size=context['page_size'])
+        context['edits'] = list(client.data.iter(1, context['page_size']))[
+            :context['page_size']]
+    # Re-applying a page of edits invalidates the cached results
+    stats.upsert(1, context['edits'])
+    return len(stats.get()) + len(stats.group_by('group0/q4', 'group0/q1'))
+
+
+def data_bulk_tag(context):
+    result = context['client'].data.bulk_tag(1, range(1, 501), ['reviewed'])
+    return len(result.succeeded)
+
+
+def onaform_parse(context):
+    OnaForm(context['schema'])
+    return len(context['schema']['children'])
+
+
+def upload(context):
+    context['client'].forms.create(context['xls_path'])
+    return context['upload_bytes']
+
+
+SCENARIOS = [
+    Scenario('client_startup', client_startup, 'clients'),
+    Scenario('client_first_call', client_first_call, 'clients'),
+    Scenario('data_get', data_get, 'records'),
+    Scenario('data_iter', data_iter, 'records'),
+    Scenario('data_iter_parallel', data_iter_parallel, 'records'),
+    Scenario('data_iter_flat', data_iter_flat, 'records'),
+    Scenario('forms_get', forms_get, 'forms'),
+    Scenario('forms_export', forms_export, 'bytes'),
+    Scenario('forms_export_to', forms_export_to, 'bytes'),
+    Scenario('forms_export_many', forms_export_many, 'forms'),
+    Scenario('store_find', store_find, 'records'),
+    Scenario('stats_local', stats_local, 'results'),
+    Scenario('data_bulk_tag', data_bulk_tag, 'submissions'),
+    Scenario('onaform_parse', onaform_parse, 'top level fields'),
+    Scenario('upload', upload, 'bytes'),
+]
+
+
+def summarize(samples):
+    return {
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'max': max(samples),
+    }
+
+
+def run_scenario(scenario, context, repeat):
+    """Time `repeat` runs of a scenario, then trace one more for memory"""
+    metrics = context['metrics']
+    metrics.reset()
+    scenario.func(context)  # warm up connections and caches
+
+    latencies = []
+    units = 0
+    for _ in range(repeat):
+        start = time.time()
+        units += scenario.func(context)
+        latencies.append(time.time() - start)
+    requests = metrics.summary()
+
+    tracemalloc.start()
+    try:
+        scenario.func(context)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        'runs': repeat,
+        'unit': scenario.unit,
+        'units_per_run': units // repeat,
+        'throughput': units / total if total else None,
+        'latency_seconds': summarize(latencies),
+        'peak_memory_bytes': peak,
+        'requests': requests,
+    }
+
+
+def run(url, repeat=5, only=None, page_size=1000, upload_bytes=1024 * 1024,
+        schema_fields=3000):
+    tmp = tempfile.mkdtemp(prefix='onapie-bench-')
+    try:
+        xls_path = os.path.join(tmp, 'form.xls')
+        with open(xls_path, 'wb') as f:
+            f.write(os.urandom(upload_bytes))
+
+        metrics = MetricsCollector()
+        client = Client(url, api_token=API_TOKEN,
+                        registry=ConnectionRegistry(), hooks=[metrics])
+        context = {
+            'url': url, 'client': client, 'metrics': metrics, 'tmp': tmp,
+            'page_size': page_size, 'xls_path': xls_path,
+            'upload_bytes': upload_bytes,
+            'schema': make_schema(schema_fields),
+        }
+        results = {}
+        for scenario in SCENARIOS:
+            if only and scenario.name not in only:
+                continue
+            results[scenario.name] = run_scenario(scenario, context, repeat)
+        return results
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--forms', type=int, default=1)
+    parser.add_argument('--submissions', type=int, default=10000)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--export-bytes', type=int,
+                        default=10 * 1024 * 1024)
+    parser.add_argument('--export-seconds', type=float, default=2.0)
+    parser.add_argument('--upload-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--output', help='write JSON here, not stdout')
+    args = parser.parse_args()
+
+    config = dict(vars(args))
+    config.pop('output')
+    only = set(args.only.split(',')) if args.only else None
+    with MockOnaServer(forms=args.forms, submissions=args.submissions,
+                       fields=args.fields,
+                       export_bytes=args.export_bytes,
+                       export_seconds=args.export_seconds) as server:
+        results = run(server.url, args.repeat, only, args.page_size,
+                      args.upload_bytes)
+
+    report = json.dumps({
+        'config': config,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+"""Submission statistics computed locally
+
+`LocalStats` answers the same questions as `StatsManager.get` (mean,
+median, mode and range of numeric fields) plus grouped counts, grouped
+statistics and cross tabulations, from submissions held in memory instead
+of a request per call.
+
+Submissions are kept in the typed `Column` buffers of `onapie.columns`
+and each numeric field in a histogram of value counts which is adjusted as
+submissions are added, edited or deleted, so refreshed statistics cost a
+pass over the distinct values rather than over every submission. Counting
+runs over the buffers with `Counter`, `compress` and `map`, all of which
+iterate in C.
+"""
+import math
+import operator
+import threading
+
+from array import array
+from collections import Counter, OrderedDict
+from itertools import compress, repeat
+
+from onapie.columns import CATEGORY, DATE, DATETIME, FIELD_KINDS, FLOAT
+from onapie.columns import GEOPOINT_TYPES, INTEGER, OBJECT, Column
+from onapie.columns import value_fields
+from onapie.exceptions import ClientException
+from onapie.ona_schema import OnaSchemaNode
+
+
+MEAN = 'mean'
+MEDIAN = 'median'
+MODE = 'mode'
+RANGE = 'range'
+METHODS = (MEAN, MEDIAN, MODE, RANGE)
+NUMERIC_KINDS = (INTEGER, FLOAT)
+
+
+class Distribution(object):
+    """How often each distinct value of a field occurs"""
+    __slots__ = ('counts',)
+
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+
+    def update(self, counts):
+        self.counts.update(counts)
+
+    def subtract(self, counts):
+        self.counts.subtract(counts)
+        for value in [v for v, c in self.counts.items() if c <= 0]:
+            del self.counts[value]
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def mean(self):
+        total = len(self)
+        if not total:
+            return None
+        return sum(v * c for v, c in self.counts.items()) / float(total)
+
+    def median(self):
+        """The middle value, or the mean of the two middle values"""
+        total = len(self)
+        if not total:
+            return None
+        ranks = [(total - 1) // 2, total // 2]
+        middle = []
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            while ranks and ranks[0] < seen:
+                middle.append(value)
+                ranks.pop(0)
+            if not ranks:
+                break
+        return (middle[0] + middle[1]) / 2.0
+
+    def mode(self):
+        """The most common value, the smallest of them on a tie"""
+        if not self.counts:
+            return None
+        top = max(self.counts.values())
+        return min(v for v, c in self.counts.items() if c == top)
+
+    def min(self):
+        return min(self.counts) if self.counts else None
+
+    def max(self):
+        return max(self.counts) if self.counts else None
+
+    def range(self):
+        if not self.counts:
+            return None
+        return self.max() - self.min()
+
+    def stats(self):
+        return {MEAN: self.mean(), MEDIAN: self.median(), MODE: self.mode(),
+                'min': self.min(), 'max': self.max(), RANGE: self.range()}
+
+
+def _valid(column, start=0):
+    """Flags of the rows of a column from `start` holding a value"""
+    data = column.data[start:] if start else column.data
+    if column.kind == INTEGER:
+        return column.mask[start:] if start else column.mask
+    if column.kind in (FLOAT, DATE, DATETIME):
+        return map(operator.not_, map(math.isnan, data))
+    if column.kind == CATEGORY:
+        return map(operator.ge, data, repeat(0))
+    return map(operator.is_not, data, repeat(None))
+
+
+def _decode(column, key):
+    return column.categories[key] if column.kind == CATEGORY else key
+
+
+def _value(column, row):
+    """The value of one row of a column, None when missing"""
+    value = column.data[row]
+    if column.kind == INTEGER:
+        return value if column.mask[row] else None
+    if column.kind in (FLOAT, DATE, DATETIME):
+        return None if math.isnan(value) else value
+    if column.kind == CATEGORY:
+        return column.categories[value] if value >= 0 else None
+    return value
+
+
+class _StoreTee(object):
+    """Forwards a sync to a store while keeping `LocalStats` current"""
+
+    def __init__(self, store, stats):
+        self.store = store
+        self.stats = stats
+
+    def get_checkpoint(self, pk):
+        return self.store.get_checkpoint(pk)
+
+    def set_checkpoint(self, pk, value):
+        self.store.set_checkpoint(pk, value)
+
+    def upsert(self, pk, records):
+        records = list(records)
+        counts = self.store.upsert(pk, records)
+        self.stats.upsert(pk, records)
+        return counts
+
+    def delete(self, pk, data_ids):
+        data_ids = list(data_ids)
+        self.stats.delete(pk, data_ids)
+        return self.store.delete(pk, data_ids)
+
+
+class LocalStats(object):
+    """Statistics of a form's submissions kept up to date incrementally
+
+    Also a store for `DataManager.sync`, which keeps its checkpoint in
+    memory, so new, edited and deleted submissions can be pulled straight
+    into it. Results are cached until the submissions change.
+
+    Example:
+    .. code-block:: python
+
+       stats = LocalStats(OnaForm(client.forms.get(pk, 'json')))
+       stats.refresh(client.data, pk)
+       stats.get('mean')                    # {'household/age': 31.5, ...}
+       stats.group_by('district', 'household/age', 'median')
+       stats.crosstab('district', 'water_source')
+
+    .. attribute:: form
+
+        The `OnaForm` of the submissions. Fields in repeats, groups and
+        geopoints are left out
+
+    .. attribute:: fields
+
+        Optional. Only keep these xpaths, to save memory on wide forms
+    """
+
+    def __init__(self, form, fields=None):
+        self.columns = OrderedDict()
+        for field in value_fields(form):
+            xpath = field[OnaSchemaNode.XPATH]
+            field_type = field.get(OnaSchemaNode.TYPE)
+            if field_type in GEOPOINT_TYPES or \
+                    (fields is not None and xpath not in fields):
+                continue
+            kind = FIELD_KINDS.get(field_type, OBJECT)
+            choices = [choice[OnaSchemaNode.NAME] for choice in field.get(
+                OnaSchemaNode.CHILDREN, [])] if kind == CATEGORY else None
+            self.columns[xpath] = Column(xpath, kind, choices)
+
+        self.distributions = OrderedDict(
+            (xpath, Distribution()) for xpath, column in self.columns.items()
+            if column.kind in NUMERIC_KINDS)
+        self._rows = {}
+        self._live = array('b')
+        self._checkpoints = {}
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_store(cls, store, pk, form, fields=None):
+        """Load the submissions of a form already in a sync store"""
+        stats = cls(form, fields)
+        stats.upsert(pk, store.iter_records(pk))
+        return stats
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_checkpoint(self, pk):
+        return self._checkpoints.get(str(pk))
+
+    def set_checkpoint(self, pk, value):
+        self._checkpoints[str(pk)] = value
+
+    def refresh(self, data_manager, pk, store=None, **kwargs):
+        """Pull new, edited and deleted submissions with
+        `DataManager.sync`, into `store` as well when given"""
+        if store is not None:
+            return data_manager.sync(pk, _StoreTee(store, self), **kwargs)
+        return data_manager.sync(pk, self, **kwargs)
+
+    def _counts(self, column, start=0):
+        """Count the values of live rows from `start`, category codes for
+        categorical columns"""
+        data = column.data[start:] if start else column.data
+        live = self._live[start:] if start else self._live
+        return Counter(compress(data, map(operator.and_,
+                                          _valid(column, start), live)))
+
+    def upsert(self, pk, records):
+        """Add submissions, replacing earlier versions with the same `_id`
+
+        Returns a `(created, updated)` tuple of counts.
+        """
+        created = updated = 0
+        with self._lock:
+            start = len(self._live)
+            stale = []
+            for record in records:
+                data_id = record['_id']
+                row = self._rows.get(data_id)
+                if row is not None:
+                    self._live[row] = 0
+                    if row < start:
+                        stale.append(row)
+                        updated += 1
+                else:
+                    created += 1
+                self._rows[data_id] = len(self._live)
+                self._live.append(1)
+                for xpath, column in self.columns.items():
+                    column.append(record.get(xpath))
+
+            for xpath, distribution in self.distributions.items():
+                distribution.subtract(self._stale_counts(xpath, stale))
+                distribution.update(self._counts(self.columns[xpath], start))
+            self._cache.clear()
+        return created, updated
+
+    def _stale_counts(self, xpath, rows):
+        column = self.columns[xpath]
+        return Counter(value for value in (_value(column, row)
+                                           for row in rows)
+                       if value is not None)
+
+    def delete(self, pk, data_ids):
+        """Remove submissions by `_id`, returns the number removed"""
+        with self._lock:
+            rows = [self._rows.pop(data_id) for data_id in data_ids
+                    if data_id in self._rows]
+            for row in rows:
+                self._live[row] = 0
+            for xpath, distribution in self.distributions.items():
+                distribution.subtract(self._stale_counts(xpath, rows))
+            if rows:
+                self._cache.clear()
+        return len(rows)
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+            return self._cache[key]
+
+    def _column(self, xpath, numeric=False):
+        column = self.columns.get(xpath)
+        if column is None:
+            raise ClientException(u'{} is not a field of the form'.format(
+                xpath))
+        if numeric and column.kind not in NUMERIC_KINDS:
+            raise ClientException(u'{} is not a numeric field'.format(xpath))
+        return column
+
+    def get(self, method=None):
+        """Statistics of every numeric field, shaped like
+        `StatsManager.get`
+
+        Without a method each field maps to a dict of mean, median, mode,
+        min, max and range, otherwise straight to the method's value.
+        Fields without any values are left out.
+        """
+        if method is not None and method not in METHODS:
+            raise ClientException(
+                u'Invalid method:- {}. Options are {}'.format(
+                    method, u', '.join(METHODS)))
+
+        def compute():
+            return dict(
+                (xpath, distribution.stats() if method is None
+                 else getattr(distribution, method)())
+                for xpath, distribution in self.distributions.items()
+                if distribution.counts)
+        return self._cached(('get', method), compute)
+
+    def group_by(self, xpath, field=None, method=None):
+        """Count submissions by the values of `xpath`, like the server's
+        `/stats/submissions` endpoint
+
+        Returns a list of `{xpath: value, 'count': n}` dicts sorted by value.
+        Given a numeric `field` each dict also maps `field` to its
+        statistics within the group, all of them or those of `method`.
+        """
+        if method is not None and method not in METHODS:
+            raise ClientException(u'Invalid method:- {}'.format(method))
+
+        def compute():
+            column = self._column(xpath)
+            if field is None:
+                counts = self._counts(column)
+                return [{xpath: _decode(column, key), 'count': count}
+                        for key, count in sorted(counts.items())]
+
+            values = self._column(field, numeric=True)
+            pairs = self._pair_counts(column, values)
+            groups = OrderedDict()
+            for (key, value), count in sorted(pairs.items()):
+                groups.setdefault(key, Counter())[value] = count
+            result = []
+            for key, counts in groups.items():
+                distribution = Distribution(counts)
+                result.append({
+                    xpath: _decode(column, key), 'count': len(distribution),
+                    field: distribution.stats() if method is None
+                    else getattr(distribution, method)()})
+            return result
+        return self._cached(('group_by', xpath, field, method), compute)
+
+    def _pair_counts(self, first, second):
+        valid = map(operator.and_, map(operator.and_, _valid(first),
+                                       _valid(second)), self._live)
+        return Counter(compress(zip(first.data, second.data), valid))
+
+    def crosstab(self, row_xpath, column_xpath):
+        """Count submissions by the values of two fields
+
+        Returns `{row value: {column value: count}}` with the keys in sorted
+        order, leaving out submissions missing either value.
+        """
+        def compute():
+            rows = self._column(row_xpath)
+            columns = self._column(column_xpath)
+            table = OrderedDict()
+            for (row, column), count in sorted(
+                    self._pair_counts(rows, columns).items()):
+                table.setdefault(_decode(rows, row), OrderedDict())[
+                    _decode(columns, column)] = count
+            return table
+        return self._cached(('crosstab', row_xpath, column_xpath), compute)
@@ -0,0 +1,466 @@
+"""asyncio flavour of the client, requires the optional aiohttp dependency
+
+Example:
+.. code-block:: python
+
+   async with AsyncClient('https://api.ona.io', api_token='...') as client:
+       forms, data = await asyncio.gather(client.forms.list(),
+                                          client.data.get(form_pk))
+"""
+import asyncio
+import os
+import time
+
+import aiohttp
+
+from onapie.codec import get_codec
+from onapie.data import DataPaths
+from onapie.exceptions import ClientException
+from onapie.exports import EXPORT_FORMATS, ExportJob, poll_delay
+from onapie.stats import StatsPaths
+from onapie.utils import BatchResult, DEFAULT_WORKERS
+from onapie.utils import build_url, is_other_host, raise_for_status
+from onapie.xlsforms import XlsFormsPaths
+
+
+try:
+    from urllib.parse import urlparse  # NOQA
+except ImportError:
+    from urlparse import urlparse  # NOQA
+
+
+async def iter_concurrently(coro_fn, keys, max_concurrency=DEFAULT_WORKERS):
+    """Await `coro_fn(key)` for every key with bounded concurrency
+
+    Async counterpart of `onapie.utils.iter_concurrently`, yields a
+    `BatchResult` per key in completion order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(key):
+        async with semaphore:
+            try:
+                return BatchResult(key, await coro_fn(key), None)
+            except Exception as e:
+                return BatchResult(key, None, e)
+
+    for future in asyncio.as_completed([run(key) for key in keys]):
+        yield await future
+
+
+class AsyncResponse(object):
+    """A fully read response, quacks like the `requests` responses the
+    synchronous managers and exceptions work with"""
+
+    def __init__(self, status_code, reason, headers, content, encoding=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8')
+
+
+class AsyncConnection(object):
+    """asyncio counterpart of `onapie.utils.Connection`
+
+    .. attribute:: max_connections_per_host
+
+        Optional. Upper bound on concurrent requests to the API host, any
+        further requests wait for a free connection
+    """
+
+    def __init__(self, url, **kwargs):
+        self.url = urlparse(url)
+
+        if self.url.scheme not in ['http', 'https']:
+            raise ClientException(
+                u'{} protocol is not supported'.format(self.url.scheme))
+
+        self.headers = {}
+        self.timeout = kwargs.get('timeout', 20)
+        self.read_timeout = kwargs.get('read_timeout', 180)
+        self.verify = bool(kwargs.get('ssl_verify', True))
+        self.codec = get_codec(kwargs.get('json_backend', None))
+        self.max_connections_per_host = kwargs.get(
+            'max_connections_per_host', 100)
+        self.session = None
+
+        self.user_agent = kwargs.get('user_agent', 'python-json2xlsclient')
+        self.set_header('User-Agent', self.user_agent)
+
+    def set_header(self, key, value):
+        self.headers[key] = value
+
+    def _get_session(self):
+        # aiohttp sessions must be created from within the running loop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=0, limit_per_host=self.max_connections_per_host),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout,
+                                              sock_read=self.read_timeout))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, path, data=None, headers=None,
+                      **extras):
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        url = build_url(self.url, path)
+        if is_other_host(self.url, url):
+            request_headers.pop('Authorization', None)
+
+        async with self._get_session().request(
+                method, url, data=data,
+                headers=request_headers,
+                ssl=None if self.verify else False, **extras) as response:
+            content = await response.read()
+            self.last_response = AsyncResponse(
+                response.status, response.reason, response.headers, content,
+                response.charset)
+
+        return raise_for_status(self.last_response)
+
+    def decode_json(self, response):
+        """Decode the JSON body of a response straight from its bytes"""
+        return self.codec.loads(response.content)
+
+    async def get(self, path, headers=None, **extras):
+        return await self.request('GET', path, None, headers, **extras)
+
+    async def post(self, url_path, file_path=None, payload=None,
+                   headers=None, **extras):
+        return await self._request_with_body(
+            'POST', url_path, file_path, payload, headers, **extras)
+
+    async def put(self, url_path, file_path=None, payload=None, headers=None,
+                  **extras):
+        return await self._request_with_body(
+            'PUT', url_path, file_path, payload, headers, **extras)
+
+    async def patch(self, url_path, file_path=None, payload=None,
+                    headers=None, **extras):
+        return await self._request_with_body(
+            'PATCH', url_path, file_path, payload, headers, **extras)
+
+    async def delete(self, url_path, headers=None, **extras):
+        return await self.request('DELETE', url_path, None, headers,
+                                  **extras)
+
+    async def _request_with_body(self, method, url_path, file_path=None,
+                                 payload=None, headers=None, **extras):
+        if file_path is None:
+            return await self.request(method, url_path, payload, headers,
+                                      **extras)
+
+        with open(file_path, 'rb') as file_data:
+            form = aiohttp.FormData()
+            if isinstance(payload, dict):
+                for key, value in payload.items():
+                    form.add_field(key, value)
+            form.add_field('xls_file', file_data,
+                           filename=os.path.basename(file_path))
+            return await self.request(method, url_path, form, headers,
+                                      **extras)
+
+
+class AsyncXlsFormsManager(XlsFormsPaths):
+
+    async def create(self, xls_path=None, xls_url=None, owner=None):
+        """Uploads an XLSForm, see `XlsFormsManager.create`"""
+        if (xls_path is None) == (xls_url is None):
+            raise ClientException(u'You must provide a path or a url '
+                                  'for creation. The two args are '
+                                  'mutually exclusive!')
+
+        response = await self.conn.post(self.forms_ep, xls_path, xls_url)
+        return self.conn.decode_json(response)
+
+    async def list(self, owner=None):
+        """Returns a list of forms"""
+        response = await self.conn.get(self._list_path(owner))
+        return self.conn.decode_json(response)
+
+    async def get(self, pk, representation=None, *tag_args):
+        """Get Form Information or representation"""
+        response = await self.conn.get(
+            self._get_path(pk, representation, tag_args))
+
+        if representation and representation != 'json':
+            return response.text
+        else:
+            return self.conn.decode_json(response)
+
+    async def get_many(self, pks, representation=None,
+                       max_workers=DEFAULT_WORKERS):
+        """Get several forms concurrently, see `XlsFormsManager.get_many`"""
+        async for result in iter_concurrently(
+                lambda pk: self.get(pk, representation), pks, max_workers):
+            yield result
+
+    async def export(self, pk, data_format=None):
+        response = await self.conn.get(self._export_path(pk, data_format))
+        return response.text
+
+    async def start_export(self, pk, data_format, **options):
+        """Start an export job, see `XlsFormsManager.start_export`"""
+        if data_format not in EXPORT_FORMATS:
+            raise ClientException(
+                'Invalid export format:- {}. Options are {}'.format(
+                    data_format, ', '.join(EXPORT_FORMATS)))
+        response = await self.conn.get(self._export_async_path(
+            pk, dict(options, format=data_format)))
+        return ExportJob(pk, data_format).update(
+            self.conn.decode_json(response))
+
+    async def poll_export(self, job):
+        job.polls += 1
+        response = await self.conn.get(self._export_async_path(
+            job.pk, {'format': job.data_format, 'job_uuid': job.job_uuid}))
+        return job.update(self.conn.decode_json(response))
+
+    async def wait_export(self, job, timeout=None, poll_interval=1.0,
+                          max_poll_interval=30.0):
+        """Poll an export job until it's done without blocking the event
+        loop, see `XlsFormsManager.wait_export`"""
+        started = time.time()
+        while True:
+            self._check_export(job, started, timeout)
+            if job.succeeded:
+                return job
+            await asyncio.sleep(poll_delay(job.polls, poll_interval,
+                                           max_poll_interval))
+            await self.poll_export(job)
+
+    async def get_formdata(self, pk, export_format, timeout=None):
+        job = await self.wait_export(
+            await self.start_export(pk, export_format), timeout)
+        response = await self.conn.get(job.download_path(
+            self.conn.url.netloc))
+        return response.content
+
+    async def update(self, pk, uuid, description, owner, public,
+                     public_data):
+        """Update Form"""
+        form = ('uuid={}&description={}&owner={}'
+                '&public={}&public_data={}').format(uuid, description, owner,
+                                                    public, public_data)
+
+        response = await self.conn.put('{}/{}'.format(self.forms_ep, pk),
+                                       None, form)
+        return self.conn.decode_json(response)
+
+    async def patch(self, pk, **kwargs):
+        """Update Form Properties"""
+        args = '&'.join('{}={}'.format(key, value)
+                        for key, value in sorted(kwargs.items()))
+
+        response = await self.conn.patch('{}/{}'.format(self.forms_ep, pk),
+                                         None, args)
+        return self.conn.decode_json(response)
+
+    async def delete(self, pk):
+        """Deletes your form"""
+        resp = await self.conn.delete('{}/{}'.format(self.forms_ep, pk))
+        if resp.status_code != 204:
+            raise ClientException(
+                'Invalid api delete response: {}, {}'.format(
+                    resp.status_code, resp.reason))
+
+    async def get_tags(self, pk):
+        """Get list of Tags for a specific Form"""
+        response = await self.conn.get(
+            '{}/{}/labels'.format(self.forms_ep, pk))
+        return self.conn.decode_json(response)
+
+    async def set_tag(self, pk, *tag_args):
+        """Tag forms"""
+        response = await self.conn.post(
+            '{}/{}/labels'.format(self.forms_ep, pk),
+            payload={'tags': ','.join(tag_args)})
+        return self.conn.decode_json(response)
+
+    async def remove_tag(self, pk, tag):
+        """Removes a tag"""
+        response = await self.conn.delete(
+            '{}/{}/labels/{}'.format(self.forms_ep, pk, tag))
+        return self.conn.decode_json(response)
+
+    async def get_webformlink(self, pk):
+        response = await self.conn.get(
+            '{}/{}/enketo'.format(self.forms_ep, pk))
+        return self.conn.decode_json(response)
+
+    async def share(self, pk, username, role):
+        """Share a form with a specific user"""
+        payload = {'username': username}
+
+        if role in ['readonly', 'dataentry', 'editor', 'manager']:
+            payload['role'] = role
+
+        response = await self.conn.post(
+            '{}/{}/share'.format(self.forms_ep, pk), None, payload)
+        return self.conn.decode_json(response)
+
+    async def clone_to_user(self, pk, username):
+        """Clone a form to a specific user account"""
+        response = await self.conn.post(
+            '{}/{}/clone'.format(self.forms_ep, pk),
+            None, 'username={}'.format(username))
+        return self.conn.decode_json(response)
+
+
+class AsyncDataManager(DataPaths):
+
+    async def list_endpoints(self, owner=None):
+        """Returns a list of data endpoints"""
+        response = await self.conn.get(self._list_path(owner))
+        return self.conn.decode_json(response)
+
+    async def get(self, pk, dataid=None, *tag_args, **query_kwargs):
+        """Get submitted data for a given form"""
+        response = await self.conn.get(
+            self._get_path(pk, dataid, tag_args, query_kwargs))
+        return self.conn.decode_json(response)
+
+    async def get_many(self, pks, max_workers=DEFAULT_WORKERS,
+                       **query_kwargs):
+        """Get data for several forms concurrently, see
+        `DataManager.get_many`"""
+        async for result in iter_concurrently(
+                lambda pk: self.get(pk, None, **query_kwargs), pks,
+                max_workers):
+            yield result
+
+    async def iter(self, pk, page_size=1000, query=None, tags=None):
+        """Asynchronously iterate over submitted data one page at a time,
+        see `DataManager.iter`"""
+        page = 1
+        while True:
+            try:
+                response = await self.conn.get(
+                    self._page_path(pk, page, page_size, query, tags))
+            except ClientException as e:
+                if page > 1 and e.api_response is not None and \
+                        e.api_response.status_code == 404:
+                    return
+                raise
+
+            records = self.conn.decode_json(response)
+            for record in records:
+                yield record
+
+            if len(records) < page_size:
+                return
+            page += 1
+
+    async def delete_tag(self, pk, data_id, tag_name):
+        response = await self.conn.delete('{}/{}/{}/labels/{}'.format(
+            self.data_ep, pk, data_id, tag_name))
+        return self.conn.decode_json(response)
+
+    async def get_enketo_editlink(self, pk, dataid, return_url):
+        response = await self.conn.get(
+            '{}/{}/{}/enketo?return_url={}'.format(
+                self.data_ep, pk, dataid, return_url))
+        return self.conn.decode_json(response)
+
+
+class AsyncStatsManager(StatsPaths):
+
+    async def get(self, pk, method=None):
+        """Get submitted data for a given form"""
+        response = await self.conn.get(self._get_path(pk, method))
+        return self.conn.decode_json(response)
+
+    async def get_many(self, pks, method=None, max_workers=DEFAULT_WORKERS):
+        """Get stats for several forms concurrently, see
+        `StatsManager.get_many`"""
+        async for result in iter_concurrently(
+                lambda pk: self.get(pk, method), pks, max_workers):
+            yield result
+
+
+class AsyncClient(object):
+    """asyncio counterpart of `onapie.client.Client`
+
+    Authentication and the catalog fetch need the event loop, so they run
+    when the client is entered as an async context manager or when `open`
+    is awaited.
+    """
+
+    def __init__(self, api_addr, **kwargs):
+        self.api_addr = api_addr
+        self.username = kwargs.get('username', None)
+        self.password = kwargs.get('password', None)
+        self.api_token = kwargs.get('api_token', None)
+        self.api_entrypoint = kwargs.get('api_entrypoint', '/api/v1/')
+        auth_path = kwargs.get('auth_path', 'user')
+        self.auth_path = os.path.join(self.api_entrypoint, auth_path)
+        self.should_fetch_catalog = kwargs.get('fetch_catalog', True)
+        self.catalog = None
+
+        self.conn = AsyncConnection(self.api_addr, **kwargs)
+        self._set_managers()
+
+        if self.api_token is not None:
+            self.set_api_token(self.api_token)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        if all((self.username, self.password, not self.api_token)):
+            await self.authenticate(self.username, self.password)
+
+        if self.should_fetch_catalog:
+            await self.fetch_catalog()
+
+    async def close(self):
+        await self.conn.close()
+
+    async def fetch_catalog(self):
+        response = await self.conn.get(self.api_entrypoint)
+        self.catalog = self.conn.decode_json(response)
+        self._set_managers()
+
+    def endpoint(self, name):
+        """Path of the `forms`, `data` or `stats` endpoint, from the catalog
+        if there is one"""
+        url = (self.catalog or {}).get(name)
+        if url:
+            return urlparse(url).path
+        return os.path.join(self.api_entrypoint, name)
+
+    def _set_managers(self):
+        self.forms = AsyncXlsFormsManager(self.conn, self.endpoint('forms'))
+        self.data = AsyncDataManager(self.conn, self.endpoint('data'))
+        self.stats = AsyncStatsManager(self.conn, self.endpoint('stats'))
+
+    async def authenticate(self, username, password):
+        digest_auth = getattr(aiohttp, 'DigestAuthMiddleware', None)
+        if digest_auth is None:
+            raise ClientException(u'Username and password authentication '
+                                  'needs aiohttp>=3.12, use an api_token')
+
+        response = await self.conn.get(
+            self.auth_path, None,
+            middlewares=(digest_auth(username, password),))
+        self.api_token = self.conn.decode_json(response).get('api_token')
+        self.set_api_token(self.api_token)
+        return self.api_token
+
+    def set_api_token(self, api_token):
+        self.conn.set_header('Authorization', 'Token {}'.format(api_token))
@@ -0,0 +1,332 @@
+"""HTTP response caches for conditional GET requests
+
+A `Connection` created with a cache stores the body of every GET response
+that carries an ETag or Last-Modified header, revalidates it with
+If-None-Match / If-Modified-Since on the next request and serves the
+stored body when the server answers 304 Not Modified. Responses to
+requests sent with `auth`, such as the api_token fetched by
+`Client.authenticate`, are never stored.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from requests.structures import CaseInsensitiveDict
+
+
+class CacheEntry(object):
+    """A cached response body and the validators needed to revalidate it"""
+    __slots__ = ('status_code', 'reason', 'headers', 'encoding', 'content',
+                 'etag', 'last_modified', 'stored_at')
+
+    def __init__(self, status_code, reason, headers, encoding, content,
+                 stored_at=None):
+        self.status_code = status_code
+        self.reason = reason
+        # Header names are lower case over HTTP/2 and from httpx
+        self.headers = CaseInsensitiveDict(headers)
+        self.encoding = encoding
+        self.content = content
+        self.etag = self.headers.get('ETag')
+        self.last_modified = self.headers.get('Last-Modified')
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+    @classmethod
+    def from_response(cls, response):
+        """Build an entry from a `requests` response, None if it can't be
+        revalidated"""
+        headers = CaseInsensitiveDict(response.headers)
+        if 'ETag' not in headers and 'Last-Modified' not in headers:
+            return None
+
+        return cls(response.status_code, response.reason, headers,
+                   response.encoding, response.content)
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class BaseCache(object):
+    """Common bookkeeping for the cache backends
+
+    .. attribute:: ttl
+
+        Optional. Seconds after which an entry is dropped instead of
+        revalidated. None keeps entries until evicted for space
+
+    .. attribute:: max_entries
+
+        Optional. Least recently used entries are evicted past this count
+
+    .. attribute:: max_bytes
+
+        Optional. Least recently used entries are evicted once the cached
+        bodies exceed this size
+    """
+
+    def __init__(self, ttl=None, max_entries=1000, max_bytes=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    @property
+    def stats(self):
+        """Hit, miss and eviction counters"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def is_expired(self, entry):
+        return self.ttl is not None and \
+            time.time() - entry.stored_at > self.ttl
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(BaseCache):
+    """An in-process LRU cache"""
+
+    def __init__(self, ttl=None, max_entries=1000, max_bytes=None):
+        super(MemoryCache, self).__init__(ttl, max_entries, max_bytes)
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.is_expired(entry):
+                self._remove(key)
+                self.evictions += 1
+                return None
+            # Mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._size += len(entry.content)
+            while self._entries and (
+                    (self.max_entries is not None and
+                     len(self._entries) > self.max_entries) or
+                    (self.max_bytes is not None and
+                     self._size > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.content)
+
+
+class FileCache(BaseCache):
+    """An on-disk cache that survives restarts
+
+    Each entry is a `<hash>.json` metadata file next to a `<hash>.body`
+    file. File modification times track recency for LRU eviction.
+    """
+
+    def __init__(self, directory, ttl=None, max_entries=1000,
+                 max_bytes=None):
+        super(FileCache, self).__init__(ttl, max_entries, max_bytes)
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key, ext):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{}.{}'.format(name, ext))
+
+    def get(self, key):
+        meta_path = self._path(key, 'json')
+        with self._lock:
+            try:
+                with open(meta_path) as meta_file:
+                    meta = json.load(meta_file)
+                with open(self._path(key, 'body'), 'rb') as body_file:
+                    content = body_file.read()
+            except (IOError, OSError, ValueError):
+                return None
+
+            entry = CacheEntry(meta['status_code'], meta['reason'],
+                               meta['headers'], meta['encoding'], content,
+                               meta['stored_at'])
+            if self.is_expired(entry):
+                self.delete(key)
+                self.evictions += 1
+                return None
+
+            os.utime(meta_path, None)
+            return entry
+
+    def set(self, key, entry):
+        meta = {'status_code': entry.status_code, 'reason': entry.reason,
+                'headers': dict(entry.headers), 'encoding': entry.encoding,
+                'stored_at': entry.stored_at}
+        with self._lock:
+            with open(self._path(key, 'body'), 'wb') as body_file:
+                body_file.write(entry.content)
+            with open(self._path(key, 'json'), 'w') as meta_file:
+                json.dump(meta, meta_file)
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            for ext in ['json', 'body']:
+                try:
+                    os.remove(self._path(key, ext))
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith(('.json', '.body')):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _evict(self):
+        entries = []
+        size = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            body_path = meta_path[:-len('json')] + 'body'
+            try:
+                body_size = os.path.getsize(body_path)
+                entries.append((os.path.getmtime(meta_path), meta_path,
+                                body_path, body_size))
+            except OSError:
+                continue
+            size += body_size
+
+        entries.sort()
+        while entries and (
+                (self.max_entries is not None and
+                 len(entries) > self.max_entries) or
+                (self.max_bytes is not None and size > self.max_bytes)):
+            _, meta_path, body_path, body_size = entries.pop(0)
+            for path in [meta_path, body_path]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            size -= body_size
+            self.evictions += 1
+
+
+class SessionFile(object):
+    """A small JSON file remembering the API catalog and token of each
+    client between runs, so a new process needn't ask the server again
+
+    The file may hold an api_token, it's only ever written readable by its
+    owner.
+
+    .. attribute:: path
+
+        Location of the file, created on the first write
+
+    .. attribute:: ttl
+
+        Seconds a stored session is used for before it's fetched again
+    """
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as session_file:
+                sessions = json.load(session_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        return sessions if isinstance(sessions, dict) else {}
+
+    def _dump(self, sessions):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as session_file:
+            json.dump(sessions, session_file)
+        os.rename(tmp_path, self.path)
+
+    def _is_fresh(self, session, now):
+        return session.get('stored_at', 0) + self.ttl >= now
+
+    def get(self, key):
+        """The values stored for `key`, None if missing or expired"""
+        with self._lock:
+            session = self._load().get(key)
+        if session is None or not self._is_fresh(session, time.time()):
+            return None
+        return session.get('values')
+
+    def set(self, key, **values):
+        """Merge `values` into the session stored for `key` and restart its
+        expiry"""
+        with self._lock:
+            now = time.time()
+            sessions = dict((k, s) for k, s in self._load().items()
+                            if self._is_fresh(s, now))
+            session = sessions.get(key, {})
+            session_values = session.get('values', {})
+            session_values.update(values)
+            sessions[key] = {'stored_at': now, 'values': session_values}
+            self._dump(sessions)
+
+    def delete(self, key):
+        with self._lock:
+            sessions = self._load()
+            if sessions.pop(key, None) is not None:
+                self._dump(sessions)
@@ -1,9 +1,12 @@
-import json
+import logging
 import os
+import threading
+from onapie.cache import SessionFile
+from onapie.exceptions import ApiException, ClientException
 from onapie.xlsforms import XlsFormsManager
 from onapie.data import DataManager
 from onapie.stats import StatsManager
-from onapie.utils import ConnectionSingleton
+from onapie.utils import connections
 from requests.auth import HTTPDigestAuth
 
 
@@ -13,44 +16,215 @@ except ImportError:
     from urlparse import urlparse  # NOQA
 
 
+logger = logging.getLogger(__name__)
+
+
 class Client(object):
+    """Entry point to the OnaData API
+
+    Nothing is requested when the client is created. The api_token is
+    fetched with digest authentication and the catalog resolved the first
+    time `forms`, `data` or `stats` is used.
+
+    .. attribute:: lazy
+
+        Optional. False authenticates and fetches the catalog straight away
+
+    .. attribute:: fetch_catalog
+
+        Optional. False skips the catalog and uses the well known
+        `<api_entrypoint>forms|data|stats` endpoints
+
+    .. attribute:: session_file
+
+        Optional. Path of a file remembering the catalog and api_token
+        between runs, see `onapie.cache.SessionFile`
+
+    .. attribute:: session_ttl
+
+        Optional. Seconds the remembered catalog and api_token are used for
+
+    A remembered api_token the server rejects with a 401 is forgotten and
+    a new one fetched with the username and password, the request that
+    failed raises but the following ones use the new api_token.
+    """
 
     def __init__(self, api_addr, **kwargs):
         self.api_addr = api_addr
-        username = kwargs.get('username', None)
-        password = kwargs.get('password', None)
+        self.username = kwargs.get('username', None)
+        self.password = kwargs.get('password', None)
         self.api_token = kwargs.get('api_token', None)
         self.api_entrypoint = kwargs.get('api_entrypoint', '/api/v1/')
         auth_path = kwargs.get('auth_path', 'user')
         self.auth_path = os.path.join(self.api_entrypoint, auth_path)
+        self.should_fetch_catalog = kwargs.get('fetch_catalog', True)
+        self.catalog = None
+
+        session_file = kwargs.get('session_file', None)
+        if session_file is not None and \
+                not isinstance(session_file, SessionFile):
+            session_file = SessionFile(
+                session_file, kwargs.get('session_ttl', 24 * 3600))
+        self.session_file = session_file
+        # Keyed by username only, a password hash would be on disk. The
+        # api_token remembered for an old password is replaced on a 401
+        self.session_key = u'{} {}'.format(api_addr, self.username or u'')
+        self._remembered_token = False
+
+        if self.api_token is not None:
+            credentials = self.api_token
+        elif self.username is not None:
+            credentials = (self.username, self.password)
+        else:
+            credentials = None
+        self._registry = kwargs.get('registry', connections)
+        self._kwargs = kwargs
+        self._credentials = credentials
+        self.conn = self._registry.get(self.api_addr, credentials, **kwargs)
 
-        self.conn = ConnectionSingleton(self.api_addr, **kwargs)
+        self._forms = self._data = self._stats = None
+        self._lock = threading.RLock()
 
-        if all((username, password, not self.api_token)):
-            self.authenticate(username, password)
-        elif self.api_token is not None:
+        if self.api_token is not None:
             self.set_api_token(self.api_token)
 
-        if kwargs.get('fetch_catalog', True):
-            self.fetch_catalog()
+        if not kwargs.get('lazy', True):
+            self.login()
+            if self.should_fetch_catalog:
+                self.fetch_catalog()
 
-    def fetch_catalog(self):
-        self.catalog = json.loads(self.conn.get(self.api_entrypoint).text)
+    @property
+    def forms(self):
+        if self._forms is None:
+            endpoint = self.endpoint('forms')
+            self._forms = XlsFormsManager(self.conn, endpoint)
+        return self._forms
+
+    @property
+    def data(self):
+        if self._data is None:
+            endpoint = self.endpoint('data')
+            self._data = DataManager(self.conn, endpoint)
+        return self._data
+
+    @property
+    def stats(self):
+        if self._stats is None:
+            endpoint = self.endpoint('stats')
+            self._stats = StatsManager(self.conn, endpoint)
+        return self._stats
+
+    def _session(self):
+        if self.session_file is None:
+            return {}
+        return self.session_file.get(self.session_key) or {}
+
+    def _remember(self, **values):
+        if self.session_file is not None:
+            self.session_file.set(self.session_key, **values)
+
+    def login(self):
+        """Get an api_token for the username and password unless there is
+        one already, from the client or the session file"""
+        with self._lock:
+            if self.api_token is not None or \
+                    not all((self.username, self.password)):
+                return self.api_token
+
+            api_token = self._session().get('api_token')
+            if api_token is not None:
+                self.api_token = api_token
+                self.set_api_token(api_token)
+                self._remembered_token = True
+                self.conn.add_hook(self._check_token)
+                return api_token
 
-        self.forms = XlsFormsManager(
-            self.conn, urlparse(self.catalog.get('forms')).path)
-        self.data = DataManager(
-            self.conn, urlparse(self.catalog.get('data')).path)
-        self.stats = StatsManager(
-            self.conn, urlparse(self.catalog.get('stats')).path)
+            return self.authenticate(self.username, self.password)
+
+    def endpoint(self, name):
+        """Path of the `forms`, `data` or `stats` endpoint, from the catalog
+        if there is one"""
+        with self._lock:
+            self.login()
+            if self.catalog is None and self.should_fetch_catalog:
+                self.catalog = self._session().get('catalog')
+                if self.catalog is None:
+                    try:
+                        self.fetch_catalog()
+                    except (ClientException, ApiException) as e:
+                        logger.warning(u'Using the default endpoints, the '
+                                       u'catalog is unavailable: %s', e)
+                        self.should_fetch_catalog = False
+
+            url = (self.catalog or {}).get(name)
+            if url:
+                return urlparse(url).path
+            return os.path.join(self.api_entrypoint, name)
+
+    def fetch_catalog(self):
+        self.catalog = self.conn.decode_json(
+            self.conn.get(self.api_entrypoint))
+        self._remember(catalog=self.catalog)
+        self._forms = self._data = self._stats = None
+        return self.catalog
 
     def authenticate(self, username, password):
-        self.api_token = json.loads(
+        self.api_token = self.conn.decode_json(
             self.conn.get(self.auth_path, None,
                           auth=HTTPDigestAuth(
-                              username, password)).text).get('api_token')
+                              username, password))).get('api_token')
         self.set_api_token(self.api_token)
+        self._remember(api_token=self.api_token)
         return self.api_token
 
+    def _check_token(self, event):
+        """Request hook watching a remembered api_token, removed once a
+        request shows it works and replacing it if it's rejected"""
+        if event.status is None or urlparse(event.url).path == self.auth_path:
+            return
+        with self._lock:
+            if not self._remembered_token:
+                return
+            current = self.conn.headers.get('Authorization')
+            replaced = current != 'Token {}'.format(self.api_token)
+            rejected = event.status == 401
+            if not (replaced or rejected or 200 <= event.status < 400):
+                return
+            self._remembered_token = False
+            self.conn.remove_hook(self._check_token)
+            if replaced:
+                # Another client on the connection got a new one already
+                self.api_token = current.split(' ', 1)[-1]
+            elif rejected:
+                logger.info(u'The remembered api_token was rejected, '
+                            u'authenticating again')
+                self.session_file.delete(self.session_key)
+                self.authenticate(self.username, self.password)
+
     def set_api_token(self, api_token):
-        self.conn.set_header('Authorization', 'Token {}'.format(api_token))
+        """Send `api_token` with every request
+
+        The api_token of the client's username and password, or the one it
+        was created with, is set on its connection. Any other api_token
+        would reach clients sharing that connection, so the client moves to
+        the registry's connection for the new api_token, taking its hooks
+        and headers along.
+        """
+        with self._lock:
+            if not isinstance(self._credentials, tuple) and \
+                    self._credentials != api_token:
+                self._switch_connection(api_token)
+            self.conn.set_header('Authorization',
+                                 'Token {}'.format(api_token))
+
+    def _switch_connection(self, api_token):
+        conn = self._registry.get(self.api_addr, api_token, **self._kwargs)
+        for hook in self.conn.hooks:
+            if hook not in conn.hooks:
+                conn.add_hook(hook)
+        for key, value in self.conn.headers.items():
+            if key != 'Authorization':
+                conn.set_header(key, value)
+        self.conn = conn
+        self._credentials = api_token
+        self._forms = self._data = self._stats = None
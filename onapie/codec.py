@@ -0,0 +1,82 @@
+"""JSON (de)serialization behind one interface
+
+Decoding uses the fastest installed backend, orjson, then ujson, falling
+back to the standard library. Backends take the raw response bytes so
+bodies aren't decoded to text first. Encoding always goes through the
+standard library so the JSON sent in query strings and bodies is the same
+whichever backend is installed.
+"""
+import json
+
+try:
+    import orjson  # NOQA
+except ImportError:
+    orjson = None
+
+try:
+    import ujson  # NOQA
+except ImportError:
+    ujson = None
+
+
+def _stdlib_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _ujson_loads(data):
+    # Only recent ujson releases take bytes
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return ujson.loads(data)
+
+
+class JsonCodec(object):
+    """A named JSON backend
+
+    .. attribute:: loads
+
+        Decode JSON from bytes or text. Invalid JSON raises `ValueError`
+    """
+
+    def __init__(self, name, loads):
+        self.name = name
+        self.loads = loads
+
+    def dumps(self, obj, **kwargs):
+        return json.dumps(obj, **kwargs)
+
+    def __repr__(self):
+        return u'JsonCodec({})'.format(self.name)
+
+
+CODECS = {'json': JsonCodec('json', _stdlib_loads)}
+if ujson is not None:
+    CODECS['ujson'] = JsonCodec('ujson', _ujson_loads)
+if orjson is not None:
+    CODECS['orjson'] = JsonCodec('orjson', orjson.loads)
+
+PREFERENCE = ('orjson', 'ujson', 'json')
+
+
+def get_codec(name=None):
+    """Return the named codec, or the fastest one installed for None"""
+    if name is None:
+        name = next(n for n in PREFERENCE if n in CODECS)
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(u'JSON backend {} is not installed, available: '
+                         u'{}'.format(name, u', '.join(sorted(CODECS))))
+
+
+default = get_codec()
+
+
+def loads(data):
+    return default.loads(data)
+
+
+def dumps(obj, **kwargs):
+    return default.dumps(obj, **kwargs)
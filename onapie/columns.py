@@ -0,0 +1,306 @@
+"""Typed columnar buffers for form submissions
+
+Submissions are appended one at a time into compact `array` buffers picked
+from the field types of the form's `OnaForm` schema, so large datasets can
+be streamed into memory without keeping a dict per record. Columns convert
+to NumPy arrays or a pandas DataFrame when those are installed.
+"""
+import math
+import re
+
+from array import array
+from calendar import timegm
+
+from onapie.ona_schema import OnaSchemaNode
+
+
+INTEGER = 'integer'
+FLOAT = 'float'
+DATE = 'date'
+DATETIME = 'datetime'
+CATEGORY = 'category'
+OBJECT = 'object'
+
+FIELD_KINDS = {
+    'integer': INTEGER,
+    'decimal': FLOAT,
+    'date': DATE,
+    'today': DATE,
+    'datetime': DATETIME,
+    'start': DATETIME,
+    'end': DATETIME,
+    'select one': CATEGORY,
+    'select_one': CATEGORY,
+}
+GEOPOINT_TYPES = ('geopoint',)
+GEOPOINT_PARTS = ('latitude', 'longitude', 'altitude', 'precision')
+GROUP_TYPES = ('group',)
+SKIPPED_TYPES = ('repeat', 'note')
+META_FIELDS = (('_id', INTEGER), ('_submission_time', DATETIME))
+
+DEFAULT_BATCH_SIZE = 10000
+
+_ISO_DATETIME = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?'
+    r'\s*(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 date or datetime into UTC seconds since the epoch
+
+    Returns None for values that can't be parsed.
+    """
+    match = _ISO_DATETIME.match(value.strip())
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second, fraction, tz = match.groups()
+    seconds = timegm((int(year), int(month), int(day), int(hour or 0),
+                      int(minute or 0), int(second or 0)))
+    if fraction:
+        seconds += float('0.{}'.format(fraction))
+    if tz and tz != 'Z':
+        sign = -1 if tz[0] == '-' else 1
+        tz = tz[1:].replace(':', '')
+        seconds -= sign * (int(tz[:2]) * 3600 + int(tz[2:]) * 60)
+
+    return seconds
+
+
+class Column(object):
+    """A typed column of values
+
+    Integers are stored in an `array('q')` alongside a validity `mask`,
+    decimals, dates and datetimes in an `array('d')` with NaN for missing
+    values (dates and datetimes as UTC seconds since the epoch), categorical
+    values as `array('i')` codes into `categories` with -1 for missing, and
+    anything else in a plain list.
+    """
+    __slots__ = ('name', 'kind', 'data', 'mask', 'categories', '_codes')
+
+    def __init__(self, name, kind, categories=None):
+        self.name = name
+        self.kind = kind
+        self.mask = None
+        self.categories = None
+        if kind == INTEGER:
+            self.data = array('q')
+            self.mask = array('b')
+        elif kind in (FLOAT, DATE, DATETIME):
+            self.data = array('d')
+        elif kind == CATEGORY:
+            self.data = array('i')
+            self.categories = list(categories or [])
+            self._codes = dict((c, i) for i, c in enumerate(self.categories))
+        else:
+            self.data = []
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        kind = self.kind
+        if kind == INTEGER:
+            try:
+                self.data.append(int(value))
+                self.mask.append(1)
+            except (TypeError, ValueError, OverflowError):
+                self.data.append(0)
+                self.mask.append(0)
+        elif kind == FLOAT:
+            try:
+                self.data.append(float(value))
+            except (TypeError, ValueError):
+                self.data.append(float('nan'))
+        elif kind in (DATE, DATETIME):
+            seconds = None
+            if hasattr(value, 'strip'):
+                seconds = parse_timestamp(value)
+            self.data.append(float('nan') if seconds is None else seconds)
+        elif kind == CATEGORY:
+            if value is None or value == '':
+                self.data.append(-1)
+                return
+            code = self._codes.get(value)
+            if code is None:
+                code = self._codes[value] = len(self.categories)
+                self.categories.append(value)
+            self.data.append(code)
+        else:
+            self.data.append(value)
+
+    def to_list(self):
+        """Values as Python objects with None for missing values"""
+        if self.kind == INTEGER:
+            return [v if m else None for v, m in zip(self.data, self.mask)]
+        if self.kind in (FLOAT, DATE, DATETIME):
+            return [None if math.isnan(v) else v for v in self.data]
+        if self.kind == CATEGORY:
+            return [self.categories[c] if c >= 0 else None
+                    for c in self.data]
+        return list(self.data)
+
+    def to_numpy(self):
+        """Values as a NumPy array, requires numpy
+
+        Integers come back as a masked array, dates and datetimes as
+        datetime64 and categories as their codes.
+        """
+        import numpy
+
+        if self.kind == INTEGER:
+            return numpy.ma.masked_array(
+                numpy.frombuffer(self.data, dtype='int64'),
+                mask=numpy.frombuffer(self.mask, dtype='int8') == 0)
+        if self.kind in (DATE, DATETIME):
+            values = numpy.frombuffer(self.data, dtype='float64')
+            stamps = numpy.full(len(values), numpy.datetime64('NaT'),
+                                dtype='datetime64[ms]')
+            valid = ~numpy.isnan(values)
+            stamps[valid] = (values[valid] * 1000).astype('int64')
+            if self.kind == DATE:
+                return stamps.astype('datetime64[D]')
+            return stamps
+        if self.kind == FLOAT:
+            return numpy.frombuffer(self.data, dtype='float64')
+        if self.kind == CATEGORY:
+            return numpy.frombuffer(self.data, dtype='int32')
+        return numpy.array(self.data, dtype=object)
+
+    def to_pandas(self):
+        """Values as a pandas Series with a matching dtype, requires
+        pandas"""
+        import numpy
+        import pandas
+
+        if self.kind == INTEGER:
+            values = pandas.arrays.IntegerArray(
+                numpy.frombuffer(self.data, dtype='int64').copy(),
+                numpy.frombuffer(self.mask, dtype='int8') == 0)
+        elif self.kind == CATEGORY:
+            values = pandas.Categorical.from_codes(
+                numpy.frombuffer(self.data, dtype='int32'), self.categories)
+        elif self.kind == DATETIME:
+            values = pandas.to_datetime(self.to_numpy()).tz_localize('UTC')
+        else:
+            values = self.to_numpy()
+
+        return pandas.Series(values, name=self.name)
+
+
+def value_fields(form):
+    """The fields of an `OnaForm` holding one value per submission, i.e.
+    every field but groups, repeats, notes and the fields inside repeats"""
+    for field in form.fields():
+        if field.get(OnaSchemaNode.TYPE) in GROUP_TYPES + SKIPPED_TYPES or \
+                form.repeat_of(field[OnaSchemaNode.XPATH]) is not None:
+            continue
+        yield field
+
+
+def _choices(field):
+    return [choice[OnaSchemaNode.NAME]
+            for choice in field.get(OnaSchemaNode.CHILDREN, [])]
+
+
+class ColumnBuilder(object):
+    """Accumulates submissions of a form into typed `Column`s
+
+    .. attribute:: form
+
+        The `OnaForm` the submissions belong to. Fields nested in repeats
+        are left out as they hold a list of values per submission.
+    """
+
+    def __init__(self, form, include_meta=True):
+        self._layout = []
+        if include_meta:
+            for name, kind in META_FIELDS:
+                self._layout.append((name, kind, None, None))
+
+        for field in value_fields(form):
+            xpath = field[OnaSchemaNode.XPATH]
+            field_type = field.get(OnaSchemaNode.TYPE)
+            if field_type in GEOPOINT_TYPES:
+                self._layout.append((xpath, 'geopoint', None, None))
+            else:
+                kind = FIELD_KINDS.get(field_type, OBJECT)
+                choices = _choices(field) if kind == CATEGORY else None
+                self._layout.append((xpath, kind, field_type, choices))
+        self._reset()
+
+    def xpaths(self):
+        """The submission fields read into columns"""
+        return [xpath for xpath, _, _, _ in self._layout]
+
+    def _reset(self):
+        self.columns = {}
+        self._appenders = []
+        for xpath, kind, _, choices in self._layout:
+            if kind == 'geopoint':
+                parents, _, name = xpath.rpartition('/')
+                prefix = '{}/_{}_'.format(parents, name) if parents else \
+                    '_{}_'.format(name)
+                parts = [Column(prefix + part, FLOAT)
+                         for part in GEOPOINT_PARTS]
+                for part in parts:
+                    self.columns[part.name] = part
+                self._appenders.append((xpath, self._geopoint_appender(
+                    parts)))
+            else:
+                column = self.columns[xpath] = Column(xpath, kind, choices)
+                self._appenders.append((xpath, column.append))
+
+    @staticmethod
+    def _geopoint_appender(parts):
+        def append(value):
+            values = value.split() if hasattr(value, 'split') else []
+            for i, part in enumerate(parts):
+                part.append(values[i] if i < len(values) else None)
+        return append
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def append(self, record):
+        get = record.get
+        for xpath, append in self._appenders:
+            append(get(xpath))
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def flush(self):
+        """Return the accumulated columns and start a new batch"""
+        columns = self.columns
+        self._reset()
+        return columns
+
+    def to_frame(self):
+        """Return the accumulated columns as a pandas DataFrame"""
+        import pandas
+
+        return pandas.DataFrame(dict(
+            (name, column.to_pandas())
+            for name, column in self.flush().items()))
+
+
+def to_columns(form, records):
+    """Build a dict of typed `Column`s keyed by xpath from submissions"""
+    builder = ColumnBuilder(form)
+    builder.extend(records)
+    return builder.flush()
+
+
+def iter_column_batches(form, records, batch_size=DEFAULT_BATCH_SIZE):
+    """Consume submissions lazily, yielding a dict of columns every
+    `batch_size` records"""
+    builder = ColumnBuilder(form)
+    for record in records:
+        builder.append(record)
+        if len(builder) >= batch_size:
+            yield builder.flush()
+    if len(builder):
+        yield builder.flush()
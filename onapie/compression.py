@@ -0,0 +1,58 @@
+"""Response compression negotiation
+
+Submission JSON and CSV exports compress well, so `Connection` asks for
+compressed responses with an Accept-Encoding header built here. Only
+encodings the transport can decompress are offered: gzip and deflate
+always, brotli and zstd when their libraries are installed
+(`pip install onapie[compression]`) and the transport supports them.
+Transports decompress as the body is read, so streamed responses are
+decoded chunk by chunk and never held in memory whole.
+"""
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+BROTLI = 'br'
+ZSTD = 'zstd'
+
+# Most compact first
+PREFERENCE = (ZSTD, BROTLI, GZIP, DEFLATE)
+IDENTITY = 'identity'
+
+
+def accept_encoding(encodings):
+    """Build an Accept-Encoding header value preferring `encodings` in the
+    order given, 'identity' for none"""
+    if not encodings:
+        return IDENTITY
+    values = []
+    for i, encoding in enumerate(encodings):
+        quality = max(10 - i, 1) / 10.0
+        values.append(encoding if i == 0 else u'{};q={:.1f}'.format(
+            encoding, quality))
+    return u', '.join(values)
+
+
+def negotiate(compression, supported):
+    """The encodings to offer, in order of preference
+
+    .. attribute:: compression
+
+        None for every encoding in `PREFERENCE`, False for none, or a name
+        or sequence of names in order of preference
+
+    .. attribute:: supported
+
+        Encodings the transport is able to decompress
+    """
+    if compression is None:
+        compression = PREFERENCE
+    elif compression is False:
+        compression = ()
+    elif isinstance(compression, str):
+        compression = (compression,)
+
+    unknown = [e for e in compression if e not in PREFERENCE]
+    if unknown:
+        raise ValueError(u'Unknown content encodings {}, options are '
+                         u'{}'.format(u', '.join(unknown),
+                                      u', '.join(PREFERENCE)))
+    return tuple(e for e in compression if e in supported)
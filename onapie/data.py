@@ -1,12 +1,72 @@
-import json
+from onapie.columns import ColumnBuilder
+from onapie import codec
+from onapie import pipeline
+from onapie.exceptions import ClientException
+from onapie.flatten import Flattener
+from onapie.query import DataQuery
+from onapie.utils import DEFAULT_WORKERS, iter_concurrently, run_bulk
+from onapie.utils import unique
 
 
-class DataManager(object):
+try:
+    from urllib.parse import urlencode  # NOQA
+except ImportError:
+    from urllib import urlencode  # NOQA
+
+
+DEFAULT_PAGE_SIZE = 1000
+
+
+class DataPaths(object):
+    """Endpoints and request paths shared by the sync and async data
+    managers"""
 
     def __init__(self, conn, api_entrypoint):
         self.conn = conn
         self.data_ep = api_entrypoint
 
+    def _list_path(self, owner=None):
+        query = self.data_ep
+
+        if owner is not None:
+            query = '{}?owner={}'.format(query, owner)
+
+        return query
+
+    def _get_path(self, pk, dataid=None, tag_args=(), query_kwargs=None):
+        path = '{}/{}'.format(self.data_ep, pk)
+        if dataid is not None:
+            path = '{}/{}'.format(path, dataid)
+        elif query_kwargs:
+            path = '{}?{}'.format(path, urlencode(
+                [('query', codec.dumps(query_kwargs))]))
+        elif any(tag_args):
+            path = '{}?{}'.format(path, urlencode(
+                [('tags', ','.join(u'{}'.format(t) for t in tag_args))]))
+
+        return path
+
+    def _page_path(self, pk, page=None, page_size=None, query=None,
+                   tags=None):
+        params = []
+        if isinstance(query, DataQuery):
+            params.extend(query.params())
+        elif query:
+            params.append(('query', codec.dumps(query)))
+        if tags:
+            params.append(('tags', ','.join(tags)))
+        if page is not None:
+            params.extend([('page', page), ('page_size', page_size)])
+
+        path = '{}/{}'.format(self.data_ep, pk)
+        if params:
+            path = '{}?{}'.format(path, urlencode(params))
+
+        return path
+
+
+class DataManager(DataPaths):
+
     def list_endpoints(self, owner=None):
         """Returns a list of data endpoints
 
@@ -15,34 +75,294 @@ class DataManager(object):
             Optional. Get endpoints by owner username
             Pass 'public to get public endpoints'
         """
-        query = self.data_ep
-
-        if owner is not None:
-            query = '{}?owner={}'.format(query, owner)
-
-        return json.loads(self.conn.get(query).text)
+        return self.conn.decode_json(self.conn.get(self._list_path(owner)))
 
     def get(self, pk, dataid=None, *tag_args, **query_kwargs):
         """Get submitted data for a given form"""
-        path = '{}/{}'.format(self.data_ep, pk)
-        if dataid is not None:
-            path = '{}/{}'.format(path, dataid)
-        elif any(query_kwargs):
-            path = '{}?query={}'.format(path, json.dumps(query_kwargs))
-        elif any(tag_args):
-            tags = tag_args[0]
-            for tag in tag_args[1:]:
-                tags = '{},{}'.format(tags, tag)
-            path = '{}?tags={}'.format(path, tags)
+        return self.conn.decode_json(
+            self.conn.get(self._get_path(pk, dataid, tag_args,
+                                         query_kwargs)))
+
+    def get_many(self, pks, max_workers=DEFAULT_WORKERS, **query_kwargs):
+        """Get submitted data for several forms concurrently
+
+        Yields a `BatchResult(pk, data, error)` for every pk as soon as its
+        request completes. A failed request sets `error` instead of
+        aborting the batch.
+
+        .. attribute:: max_workers
+
+            Optional. Maximum number of requests in flight
+        """
+        return iter_concurrently(
+            lambda pk: self.get(pk, None, **query_kwargs), pks, max_workers)
+
+    def query(self, pk, data_query):
+        """Get the submissions matching a `onapie.query.DataQuery`
+
+        Only the projected fields of matching submissions are transferred.
+        Field names are validated against the query's form before anything
+        is sent.
+        """
+        return self.conn.decode_json(
+            self.conn.get(self._page_path(pk, query=data_query)))
+
+    def iter(self, pk, page_size=DEFAULT_PAGE_SIZE, query=None, tags=None):
+        """Iterate over submitted data for a given form one page at a time
+
+        Each page is decoded as it streams in so only the submission being
+        yielded is held in memory, this is the preferred way of walking forms
+        with a large number of submissions.
+
+        .. attribute:: page_size
+
+            Optional. Number of submissions to request per page. Pass None
+            to stream all submissions from a single request
+
+        .. attribute:: query
+
+            Optional. A dict of filters, same as the keyword args to `get`,
+            or a `onapie.query.DataQuery`. A query with a limit is fetched
+            in a single request
+
+        .. attribute:: tags
+
+            Optional. A list of tags, same as the positional args to `get`
+        """
+        if isinstance(query, DataQuery) and query.limit is not None:
+            page_size = None
+
+        if page_size is None:
+            path = self._page_path(pk, None, None, query, tags)
+            for record in self.conn.iter_json(path):
+                yield record
+            return
+
+        page = 1
+        while True:
+            page_path = self._page_path(pk, page, page_size, query, tags)
+            try:
+                records = self.conn.iter_json(page_path)
+            except ClientException as e:
+                # The API answers with a 404 once we page past the last
+                # submission
+                if page > 1 and e.api_response is not None and \
+                        e.api_response.status_code == 404:
+                    return
+                raise
+
+            count = 0
+            for record in records:
+                count += 1
+                yield record
+
+            if count < page_size:
+                return
+            page += 1
+
+    def iter_parallel(self, pk, form=None, page_size=DEFAULT_PAGE_SIZE,
+                      query=None, tags=None, output=pipeline.RECORDS,
+                      processes=None, prefetch=None):
+        """Iterate over submitted data, decoding pages on a process pool
+
+        Pages are downloaded one after another on a thread while earlier
+        ones are decoded and laid out by worker processes, so fetching and
+        parsing overlap and parsing uses every core. Results come back in
+        order.
+
+        .. attribute:: form
+
+            The `OnaForm` for `pk`, needed for the `tuples`, `columns` and
+            `flat` outputs. Unless `query` is a `onapie.query.DataQuery`
+            only the fields that make it into the output are then requested
+
+        .. attribute:: output
+
+            Optional. `records` yields submission dicts, `tuples` yields a
+            tuple of values per submission in `ColumnBuilder(form).xpaths()`
+            order, `columns` yields a dict of typed `Column`s per page and
+            `flat` yields the `onapie.flatten.Flattener` tables of each page,
+            with repeats in tables of their own
+
+        .. attribute:: processes
 
-        return json.loads(self.conn.get(path).text)
+            Optional. Number of worker processes, defaults to the CPU count
+
+        .. attribute:: prefetch
+
+            Optional. Most pages fetched or parsed ahead of the consumer,
+            defaults to twice `processes`
+        """
+        if output not in pipeline.OUTPUTS:
+            raise ClientException(
+                u'Invalid output:- {}. Options are {}'.format(
+                    output, u', '.join(pipeline.OUTPUTS)))
+        if output != pipeline.RECORDS and form is None:
+            raise ClientException(u'The {} output needs a form'.format(output))
+        if not page_size or page_size < 1:
+            raise ClientException(
+                u'Invalid page_size:- {}. Pages are needed to fetch in '
+                u'parallel'.format(page_size))
+
+        if form is not None and not isinstance(query, DataQuery):
+            xpaths = Flattener(form).xpaths() if output == pipeline.FLAT \
+                else ColumnBuilder(form).xpaths()
+            query = DataQuery(form).where(query).fields(*xpaths)
+
+        def fetch(page):
+            try:
+                return self.conn.get(self._page_path(
+                    pk, page, page_size, query, tags)).content
+            except ClientException as e:
+                # Past the last page
+                if page > 1 and e.api_response is not None and \
+                        e.api_response.status_code == 404:
+                    return None
+                raise
+
+        # Plain JSON pickles smaller than the parsed nodes
+        schema = codec.loads(codec.dumps(form)) if form is not None else None
+        batches = pipeline.iter_pipelined(
+            fetch, pipeline.PARSERS[output], page_size, processes, prefetch,
+            schema, self.conn.codec.name)
+        if output in (pipeline.COLUMNS, pipeline.FLAT):
+            return batches
+        return (record for batch in batches for record in batch)
+
+    def get_frame(self, pk, form, page_size=DEFAULT_PAGE_SIZE, query=None,
+                  tags=None):
+        """Get submitted data for a given form as a pandas DataFrame
+
+        Submissions are streamed into typed column buffers chosen from the
+        field types of `form`, so integers, decimals, dates, select one
+        categoricals and geopoints get proper dtypes. Requires pandas.
+
+        Unless `query` is a `onapie.query.DataQuery` only the fields that
+        make it into columns are requested.
+
+        .. attribute:: form
+
+            The `OnaForm` for `pk`, e.g.
+            `OnaForm(client.forms.get(pk, 'json'))`
+        """
+        builder = ColumnBuilder(form)
+        if not isinstance(query, DataQuery):
+            query = DataQuery(form).where(query).fields(*builder.xpaths())
+        builder.extend(self.iter(pk, page_size, query, tags))
+        return builder.to_frame()
+
+    def sync(self, pk, store, field='_date_modified',
+             page_size=DEFAULT_PAGE_SIZE):
+        """Bring a local store up to date with a form's submissions
+
+        Only submissions whose `field` is at or past the checkpoint saved by
+        the previous sync are requested, so submissions sharing the
+        checkpoint's timestamp but landing after the previous sync aren't
+        missed. New and edited submissions are upserted and those carrying
+        a `_deleted_at` timestamp are removed. The new
+        checkpoint is saved once every page has been stored, so an
+        interrupted sync simply starts over from the previous one.
+
+        .. attribute:: store
+
+            A store such as `onapie.sync.SQLiteStore`
+
+        .. attribute:: field
+
+            Optional. A monotonically increasing field to use as the high
+            water mark, e.g. `_date_modified` (catches edits) or `_id`
+
+        Returns a dict with counts of `created`, `updated` and `deleted`
+        submissions and the new `checkpoint`. Submissions at the previous
+        checkpoint that were already stored are stored again but not
+        counted, so a sync without changes reports no updates.
+        """
+        checkpoint = since = store.get_checkpoint(pk)
+        query = None
+        if checkpoint is not None:
+            query = {field: {'$gte': checkpoint}}
+
+        summary = {'created': 0, 'updated': 0, 'deleted': 0}
+        batch_size = page_size or DEFAULT_PAGE_SIZE
+        batch = []
+        # Fetched again by `$gte`, only new ones among them count
+        refetched = []
+        deleted = []
+
+        def flush():
+            created, updated = store.upsert(pk, batch)
+            summary['created'] += created
+            summary['updated'] += updated
+            if refetched:
+                summary['created'] += store.upsert(pk, refetched)[0]
+            summary['deleted'] += store.delete(pk, deleted)
+            del batch[:]
+            del refetched[:]
+            del deleted[:]
+
+        for record in self.iter(pk, page_size, query):
+            value = record.get(field)
+            if value is not None and (checkpoint is None or
+                                      value > checkpoint):
+                checkpoint = value
+
+            if record.get('_deleted_at'):
+                deleted.append(record['_id'])
+            elif since is not None and value == since:
+                refetched.append(record)
+            else:
+                batch.append(record)
+            if len(batch) + len(refetched) + len(deleted) >= batch_size:
+                flush()
+
+        flush()
+        if checkpoint is not None:
+            store.set_checkpoint(pk, checkpoint)
+        summary['checkpoint'] = checkpoint
+
+        return summary
+
+    def set_tag(self, pk, data_id, *tag_args):
+        """Tag a submission"""
+        return self.conn.decode_json(self.conn.post(
+            '{}/{}/{}/labels'.format(self.data_ep, pk, data_id),
+            payload={'tags': ','.join(tag_args)}))
+
+    def bulk_tag(self, pk, data_ids, tags, max_workers=DEFAULT_WORKERS):
+        """Add `tags` to many submissions of a form
+
+        Every distinct submission is tagged with a single request, up to
+        `max_workers` at a time over the connection's keep-alive pool, and
+        failures don't stop the rest. Returns a `BulkResult` of the
+        submission ids tagged and the failures.
+
+        .. attribute:: max_workers
+
+            Optional. Maximum number of requests in flight, keep it within
+            the connection's `pool_maxsize` to reuse connections
+        """
+        tags = list(unique(tags))
+        return run_bulk(lambda data_id: self.set_tag(pk, data_id, *tags),
+                        data_ids, max_workers)
+
+    def bulk_untag(self, pk, data_ids, tags, max_workers=DEFAULT_WORKERS):
+        """Remove `tags` from many submissions of a form
+
+        The API removes one tag per request, so the keys of the returned
+        `BulkResult` are `(data_id, tag)` pairs.
+        """
+        tags = list(unique(tags))
+        pairs = ((data_id, tag) for data_id in unique(data_ids)
+                 for tag in tags)
+        return run_bulk(lambda pair: self.delete_tag(pk, *pair), pairs,
+                        max_workers)
 
     def delete_tag(self, pk, data_id, tag_name):
-        return json.loads(
+        return self.conn.decode_json(
             self.conn.delete('{}/{}/{}/labels/{}'.format(
-                self.data_ep, pk, data_id, tag_name)).text)
+                self.data_ep, pk, data_id, tag_name)))
 
     def get_enketo_editlink(self, pk, dataid, return_url):
-        return json.loads(self.conn.get(
+        return self.conn.decode_json(self.conn.get(
             '{}/{}/{}/enketo?return_url={}'.format(
-                self.data_ep, pk, dataid, return_url)).text)
+                self.data_ep, pk, dataid, return_url)))
@@ -0,0 +1,86 @@
+"""Asynchronous export jobs
+
+OnaData builds large exports in the background: a request to a form's
+`export_async` endpoint starts a job and returns its uuid, polling with the
+uuid reports the job status until the export is ready for download from
+`export_url`. Polls back off geometrically since big exports take minutes.
+"""
+try:
+    from urllib.parse import urlparse  # NOQA
+except ImportError:
+    from urlparse import urlparse  # NOQA
+
+
+PENDING = 'PENDING'
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+
+EXPORT_FORMATS = ('csv', 'csvzip', 'kml', 'osm', 'sav', 'savzip', 'xls',
+                  'xlsx', 'zip')
+
+
+class ExportJob(object):
+    """State of an export job on the server
+
+    .. attribute:: status
+
+        The job status reported by the server, `PENDING` until the first
+        response. Celery states such as 'STARTED' or 'PROGRESS' mean the
+        export is still being built
+
+    .. attribute:: polls
+
+        Number of status requests made since the job started
+    """
+
+    def __init__(self, pk, data_format, job_uuid=None, status=PENDING,
+                 export_url=None, error=None):
+        self.pk = pk
+        self.data_format = data_format
+        self.job_uuid = job_uuid
+        self.status = status
+        self.export_url = export_url
+        self.error = error
+        self.polls = 0
+
+    @property
+    def succeeded(self):
+        return self.status == SUCCESS and self.export_url is not None
+
+    @property
+    def failed(self):
+        return self.status == FAILURE
+
+    @property
+    def done(self):
+        return self.succeeded or self.failed
+
+    def update(self, response):
+        """Apply a decoded `export_async` response"""
+        self.job_uuid = response.get('job_uuid') or self.job_uuid
+        self.status = response.get('job_status') or self.status
+        self.export_url = response.get('export_url') or self.export_url
+        if self.failed:
+            self.error = response.get('error') or response.get('progress')
+        return self
+
+    def download_path(self, host=None):
+        """The path and query of `export_url` to fetch with the
+        connection the job was started on, or the whole url when it's on
+        another host than `host`, e.g. a storage bucket or CDN"""
+        url = urlparse(self.export_url)
+        if host is not None and url.netloc and url.netloc != host:
+            return self.export_url
+        if url.query:
+            return u'{}?{}'.format(url.path, url.query)
+        return url.path
+
+    def __repr__(self):
+        return u'ExportJob({}, {}, {})'.format(self.pk, self.data_format,
+                                               self.status)
+
+
+def poll_delay(polls, interval=1.0, max_interval=30.0, growth=1.5):
+    """Seconds to wait before the next status request of a job already
+    polled `polls` times"""
+    return min(max_interval, interval * growth ** polls)
@@ -0,0 +1,180 @@
+"""Flatten nested submissions into a table per repeat
+
+Submissions come back keyed by xpath, except that each repeat holds a list
+of dicts, one per repetition, keyed by the xpaths of the fields inside it
+and possibly holding further repeats. `Flattener` compiles the form's
+`OnaForm` schema once into an extraction plan, the xpaths read into each
+table, so applying it to a batch of submissions is a `map` of `dict.get`
+per row rather than a walk of the form per submission.
+
+Every submission becomes a row of the root table, named after the form,
+and every repetition a row of its repeat's table, named by the repeat's
+xpath. Repeat rows start with these keys:
+
+- `_id`, the submission the row belongs to
+- `_index`, the row's number, counting from 1 within its submission
+- `_parent_index`, the `_index` of the enclosing repetition when the
+  repeat is nested in another, None directly under the root
+
+so `(_id, _index)` identifies a row of a repeat table and `(_id,
+_parent_index)` the row of its parent table it belongs to.
+"""
+from collections import OrderedDict, namedtuple
+
+from onapie.columns import DEFAULT_BATCH_SIZE, GROUP_TYPES, META_FIELDS
+from onapie.ona_schema import OnaSchemaNode
+
+
+ID = '_id'
+INDEX = '_index'
+PARENT_INDEX = '_parent_index'
+REPEAT_KEYS = (ID, INDEX, PARENT_INDEX)
+VALUELESS_TYPES = GROUP_TYPES + ('note',)
+
+# The xpaths read into a table and the repeats nested directly in it, as
+# `(xpath, plan)` pairs
+_Plan = namedtuple('_Plan', ['table', 'xpaths', 'repeats'])
+
+
+class Flattener(object):
+    """Lays out submissions of a form as rows of a table per repeat
+
+    Example:
+    .. code-block:: python
+
+       flattener = Flattener(OnaForm(client.forms.get(pk, 'json')))
+       tables = flattener.flatten(client.data.get(pk))
+       tables['household/members']     # [(_id, _index, None, name, ...)]
+       flattener.columns['household/members']  # ('_id', '_index', ...)
+
+    .. attribute:: form
+
+        The `OnaForm` the submissions belong to
+
+    .. attribute:: fields
+
+        Optional. Only keep these xpaths, repeats left without any fields
+        or nested repeats are dropped
+
+    .. attribute:: include_meta
+
+        Optional. Start root rows with `_submission_time` after `_id`
+    """
+
+    def __init__(self, form, fields=None, include_meta=True):
+        # Bypass __getitem__, OnaForm overrides it to look up fields
+        self.name = dict.__getitem__(form, OnaSchemaNode.NAME)
+        self.columns = OrderedDict()
+        meta = [name for name, _ in META_FIELDS if name != ID] \
+            if include_meta else []
+        self._plan = self._compile(
+            self.name, dict.__getitem__(form, OnaSchemaNode.CHILDREN),
+            [ID] + meta,
+            set(fields) if fields is not None else None)
+
+    def _compile(self, table, children, xpaths, fields):
+        """Plan the table of the form or a repeat, returns None when
+        there's nothing to read into it"""
+        self.columns[table] = None
+        repeats = []
+        for field in self._leaves(children):
+            xpath = field[OnaSchemaNode.XPATH]
+            if field.get(OnaSchemaNode.TYPE) == OnaSchemaNode.REPEAT:
+                plan = self._compile(xpath, field[OnaSchemaNode.CHILDREN],
+                                     [], fields)
+                if plan is not None:
+                    repeats.append((xpath, plan))
+            elif fields is None or xpath in fields:
+                xpaths.append(xpath)
+
+        if not xpaths and not repeats and table != self.name:
+            del self.columns[table]
+            return None
+        keys = REPEAT_KEYS if table != self.name else ()
+        self.columns[table] = keys + tuple(xpaths)
+        return _Plan(table, tuple(xpaths), tuple(repeats))
+
+    @classmethod
+    def _leaves(cls, children):
+        """The fields and repeats under a form or repeat, looking through
+        groups"""
+        for field in children:
+            field_type = field.get(OnaSchemaNode.TYPE)
+            if field_type in GROUP_TYPES:
+                for leaf in cls._leaves(field.get(OnaSchemaNode.CHILDREN,
+                                                  [])):
+                    yield leaf
+            elif field_type not in VALUELESS_TYPES:
+                yield field
+
+    @property
+    def tables(self):
+        """Table names, the root table first"""
+        return list(self.columns)
+
+    def xpaths(self):
+        """The submission fields read, repeats included"""
+        return list(self._plan.xpaths) + [
+            xpath for xpath, _ in self._plan.repeats]
+
+    def flatten(self, records):
+        """Lay out submissions as rows, returns a dict of row tuples lists
+        keyed by table name in `tables` order"""
+        tables = OrderedDict((table, []) for table in self.columns)
+        xpaths = self._plan.xpaths
+        repeats = self._plan.repeats
+        rows = tables[self.name]
+        append = rows.append
+        if not repeats:
+            for record in records:
+                append(tuple(map(record.get, xpaths)))
+            return tables
+
+        for record in records:
+            append(tuple(map(record.get, xpaths)))
+            self._flatten_repeats(record, record.get(ID), None, repeats,
+                                  tables, {})
+        return tables
+
+    @classmethod
+    def _flatten_repeats(cls, item, data_id, parent_index, repeats, tables,
+                         counters):
+        for xpath, plan in repeats:
+            repetitions = item.get(xpath)
+            if not repetitions:
+                continue
+            append = tables[plan.table].append
+            index = counters.get(plan.table, 0)
+            for repetition in repetitions:
+                index += 1
+                append((data_id, index, parent_index) +
+                       tuple(map(repetition.get, plan.xpaths)))
+                if plan.repeats:
+                    cls._flatten_repeats(repetition, data_id, index,
+                                         plan.repeats, tables, counters)
+            counters[plan.table] = index
+
+    def to_frames(self, tables):
+        """Flattened tables as pandas DataFrames keyed by table name,
+        requires pandas"""
+        import pandas
+
+        return OrderedDict(
+            (table, pandas.DataFrame.from_records(
+                rows, columns=list(self.columns[table])))
+            for table, rows in tables.items())
+
+
+def iter_flat_batches(form, records, batch_size=DEFAULT_BATCH_SIZE,
+                      **kwargs):
+    """Consume submissions lazily, yielding the flattened tables of every
+    `batch_size` submissions"""
+    flattener = Flattener(form, **kwargs)
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield flattener.flatten(batch)
+            batch = []
+    if batch:
+        yield flattener.flatten(batch)
@@ -0,0 +1,256 @@
+"""Request instrumentation
+
+Every request made through a `Connection` produces a `RequestEvent` that
+is passed to the connection's hooks once the response body has been read.
+`MetricsCollector` is a ready made hook keeping per endpoint latency
+histograms and percentiles, `DecodeProfiler` profiles JSON decoding.
+"""
+import bisect
+import cProfile
+import pstats
+import re
+import threading
+
+from collections import deque
+
+
+try:
+    from urllib.parse import urlparse, parse_qsl  # NOQA
+except ImportError:
+    from urlparse import urlparse, parse_qsl  # NOQA
+
+
+_ID_SEGMENT = re.compile(
+    r'^(\d+|[0-9a-f]{32}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-'
+    r'[0-9a-f]{12})$', re.IGNORECASE)
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, float('inf'))
+
+
+def path_template(path):
+    """Reduce a request path to its endpoint template
+
+    Numeric and uuid path segments become `{id}` and only the names of
+    query parameters are kept, e.g. `/api/v1/data/12?page=2` becomes
+    `/api/v1/data/{id}?page`.
+    """
+    parsed = urlparse(path)
+    segments = [u'{id}' if _ID_SEGMENT.match(segment) else segment
+                for segment in parsed.path.split('/')]
+    template = u'/'.join(segments)
+    names = sorted(set(name for name, _ in parse_qsl(
+        parsed.query, keep_blank_values=True)))
+    if names:
+        template = u'{}?{}'.format(template, u'&'.join(names))
+    return template
+
+
+class RequestEvent(object):
+    """What happened during a single request
+
+    .. attribute:: path
+
+        The endpoint template of the request path, see `path_template`
+
+    .. attribute:: bytes
+
+        Size of the response body after decompression
+
+    .. attribute:: wire_bytes
+
+        Size of the response body as transferred, before decompression.
+        None when the transport doesn't report it
+
+    .. attribute:: ttfb
+
+        Seconds until the response headers arrived
+
+    .. attribute:: elapsed
+
+        Seconds until the response body had been read
+
+    .. attribute:: retries
+
+        How many times the request was retried
+
+    .. attribute:: error
+
+        The exception raised while making the request, None on success
+    """
+    __slots__ = ('method', 'url', 'path', 'status', 'bytes', 'wire_bytes',
+                 'ttfb', 'elapsed', 'retries', 'error')
+
+    def __init__(self, method, url, path, status=None, bytes=0, ttfb=None,
+                 elapsed=None, retries=0, error=None, wire_bytes=None):
+        self.method = method
+        self.url = url
+        self.path = path
+        self.status = status
+        self.bytes = bytes
+        self.wire_bytes = wire_bytes
+        self.ttfb = ttfb
+        self.elapsed = elapsed
+        self.retries = retries
+        self.error = error
+
+    @property
+    def endpoint(self):
+        return u'{} {}'.format(self.method, self.path)
+
+    def __repr__(self):
+        return '<RequestEvent {} {} {}s>'.format(
+            self.endpoint, self.status, self.elapsed)
+
+
+def percentile(values, q):
+    """The q-th (0-100) percentile of values by linear interpolation"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * \
+        (position - lower)
+
+
+class EndpointStats(object):
+    """Counters, a latency histogram and recent latency samples for one
+    endpoint"""
+
+    def __init__(self, max_samples):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.retries = 0
+        self.total_elapsed = 0.0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self.elapsed = deque(maxlen=max_samples)
+        self.ttfb = deque(maxlen=max_samples)
+
+    def add(self, event):
+        self.count += 1
+        self.retries += event.retries
+        if event.error is not None or event.status is None or \
+                event.status >= 400:
+            self.errors += 1
+        self.bytes += event.bytes or 0
+        self.wire_bytes += event.bytes if event.wire_bytes is None \
+            else event.wire_bytes
+        if event.elapsed is not None:
+            self.total_elapsed += event.elapsed
+            self.elapsed.append(event.elapsed)
+            self.histogram[bisect.bisect_left(
+                LATENCY_BUCKETS, event.elapsed)] += 1
+        if event.ttfb is not None:
+            self.ttfb.append(event.ttfb)
+
+    def summary(self):
+        samples = list(self.elapsed)
+        ttfb = list(self.ttfb)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'wire_bytes': self.wire_bytes,
+            'compression_ratio': self.bytes / float(self.wire_bytes)
+            if self.wire_bytes else None,
+            'throughput': self.bytes / self.total_elapsed
+            if self.total_elapsed else None,
+            'elapsed': {
+                'mean': sum(samples) / len(samples) if samples else None,
+                'p50': percentile(samples, 50),
+                'p90': percentile(samples, 90),
+                'p99': percentile(samples, 99),
+                'max': max(samples) if samples else None,
+            },
+            'ttfb': {
+                'p50': percentile(ttfb, 50),
+                'p99': percentile(ttfb, 99),
+            },
+            'histogram': dict(
+                (str(bound), count)
+                for bound, count in zip(LATENCY_BUCKETS, self.histogram)),
+        }
+
+
+class MetricsCollector(object):
+    """A connection hook aggregating request metrics per endpoint
+
+    Example:
+    .. code-block:: python
+
+       metrics = MetricsCollector()
+       client.conn.add_hook(metrics)
+       ...
+       metrics.summary()['GET /api/v1/data/{id}']['elapsed']['p99']
+
+    .. attribute:: max_samples
+
+        Optional. Latency samples kept per endpoint for percentiles, the
+        histogram counts every request
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self._endpoints.get(event.endpoint)
+            if stats is None:
+                stats = self._endpoints[event.endpoint] = EndpointStats(
+                    self.max_samples)
+            stats.add(event)
+
+    def endpoints(self):
+        with self._lock:
+            return sorted(self._endpoints)
+
+    def summary(self):
+        """A dict of metrics keyed by `'<METHOD> <path template>'`"""
+        with self._lock:
+            return dict((endpoint, stats.summary())
+                        for endpoint, stats in self._endpoints.items())
+
+    def slowest(self, count=10, q=90):
+        """The endpoints with the highest q-th percentile latency"""
+        with self._lock:
+            ranked = [(percentile(list(stats.elapsed), q), endpoint)
+                      for endpoint, stats in self._endpoints.items()
+                      if stats.elapsed]
+        return [(endpoint, latency)
+                for latency, endpoint in sorted(ranked, reverse=True)[:count]]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+class DecodeProfiler(object):
+    """Runs JSON decoding under cProfile
+
+    Enable with `Connection(..., profile_decode=True)` and inspect
+    `conn.decode_profiler.stats()`. Profiled decodes are serialised, so
+    only use this while investigating.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def run(self, func, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            return self.profile.runcall(func, *args, **kwargs)
+
+    def stats(self, sort='cumulative'):
+        """A `pstats.Stats` of everything decoded so far"""
+        with self._lock:
+            return pstats.Stats(self.profile).sort_stats(sort)
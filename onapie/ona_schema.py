@@ -1,3 +1,6 @@
+from collections import OrderedDict
+
+
 class OnaSchemaNode(dict):
     """
     Initialised with form JSON dict. Represents a schema with child fields.
@@ -5,12 +8,16 @@ class OnaSchemaNode(dict):
     The JSON dict could be an entire form or just a single field. Implements
     easy field data accessor methods.
     """
+    __slots__ = ()
+
     ID_STRING = 'id_string'
     XPATH = 'xpath'
     CHILDREN = 'children'
     TYPE = 'type'
     NAME = 'name'
     LABEL = 'label'
+    GROUP = 'group'
+    REPEAT = 'repeat'
 
     def __init__(self, schema, parents=None):
         super(OnaSchemaNode, self).__init__(schema)
@@ -20,17 +27,31 @@ class OnaSchemaNode(dict):
             xpath += "{}"
         else:
             xpath += "/{}"
-        self[OnaSchemaNode.XPATH] = xpath.format(self[OnaSchemaNode.NAME])
+        # Bypass __getitem__, OnaForm overrides it to look up fields
+        dict.__setitem__(self, OnaSchemaNode.XPATH,
+                         xpath.format(schema[OnaSchemaNode.NAME]))
 
     def label(self, language=None):
         """
         Return the label for the specified language, or the default language
         if None
         """
-        return self.get(OnaSchemaNode.LABEL, self[OnaSchemaNode.NAME])
+        return dict.get(self, OnaSchemaNode.LABEL,
+                        dict.__getitem__(self, OnaSchemaNode.NAME))
+
+    def has_fields(self):
+        """
+        Whether the children of this node are fields, as in groups and
+        repeats, rather than the choices of a select question
+        """
+        return OnaSchemaNode.CHILDREN in self and \
+            not dict.get(self, OnaSchemaNode.TYPE, '').startswith('select')
 
     def __getattr__(self, item):
-        return self[item]
+        try:
+            return dict.__getitem__(self, item)
+        except KeyError:
+            raise AttributeError(item)
 
 
 class OnaForm(OnaSchemaNode):
@@ -38,6 +59,11 @@ class OnaForm(OnaSchemaNode):
     Subclass of a `OnaSchemaNode` that implements form specific functions
     e.g. default_language
 
+    Every field is parsed into exactly one `OnaSchemaNode`, the children of
+    the form and of its groups are replaced by those same nodes. Fields are
+    indexed by xpath, name and type when the form is built so lookups don't
+    walk the tree.
+
     Example:
     .. code-block:: python
 
@@ -45,37 +71,114 @@ class OnaForm(OnaSchemaNode):
 
        for c in form.children:
            c.label() -> data[c.xpath]
+
+       form['group/age'].type -> 'integer'
     """
-    _fields = {}
+    __slots__ = ('_fields', '_positions', '_by_name', '_by_type')
 
     def __init__(self, schema):
         super(OnaForm, self).__init__(schema)
         children = schema[OnaSchemaNode.CHILDREN]
         self._fields = OnaForm._parse_children(children, [])
+        dict.__setitem__(self, OnaSchemaNode.CHILDREN, [
+            self._fields[child[OnaSchemaNode.NAME]] for child in children])
+
+        self._positions = {}
+        self._by_name = {}
+        self._by_type = {}
+        for position, node in enumerate(self._fields.values()):
+            self._positions[dict.__getitem__(
+                node, OnaSchemaNode.XPATH)] = position
+            self._by_name.setdefault(
+                dict.__getitem__(node, OnaSchemaNode.NAME), []).append(node)
+            self._by_type.setdefault(
+                node.get(OnaSchemaNode.TYPE), []).append(node)
 
     @classmethod
     def _parse_children(cls, children, parents=None):
         """
-        Flatten the schema and make the fields accessible by xpath
+        Flatten the schema and make the fields accessible by xpath, in
+        document order
         """
         parents = parents or []
-        nodes = {}
+        nodes = OrderedDict()
+        cls._parse_into(nodes, children, parents)
+        return nodes
+
+    @classmethod
+    def _parse_into(cls, nodes, children, parents):
+        child_nodes = []
         for child in children:
             node = OnaSchemaNode(child, parents)
-            nodes[node[OnaSchemaNode.XPATH]] = OnaSchemaNode(
-                child, parents)
-            if OnaSchemaNode.CHILDREN in node:
-                # create a copy of the list
-                new_parents = parents[:]
-                new_parents.append(node.name)
-                child_nodes = cls._parse_children(
-                    node[OnaSchemaNode.CHILDREN], new_parents)
-                nodes.update(child_nodes)
+            nodes[dict.__getitem__(node, OnaSchemaNode.XPATH)] = node
+            if node.has_fields():
+                dict.__setitem__(node, OnaSchemaNode.CHILDREN, cls._parse_into(
+                    nodes, child[OnaSchemaNode.CHILDREN],
+                    parents + [child[OnaSchemaNode.NAME]]))
+            child_nodes.append(node)
 
-        return nodes
+        return child_nodes
 
     def __getitem__(self, xpath):
         """
         Return the field with the specified name
         """
         return self._fields[xpath]
+
+    def fields(self):
+        """
+        Return all fields, including groups and repeats, in document order
+        """
+        return list(self._fields.values())
+
+    def get_field(self, xpath, default=None):
+        return self._fields.get(xpath, default)
+
+    def has_field(self, xpath):
+        return xpath in self._fields
+
+    def fields_by_name(self, name):
+        """
+        Return the fields called `name`, in any group
+        """
+        return list(self._by_name.get(name, []))
+
+    def fields_by_type(self, *types):
+        """
+        Return the fields of any of the given types in document order
+        """
+        if len(types) == 1:
+            return list(self._by_type.get(types[0], []))
+        return sorted(
+            (node for field_type in set(types)
+             for node in self._by_type.get(field_type, [])),
+            key=lambda node: self._positions[node[OnaSchemaNode.XPATH]])
+
+    def group_of(self, xpath):
+        """
+        Return the group or repeat directly containing a field, None for top
+        level fields
+        """
+        parent = xpath.rpartition('/')[0]
+        return self._fields.get(parent) if parent else None
+
+    def ancestors(self, xpath):
+        """
+        Return the groups and repeats containing a field, innermost first
+        """
+        groups = []
+        group = self.group_of(xpath)
+        while group is not None:
+            groups.append(group)
+            group = self.group_of(group[OnaSchemaNode.XPATH])
+        return groups
+
+    def repeat_of(self, xpath):
+        """
+        Return the innermost repeat containing a field, None if it isn't in
+        a repeat
+        """
+        for group in self.ancestors(xpath):
+            if group.get(OnaSchemaNode.TYPE) == OnaSchemaNode.REPEAT:
+                return group
+        return None
@@ -0,0 +1,168 @@
+"""Overlap fetching pages of submissions with parsing them on every core
+
+Decoding JSON and laying submissions out against a form is CPU bound, so
+in a single process it's serialized by the GIL however fast pages arrive.
+Here raw page bytes are fetched on a thread and handed to a pool of worker
+processes which return compact records, columnar batches or flattened
+tables, in page order.
+"""
+import itertools
+import os
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from onapie import codec
+from onapie.columns import ColumnBuilder
+from onapie.flatten import Flattener
+from onapie.ona_schema import OnaForm
+
+
+RECORDS = 'records'
+TUPLES = 'tuples'
+COLUMNS = 'columns'
+FLAT = 'flat'
+OUTPUTS = (RECORDS, TUPLES, COLUMNS, FLAT)
+
+# Built once per worker process by `_init_worker`
+_codec = codec.default
+_builder = None
+_flattener = None
+
+
+def _init_worker(schema, json_backend=None):
+    global _codec, _builder, _flattener
+    _codec = codec.get_codec(json_backend)
+    if schema is None:
+        _builder = _flattener = None
+        return
+    form = OnaForm(schema)
+    _builder = ColumnBuilder(form)
+    _flattener = Flattener(form)
+
+
+def parse_records(content):
+    """Decode a page, returns `(count, records)`"""
+    records = _codec.loads(content)
+    return len(records), records
+
+
+def parse_tuples(content):
+    """Decode a page into tuples of the worker form's column xpaths,
+    returns `(count, tuples)`"""
+    records = _codec.loads(content)
+    xpaths = _builder.xpaths()
+    return len(records), [tuple(record.get(xpath) for xpath in xpaths)
+                          for record in records]
+
+
+def parse_columns(content):
+    """Decode a page into the worker form's typed columns, returns
+    `(count, columns)`"""
+    records = _codec.loads(content)
+    _builder.extend(records)
+    return len(records), _builder.flush()
+
+
+def parse_flat(content):
+    """Decode a page into the worker form's flattened tables, returns
+    `(count, tables)`"""
+    records = _codec.loads(content)
+    return len(records), _flattener.flatten(records)
+
+
+PARSERS = {RECORDS: parse_records, TUPLES: parse_tuples,
+           COLUMNS: parse_columns, FLAT: parse_flat}
+
+
+def _is_empty(content):
+    """Whether raw page bytes hold an empty JSON array"""
+    return content.strip() == b'[]'
+
+
+def _is_short(future, page_size):
+    """Whether a parsed page is known to be the last"""
+    return future.done() and future.exception() is None and \
+        future.result()[0] < page_size
+
+
+def cpu_count():
+    try:
+        return os.cpu_count() or 1
+    except AttributeError:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+
+def iter_pipelined(fetch, parse, page_size, processes=None, prefetch=None,
+                   schema=None, json_backend=None):
+    """Fetch pages on a thread and parse them on a process pool
+
+    Yields the parsed result of each page in page order. Up to `prefetch`
+    pages are fetched or parsed ahead of the consumer, which bounds memory,
+    and iteration stops after the first page shorter than `page_size`. No
+    more pages are fetched once an empty or short page turns up.
+
+    .. attribute:: fetch
+
+        `fetch(page)` returns the raw bytes of page `page`, counting from 1,
+        or None past the last page. Runs in this process
+
+    .. attribute:: page_size
+
+        Number of submissions per page, a positive integer
+
+    .. attribute:: parse
+
+        A module level function `parse(content)` returning `(count,
+        result)`, run in the worker processes
+
+    .. attribute:: schema
+
+        Optional. A form JSON dict each worker builds its `OnaForm` from,
+        once, for `parse_tuples`, `parse_columns` and `parse_flat`
+
+    .. attribute:: json_backend
+
+        Optional. Name of the `onapie.codec` backend the workers decode
+        pages with, the fastest installed one by default
+    """
+    if page_size is None or page_size < 1:
+        raise ValueError(
+            u'page_size must be a positive integer, got {!r}'.format(
+                page_size))
+    processes = processes or cpu_count()
+    window = prefetch or processes * 2
+    pages = itertools.count(1)
+    with ThreadPoolExecutor(1) as fetcher, \
+            ProcessPoolExecutor(processes, initializer=_init_worker,
+                                initargs=(schema, json_backend)) as parsers:
+        fetches = deque([fetcher.submit(fetch, next(pages))])
+        pending = deque()
+        exhausted = False
+        try:
+            while True:
+                # Keep parsers busy while the next page downloads, only
+                # block on a fetch when there's nothing to parse
+                while not exhausted and len(pending) < window and \
+                        (not pending or fetches[0].done()):
+                    content = fetches.popleft().result()
+                    if content is None or _is_empty(content):
+                        exhausted = True
+                        break
+                    pending.append(parsers.submit(parse, content))
+                    if any(_is_short(future, page_size)
+                           for future in pending):
+                        exhausted = True
+                        break
+                    fetches.append(fetcher.submit(fetch, next(pages)))
+
+                if not pending:
+                    return
+                count, result = pending.popleft().result()
+                yield result
+                if count < page_size:
+                    return
+        finally:
+            for future in itertools.chain(fetches, pending):
+                future.cancel()
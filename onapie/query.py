@@ -0,0 +1,153 @@
+"""Build data endpoint queries that are filtered and projected server side
+
+Example:
+.. code-block:: python
+
+   form = OnaForm(client.forms.get(pk, 'json'))
+   query = DataQuery(form).fields('_id', 'household/age') \\
+       .where({'household/age': {'$gte': 18}}) \\
+       .between('_submission_time', date(2015, 1, 1), date(2015, 2, 1)) \\
+       .sort('_submission_time', descending=True) \\
+       .slice(0, 500)
+   records = client.data.query(pk, query)
+"""
+
+from collections import OrderedDict
+from datetime import date
+
+from onapie import codec
+from onapie.exceptions import ClientException
+
+
+try:
+    from urllib.parse import urlencode  # NOQA
+except ImportError:
+    from urllib import urlencode  # NOQA
+
+
+def _json_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class DataQuery(object):
+    """Filters, projection, ordering and slicing for a form's submissions
+
+    Every method returns the query so calls can be chained. Field names are
+    checked against the xpaths of `form` when it's given, metadata fields
+    such as `_id` or `_submission_time` are always accepted.
+
+    .. attribute:: form
+
+        Optional. The `OnaForm` the query is for
+    """
+
+    def __init__(self, form=None):
+        self.form = form
+        self.query = {}
+        self.projection = []
+        self.ordering = []
+        self.tag_names = []
+        self.start = None
+        self.limit = None
+
+    def fields(self, *xpaths):
+        """Only return these fields of each submission"""
+        self.projection.extend(xpaths)
+        return self
+
+    def where(self, query=None, **kwargs):
+        """Add conditions in the API's mongo style query syntax, e.g.
+        `{'age': {'$gt': 18}}`. Keyword args suit fields outside groups"""
+        for xpath, condition in dict(query or {}, **kwargs).items():
+            existing = self.query.get(xpath)
+            if isinstance(existing, dict) and isinstance(condition, dict):
+                # Merge into a copy, the caller's condition dicts are left
+                # untouched
+                existing = dict(existing)
+                existing.update(condition)
+                self.query[xpath] = existing
+            else:
+                self.query[xpath] = condition
+        return self
+
+    def between(self, xpath='_submission_time', start=None, end=None):
+        """Only return submissions whose `xpath` falls between `start` and
+        `end`, inclusive. Dates and datetimes are sent in ISO 8601"""
+        condition = {}
+        if start is not None:
+            condition['$gte'] = _json_value(start)
+        if end is not None:
+            condition['$lte'] = _json_value(end)
+        return self.where({xpath: condition}) if condition else self
+
+    def sort(self, xpath, descending=False):
+        self.ordering.append((xpath, -1 if descending else 1))
+        return self
+
+    def slice(self, start=None, limit=None):
+        """Skip `start` submissions and return at most `limit`"""
+        self.start = start
+        self.limit = limit
+        return self
+
+    def tags(self, *tags):
+        self.tag_names.extend(tags)
+        return self
+
+    def xpaths(self):
+        """Every field name the query refers to"""
+        names = list(self.projection)
+        names.extend(xpath for xpath, _ in self.ordering)
+        names.extend(self._query_xpaths(self.query))
+        return names
+
+    @classmethod
+    def _query_xpaths(cls, query):
+        """Field names in a query, the keys of a field's condition are
+        operators but those of `$or` and friends hold whole queries"""
+        if isinstance(query, list):
+            for item in query:
+                for xpath in cls._query_xpaths(item):
+                    yield xpath
+        elif isinstance(query, dict):
+            for key, value in query.items():
+                if not key.startswith('$'):
+                    yield key
+                else:
+                    for xpath in cls._query_xpaths(value):
+                        yield xpath
+
+    def validate(self):
+        """Raise a `ClientException` naming any field not in the form"""
+        if self.form is None:
+            return
+        unknown = sorted(set(
+            xpath for xpath in self.xpaths()
+            if not xpath.startswith('_') and not self.form.has_field(xpath)))
+        if unknown:
+            raise ClientException(u'Unknown fields for form {}: {}'.format(
+                self.form.get('id_string'), u', '.join(unknown)))
+
+    def params(self):
+        """The query string parameters as a list of (name, value) pairs"""
+        self.validate()
+        params = []
+        if self.query:
+            params.append(('query', codec.dumps(self.query, sort_keys=True,
+                                                default=_json_value)))
+        if self.projection:
+            params.append(('fields', codec.dumps(self.projection)))
+        if self.ordering:
+            params.append(('sort', codec.dumps(OrderedDict(self.ordering))))
+        if self.tag_names:
+            params.append(('tags', ','.join(self.tag_names)))
+        if self.start is not None:
+            params.append(('start', self.start))
+        if self.limit is not None:
+            params.append(('limit', self.limit))
+        return params
+
+    def urlencode(self):
+        return urlencode(self.params())
@@ -0,0 +1,181 @@
+import random
+import threading
+import time
+
+from email.utils import mktime_tz, parsedate_tz
+
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+THROTTLE_STATUSES = frozenset([429, 503])
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait according to a Retry-After header, which is either a
+    number of seconds or an HTTP date. None if it can't be parsed"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - (time.time() if now is None
+                                         else now))
+
+
+def replayable(data):
+    """Whether a request body can be sent again, streamed bodies such as
+    a `MultipartEncoder` or an open file are consumed by the first attempt"""
+    return data is None or isinstance(
+        data, (bytes, type(u''), dict, list, tuple))
+
+
+class RetryPolicy(object):
+    """When and how long to wait before retrying a response
+
+    Retries use exponential backoff with full jitter, a `Retry-After` header
+    on the response takes precedence when present.
+
+    .. attribute:: total
+
+        Maximum number of retries for a request
+
+    .. attribute:: backoff_factor
+
+        The delay before retry n is drawn from [0, backoff_factor * 2 ** n]
+
+    .. attribute:: max_backoff
+
+        Upper bound in seconds of any single delay, Retry-After included
+
+    .. attribute:: statuses
+
+        Response statuses worth retrying
+
+    .. attribute:: methods
+
+        Methods retried for any of `statuses`. A 429 means the server didn't
+        handle the request at all, so it's retried whatever the method.
+
+    Example:
+    .. code-block:: python
+
+       Client(api_addr, api_token=token,
+              retry_policy=RetryPolicy(total=8, backoff_factor=1))
+    """
+
+    def __init__(self, total=5, backoff_factor=0.5, max_backoff=60,
+                 statuses=RETRY_STATUSES, methods=IDEMPOTENT_METHODS,
+                 respect_retry_after=True, jitter=True):
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(m.upper() for m in methods)
+        self.respect_retry_after = respect_retry_after
+        self.jitter = jitter
+
+    def should_retry(self, method, response, attempt):
+        if attempt >= self.total or response.status_code not in self.statuses:
+            return False
+        return response.status_code == 429 or method.upper() in self.methods
+
+    def backoff(self, attempt):
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def delay(self, response, attempt):
+        """Seconds to wait before retrying `response`, the `attempt`th retry
+        counting from 0"""
+        if self.respect_retry_after:
+            retry_after = parse_retry_after(
+                response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(self.max_backoff, retry_after)
+        return self.backoff(attempt)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class TokenBucket(object):
+    """A thread safe token bucket that adapts its rate to the server
+
+    Every request takes a token, blocking until one is available. The rate
+    grows by `increase` requests per second after each accepted request and
+    is cut by `decrease` whenever the server throttles, so a crawl settles
+    just below the rate the server will accept.
+
+    .. attribute:: rate
+
+        Current requests per second
+
+    .. attribute:: capacity
+
+        Burst size, the most tokens that can accumulate while idle
+    """
+
+    def __init__(self, rate=10.0, capacity=None, min_rate=0.5, max_rate=None,
+                 increase=0.5, decrease=0.5):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Take a token, returns the seconds spent waiting for it"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def succeeded(self):
+        with self._lock:
+            rate = self.rate + self.increase
+            self.rate = min(rate, self.max_rate) if self.max_rate else rate
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiterRegistry(object):
+    """One `TokenBucket` per host so every connection and thread talking to
+    a server shares its budget"""
+
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, rate=10.0, **kwargs):
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = TokenBucket(rate, **kwargs)
+            return limiter
+
+    def clear(self):
+        with self._lock:
+            self._limiters.clear()
+
+
+rate_limiters = RateLimiterRegistry()
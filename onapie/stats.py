@@ -1,16 +1,34 @@
-import json
+from onapie.utils import DEFAULT_WORKERS, iter_concurrently
 
 
-class StatsManager(object):
+class StatsPaths(object):
+    """Endpoints and request paths shared by the sync and async stats
+    managers"""
 
     def __init__(self, conn, stats_path):
         self.conn = conn
         self.stats_ep = stats_path
 
-    def get(self, pk, method=None):
-        """Get submitted data for a given form"""
+    def _get_path(self, pk, method=None):
         path = '{}/{}?'.format(self.stats_ep, pk)
         if method is not None:
             path = '{}method={}'.format(path, method)
 
-        return json.loads(self.conn.get(path).text)
+        return path
+
+
+class StatsManager(StatsPaths):
+
+    def get(self, pk, method=None):
+        """Get submitted data for a given form"""
+        return self.conn.decode_json(
+            self.conn.get(self._get_path(pk, method)))
+
+    def get_many(self, pks, method=None, max_workers=DEFAULT_WORKERS):
+        """Get stats for several forms concurrently
+
+        Yields a `BatchResult(pk, stats, error)` for every pk as soon as its
+        request completes.
+        """
+        return iter_concurrently(
+            lambda pk: self.get(pk, method), pks, max_workers)
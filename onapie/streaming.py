@@ -0,0 +1,96 @@
+import codecs
+import json
+import re
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_array(chunks, encoding='utf-8'):
+    """Incrementally decode a JSON array, yielding its elements as they arrive
+
+    .. attribute:: chunks
+
+        An iterable of bytes (or text) chunks, e.g. `response.iter_content()`
+
+    .. attribute:: encoding
+
+        Optional. Encoding used to decode byte chunks
+
+    Only the undecoded tail of the stream and the element currently being
+    parsed are kept in memory. A document whose top level value is not an
+    array is decoded whole and yielded as a single item.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    raw_decode = json.JSONDecoder().raw_decode
+    chunks = iter(chunks)
+    buf = u''
+    pos = 0
+    eof = False
+    in_array = False
+    expect_comma = False
+
+    while True:
+        if pos < len(buf):
+            pos = _WHITESPACE.match(buf, pos).end()
+
+        if pos == len(buf) or (in_array and not eof and
+                               _needs_more(buf, pos, expect_comma)):
+            if eof:
+                raise ValueError(u'Unexpected end of JSON stream')
+            buf, pos, eof = _read_more(chunks, decoder, buf, pos)
+            continue
+
+        if not in_array:
+            if buf[pos] != u'[':
+                # Not an array, there are no elements to stream
+                while not eof:
+                    buf, pos, eof = _read_more(chunks, decoder, buf, pos)
+                yield json.loads(buf[pos:])
+                return
+            in_array = True
+            pos += 1
+            continue
+
+        if buf[pos] == u']':
+            return
+
+        start = pos
+        if expect_comma:
+            if buf[pos] != u',':
+                raise ValueError(
+                    u'Expecting \',\' delimiter at position {}'.format(pos))
+            start = _WHITESPACE.match(buf, pos + 1).end()
+
+        try:
+            value, end = raw_decode(buf, start)
+        except ValueError:
+            if eof:
+                raise
+            buf, pos, eof = _read_more(chunks, decoder, buf, pos)
+            continue
+
+        if end == len(buf) and not eof:
+            # A number or literal could be cut short at the chunk boundary
+            buf, pos, eof = _read_more(chunks, decoder, buf, pos)
+            continue
+
+        yield value
+        pos = end
+        expect_comma = True
+
+
+def _needs_more(buf, pos, expect_comma):
+    """Whether the buffer ends right after a delimiter"""
+    return expect_comma and buf[pos] == u',' and \
+        _WHITESPACE.match(buf, pos + 1).end() == len(buf)
+
+
+def _read_more(chunks, decoder, buf, pos):
+    """Drop the consumed part of the buffer and append the next chunk"""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return buf[pos:] + decoder.decode(b'', True), 0, True
+    if not isinstance(chunk, bytes):
+        return buf[pos:] + chunk, 0, False
+    return buf[pos:] + decoder.decode(chunk), 0, False
@@ -0,0 +1,363 @@
+"""Local stores for incrementally synced submissions
+
+`DataManager.sync` pulls only the submissions modified since the last
+run and hands them to a store, which persists them together with the high
+water mark (checkpoint) to resume from next time.
+"""
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+from onapie import codec
+from onapie.columns import FIELD_KINDS, FLOAT, INTEGER, value_fields
+from onapie.exceptions import ClientException
+from onapie.ona_schema import OnaSchemaNode
+from onapie.query import DataQuery
+
+
+# Rows read per turn of the store lock while iterating
+ITER_BATCH_SIZE = 500
+
+
+class SQLiteStore(object):
+    """Keeps synced submissions and per form checkpoints in SQLite
+
+    .. attribute:: path
+
+        Path to the database file, ':memory:' for a throwaway store
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                form_pk TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS submissions (
+                form_pk TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (form_pk, id));
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def get_checkpoint(self, pk):
+        """Return the high water mark of the last sync, None if never
+        synced"""
+        with self._lock:
+            row = self.db.execute(
+                'SELECT value FROM checkpoints WHERE form_pk = ?',
+                (str(pk),)).fetchone()
+        return codec.loads(row[0]) if row is not None else None
+
+    def set_checkpoint(self, pk, value):
+        with self._lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)',
+                (str(pk), codec.dumps(value), time.time()))
+
+    def upsert(self, pk, records):
+        """Insert or replace submissions by `_id`
+
+        Returns a `(created, updated)` tuple of counts.
+        """
+        created = updated = 0
+        with self._lock, self.db:
+            for record in records:
+                data_id = record['_id']
+                exists = self.db.execute(
+                    'SELECT 1 FROM submissions WHERE form_pk = ? AND id = ?',
+                    (str(pk), data_id)).fetchone()
+                self.db.execute(
+                    'INSERT OR REPLACE INTO submissions VALUES (?, ?, ?)',
+                    (str(pk), data_id, codec.dumps(record)))
+                if exists:
+                    updated += 1
+                else:
+                    created += 1
+        return created, updated
+
+    def delete(self, pk, data_ids):
+        """Delete submissions by `_id`, returns the number deleted"""
+        with self._lock, self.db:
+            return sum(self.db.execute(
+                'DELETE FROM submissions WHERE form_pk = ? AND id = ?',
+                (str(pk), data_id)).rowcount for data_id in data_ids)
+
+    def get(self, pk, data_id):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT data FROM submissions WHERE form_pk = ? AND id = ?',
+                (str(pk), data_id)).fetchone()
+        return codec.loads(row[0]) if row is not None else None
+
+    def iter_records(self, pk):
+        """Iterate over the stored submissions of a form in `_id` order"""
+        with self._lock:
+            cursor = self.db.execute(
+                'SELECT data FROM submissions WHERE form_pk = ? ORDER BY id',
+                (str(pk),))
+        while True:
+            # Other threads may use the connection between batches
+            with self._lock:
+                rows = cursor.fetchmany(ITER_BATCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield codec.loads(row[0])
+
+    def count(self, pk):
+        with self._lock:
+            return self.db.execute(
+                'SELECT COUNT(*) FROM submissions WHERE form_pk = ?',
+                (str(pk),)).fetchone()[0]
+
+
+SQL_TYPES = {INTEGER: 'INTEGER', FLOAT: 'REAL'}
+META_COLUMNS = (('_submission_time', 'TEXT'), ('_date_modified', 'TEXT'),
+                ('_uuid', 'TEXT'))
+OPERATORS = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<=',
+             '$ne': 'IS NOT'}
+
+
+def _quote(name):
+    return u'"{}"'.format(name.replace('"', '""'))
+
+
+def _sql_value(value, sql_type):
+    if value is None or value == '':
+        return None
+    try:
+        if sql_type == 'INTEGER':
+            return int(value)
+        if sql_type == 'REAL':
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, (dict, list)):
+        return codec.dumps(value)
+    return value
+
+
+class IndexedSQLiteStore(SQLiteStore):
+    """A `SQLiteStore` that also spreads the fields of registered forms
+    over typed, indexed columns so submissions can be queried locally
+
+    Every question of the form outside repeats gets a column named by its
+    xpath, typed from the field type. Queries use the same mongo style
+    syntax as `DataManager.get`, fields without a column (e.g. inside
+    repeats) are read from the stored JSON. The column layout is kept in
+    the database, so a form registered once can be queried from any later
+    process.
+
+    Example:
+    .. code-block:: python
+
+       store = IndexedSQLiteStore('/var/lib/onapie/submissions.sqlite')
+       store.register(pk, OnaForm(client.forms.get(pk, 'json')),
+                      index=['household/age', 'district'])
+       store.refresh(client.data, pk)
+       adults = store.find(pk, {'household/age': {'$gte': 18}},
+                           district='north')
+    """
+
+    def __init__(self, path):
+        super(IndexedSQLiteStore, self).__init__(path)
+        with self._lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS layouts ('
+                            'form_pk TEXT PRIMARY KEY, columns TEXT NOT NULL)')
+            self._columns = dict(
+                (form_pk, OrderedDict(codec.loads(columns)))
+                for form_pk, columns in self.db.execute(
+                    'SELECT form_pk, columns FROM layouts'))
+
+    @staticmethod
+    def _table(pk):
+        return _quote(u'fields:{}'.format(pk))
+
+    def register(self, pk, form, index=()):
+        """Create the columns of a form's fields, index `index` and
+        `_submission_time`, then fill them from submissions already stored.
+
+        Call it again whenever the form changes. The columns are only
+        rebuilt when the form's layout differs from the stored one,
+        otherwise just the indexes are added.
+        """
+        columns = OrderedDict(META_COLUMNS)
+        for field in value_fields(form):
+            columns[field[OnaSchemaNode.XPATH]] = SQL_TYPES.get(
+                FIELD_KINDS.get(field.get(OnaSchemaNode.TYPE)), 'TEXT')
+
+        table = self._table(pk)
+        with self._lock, self.db:
+            if self._columns.get(str(pk)) == columns:
+                for xpath in ['_submission_time'] + list(index):
+                    self.create_index(pk, xpath)
+                return
+
+            self.db.execute(u'CREATE TABLE IF NOT EXISTS {} ('
+                            u'id INTEGER PRIMARY KEY)'.format(table))
+            existing = set(row[1] for row in self.db.execute(
+                u'PRAGMA table_info({})'.format(table)))
+            for xpath, sql_type in columns.items():
+                if xpath not in existing:
+                    self.db.execute(u'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                        table, _quote(xpath), sql_type))
+            self._columns[str(pk)] = columns
+            self.db.execute('INSERT OR REPLACE INTO layouts VALUES (?, ?)',
+                            (str(pk), codec.dumps(list(columns.items()))))
+            for xpath in ['_submission_time'] + list(index):
+                self.create_index(pk, xpath)
+
+            self.db.execute(u'DELETE FROM {}'.format(table))
+            self._insert_rows(pk, self.iter_records(pk))
+
+    def create_index(self, pk, xpath):
+        columns = self._columns[str(pk)]
+        if xpath not in columns:
+            raise ClientException(
+                u'{} is not a column of form {}'.format(xpath, pk))
+        with self._lock, self.db:
+            self.db.execute(u'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                _quote(u'index:{}:{}'.format(pk, xpath)), self._table(pk),
+                _quote(xpath)))
+
+    def _insert_rows(self, pk, records):
+        columns = self._columns.get(str(pk))
+        if columns is None:
+            return
+        names = list(columns)
+        self.db.executemany(
+            u'INSERT OR REPLACE INTO {} (id, {}) VALUES (?, {})'.format(
+                self._table(pk), u', '.join(_quote(n) for n in names),
+                u', '.join('?' * len(names))),
+            ([record['_id']] + [_sql_value(record.get(n), columns[n])
+                                for n in names]
+             for record in records))
+
+    def upsert(self, pk, records):
+        records = list(records)
+        with self._lock, self.db:
+            counts = super(IndexedSQLiteStore, self).upsert(pk, records)
+            self._insert_rows(pk, records)
+        return counts
+
+    def delete(self, pk, data_ids):
+        data_ids = list(data_ids)
+        with self._lock, self.db:
+            deleted = super(IndexedSQLiteStore, self).delete(pk, data_ids)
+            if str(pk) in self._columns:
+                self.db.executemany(u'DELETE FROM {} WHERE id = ?'.format(
+                    self._table(pk)), ((data_id,) for data_id in data_ids))
+        return deleted
+
+    def refresh(self, data_manager, pk, **kwargs):
+        """Pull new, edited and deleted submissions with
+        `DataManager.sync`"""
+        return data_manager.sync(pk, self, **kwargs)
+
+    def _column(self, pk, xpath):
+        if xpath == '_id':
+            return u'f.id'
+        if xpath in self._columns[str(pk)]:
+            return u'f.{}'.format(_quote(xpath))
+        return u"json_extract(s.data, '$.{}')".format(
+            _quote(xpath).replace("'", "''"))
+
+    def _where(self, pk, query, params):
+        clauses = []
+        for key, condition in sorted(query.items()):
+            if key in ('$or', '$and'):
+                parts = [u'({})'.format(self._where(pk, q, params))
+                         for q in condition]
+                clauses.append(u'({})'.format(
+                    (u' OR ' if key == '$or' else u' AND ').join(parts)))
+                continue
+
+            column = self._column(pk, key)
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for op, value in sorted(condition.items()):
+                if op == '$eq' and value is None:
+                    clauses.append(u'{} IS NULL'.format(column))
+                elif op == '$eq':
+                    clauses.append(u'{} = ?'.format(column))
+                    params.append(value)
+                elif op in OPERATORS:
+                    clauses.append(u'{} {} ?'.format(column, OPERATORS[op]))
+                    params.append(value)
+                elif op in ('$in', '$nin'):
+                    clauses.append(u'{} {}IN ({})'.format(
+                        column, u'NOT ' if op == '$nin' else u'',
+                        u', '.join('?' * len(value))))
+                    params.extend(value)
+                elif op == '$exists':
+                    clauses.append(u'{} IS {}NULL'.format(
+                        column, u'NOT ' if value else u''))
+                else:
+                    raise ClientException(
+                        u'Unsupported query operator {}'.format(op))
+        return u' AND '.join(clauses) or u'1'
+
+    def _select(self, pk, what, query, sort=(), start=None, limit=None):
+        if str(pk) not in self._columns:
+            raise ClientException(u'Form {} is not registered'.format(pk))
+        params = [str(pk)]
+        sql = u'SELECT {} FROM {} f JOIN submissions s ON s.form_pk = ? ' \
+            u'AND s.id = f.id WHERE {}'.format(
+                what, self._table(pk), self._where(pk, query, params))
+        if sort:
+            sql += u' ORDER BY {}'.format(u', '.join(
+                u'{} {}'.format(self._column(pk, xpath),
+                                u'DESC' if direction < 0 else u'ASC')
+                for xpath, direction in sort))
+        if start is not None or limit is not None:
+            sql += u' LIMIT ? OFFSET ?'
+            params.extend([-1 if limit is None else limit, start or 0])
+        return self.db.execute(sql, params)
+
+    def find(self, pk, query=None, fields=None, sort=None, start=None,
+             limit=None, **query_kwargs):
+        """Stored submissions of a registered form matching a query
+
+        .. attribute:: query
+
+            Optional. A dict in the API's query syntax, or a
+            `onapie.query.DataQuery` whose fields, sort and slice are used
+            as well
+
+        .. attribute:: sort
+
+            Optional. A list of `(xpath, 1 or -1)` pairs
+        """
+        if isinstance(query, DataQuery):
+            query.validate()
+            fields = fields or query.projection
+            sort = sort or query.ordering
+            start = query.start if start is None else start
+            limit = query.limit if limit is None else limit
+            query = query.query
+        query = dict(query or {}, **query_kwargs)
+
+        with self._lock:
+            rows = self._select(pk, u's.data', query, sort or (), start,
+                                limit).fetchall()
+        records = []
+        for row in rows:
+            record = codec.loads(row[0])
+            if fields:
+                record = dict((f, record.get(f)) for f in fields)
+            records.append(record)
+        return records
+
+    def count_where(self, pk, query=None, **query_kwargs):
+        query = dict(query or {}, **query_kwargs)
+        with self._lock:
+            return self._select(pk, u'COUNT(*)', query).fetchone()[0]
@@ -0,0 +1,277 @@
+"""Pluggable HTTP transports for `Connection`
+
+A transport makes a single HTTP request and returns a `requests` style
+response, leaving retries, rate limiting, caching, metrics and mapping
+errors to `Connection`, so they behave the same whichever transport is in
+use.
+
+`RequestsTransport`, the default, keeps a pool of HTTP/1.1 connections so
+every concurrent request holds a TCP (and TLS) connection of its own.
+`HTTPXTransport` can instead multiplex concurrent requests as HTTP/2
+streams over a single connection per host, which saves a handshake per
+concurrent request when firing many small calls. It requires
+`pip install onapie[http2]`. Digest and basic `requests` auth are sent as
+their httpx counterparts, other `requests.auth.AuthBase` instances are
+applied to each request's headers.
+"""
+import datetime
+import time
+
+import requests
+
+from onapie.compression import DEFLATE, GZIP, PREFERENCE
+
+try:
+    from http.client import responses as REASONS  # NOQA
+except ImportError:
+    from httplib import responses as REASONS  # NOQA
+
+try:
+    import httpx  # NOQA
+except ImportError:
+    httpx = None
+
+
+def _decoders(names):
+    return tuple(e for e in PREFERENCE if e in names) or (GZIP, DEFLATE)
+
+
+if httpx is not None:
+    class _RequestsAuth(httpx.Auth):
+        """Applies a `requests` auth to the headers of an httpx request"""
+
+        def __init__(self, auth):
+            self.auth = auth
+
+        def auth_flow(self, request):
+            prepared = requests.models.PreparedRequest()
+            prepared.prepare(method=request.method, url=str(request.url),
+                             headers=dict(request.headers))
+            prepared = self.auth(prepared)
+            request.headers.update(prepared.headers)
+            yield request
+
+
+def _httpx_auth(auth):
+    """The httpx equivalent of a `requests` auth argument"""
+    if auth is None:
+        return None
+    if isinstance(auth, tuple):
+        return httpx.BasicAuth(*auth)
+    if isinstance(auth, requests.auth.HTTPDigestAuth):
+        return httpx.DigestAuth(auth.username, auth.password)
+    if isinstance(auth, requests.auth.HTTPBasicAuth):
+        return httpx.BasicAuth(auth.username, auth.password)
+    if isinstance(auth, requests.auth.AuthBase):
+        return _RequestsAuth(auth)
+    raise TypeError(u'Unsupported auth {!r}'.format(auth))
+
+
+class RequestsTransport(object):
+    """Sends requests through a `requests.Session`
+
+    .. attribute:: max_retries
+
+        Optional. How many times urllib3 retries failed connections
+
+    .. attribute:: content_encodings
+
+        The response encodings urllib3 decompresses
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=5,
+                 **kwargs):
+        self.content_encodings = _decoders(getattr(
+            requests.packages.urllib3.response.HTTPResponse,
+            'CONTENT_DECODERS', ()))
+        self.session = requests.Session()
+        for prefix in ['https://', 'http://']:
+            self.session.mount(prefix, requests.adapters.HTTPAdapter(
+                pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                max_retries=max_retries))
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class _StreamReader(object):
+    """The `raw` of a streamed response, reading from an httpx response
+    so `requests.Response.iter_content` works unchanged"""
+
+    def __init__(self, response):
+        self.response = response
+        self._chunks = response.iter_bytes()
+        self._buffer = b''
+
+    def read(self, size=-1):
+        try:
+            while size < 0 or len(self._buffer) < size:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer += chunk
+        except httpx.TransportError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def tell(self):
+        """Bytes received so far, before decompression"""
+        return self.response.num_bytes_downloaded
+
+    def close(self):
+        self.response.close()
+
+
+def _adapt_response(response, stream, elapsed):
+    """Wrap an httpx response in a `requests.Response`"""
+    adapted = requests.models.Response()
+    adapted.status_code = response.status_code
+    adapted.reason = response.reason_phrase or \
+        REASONS.get(response.status_code, '')
+    adapted.headers = requests.structures.CaseInsensitiveDict(
+        response.headers.items())
+    adapted.encoding = requests.utils.get_encoding_from_headers(
+        adapted.headers)
+    adapted.url = str(response.url)
+    adapted.elapsed = datetime.timedelta(seconds=elapsed)
+    adapted.http_version = response.http_version
+    adapted.raw = _StreamReader(response)
+    if not stream:
+        adapted._content = response.content
+        adapted._content_consumed = True
+    return adapted
+
+
+class HTTPXTransport(object):
+    """Sends requests through an `httpx.Client`, multiplexed over HTTP/2
+    when `http2` is set
+
+    Plain http URLs speak HTTP/2 with prior knowledge (h2c), https URLs
+    negotiate it with the server and fall back to HTTP/1.1. httpx errors
+    are raised as their `requests` counterparts.
+
+    .. attribute:: pool_maxsize
+
+        Optional. Most connections to keep per host. With HTTP/2 a single
+        connection carries any number of concurrent requests
+
+    .. attribute:: verify
+
+        Optional. Whether to verify TLS certificates. Requests asking
+        otherwise go through a second client, created on first use
+    """
+
+    def __init__(self, http2=True, pool_maxsize=10, max_retries=5,
+                 verify=True, timeout=(20, 180), **kwargs):
+        if httpx is None:
+            raise ImportError('The httpx transport requires httpx, install '
+                              'onapie[http2]')
+        self.http2 = http2
+        self.verify = verify
+        try:
+            from httpx._decoders import SUPPORTED_DECODERS
+        except ImportError:
+            SUPPORTED_DECODERS = ()
+        self.content_encodings = _decoders(SUPPORTED_DECODERS)
+        self._options = (pool_maxsize, max_retries, timeout)
+        self._clients = {}
+        self.session = self._client(verify)
+
+    def _client(self, verify):
+        client = self._clients.get(verify)
+        if client is not None:
+            return client
+        pool_maxsize, max_retries, timeout = self._options
+        limits = httpx.Limits(max_connections=pool_maxsize,
+                              max_keepalive_connections=pool_maxsize)
+        client = self._clients[verify] = httpx.Client(
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            follow_redirects=True,
+            mounts={
+                'https://': httpx.HTTPTransport(
+                    http2=self.http2, verify=verify, limits=limits,
+                    retries=max_retries),
+                # Plain http has no ALPN to negotiate with, assume h2c
+                'http://': httpx.HTTPTransport(
+                    http1=not self.http2, http2=self.http2, limits=limits,
+                    retries=max_retries),
+            })
+        return client
+
+    def request(self, method, url, headers=None, data=None, files=None,
+                timeout=None, stream=False, verify=None, auth=None,
+                **kwargs):
+        if kwargs:
+            raise TypeError(u'The httpx transport does not support {}'.format(
+                u', '.join(sorted(kwargs))))
+        client = self.session
+        if verify is not None and verify != self.verify:
+            client = self._client(verify)
+        if client is not self.session or \
+                None in (headers or {}).values():
+            # Default headers are set on the main client only, and None
+            # leaves one out as it does with requests
+            merged = httpx.Headers(self.session.headers)
+            for key, value in (headers or {}).items():
+                if value is None:
+                    merged.pop(key, None)
+                else:
+                    merged[key] = value
+            headers = merged
+        options = {'headers': headers}
+        if isinstance(data, dict):
+            options['data'] = data
+        elif data is not None:
+            if isinstance(data, (bytes, str)):
+                options['content'] = data
+            else:
+                options['content'] = iter(data)
+                if hasattr(data, '__len__'):
+                    options['headers'] = dict(
+                        headers or {}, **{'Content-Length': str(len(data))})
+        if files:
+            options['files'] = files
+        if timeout is not None:
+            options['timeout'] = httpx.Timeout(timeout[1],
+                                               connect=timeout[0])
+
+        start = time.time()
+        try:
+            request = client.build_request(method, url, **options)
+            response = client.send(request, stream=stream,
+                                   auth=_httpx_auth(auth))
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e)
+        return _adapt_response(response, stream, time.time() - start)
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+
+
+TRANSPORTS = {'requests': RequestsTransport,
+              'httpx': lambda **kwargs: HTTPXTransport(http2=False, **kwargs),
+              'http2': HTTPXTransport}
+
+
+def get_transport(transport=None, **kwargs):
+    """Return a transport instance given a name, an instance, or None for
+    the default `RequestsTransport`"""
+    if transport is None:
+        transport = 'requests'
+    if not isinstance(transport, str):
+        return transport
+    try:
+        factory = TRANSPORTS[transport]
+    except KeyError:
+        raise ValueError(u'Unknown transport {}, available: {}'.format(
+            transport, u', '.join(sorted(TRANSPORTS))))
+    return factory(**kwargs)
@@ -0,0 +1,142 @@
+"""Streaming request bodies for file uploads
+
+`MultipartEncoder` produces a multipart/form-data body that is read from
+disk in chunks as it is sent, so uploading a large XLSForm or media file
+doesn't load it into memory.
+"""
+import mimetypes
+import mmap
+import os
+import uuid
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, type(u'')):
+        value = u'{}'.format(value)
+    return value.encode('utf-8')
+
+
+class MultipartEncoder(object):
+    """A file-like multipart/form-data body
+
+    .. attribute:: fields
+
+        Optional. A dict of plain form fields
+
+    .. attribute:: files
+
+        A list of `(field_name, file_path)` tuples
+
+    .. attribute:: progress
+
+        Optional. Called with `(bytes_sent, total_bytes)` after each chunk
+
+    .. attribute:: use_mmap
+
+        Optional. Memory map the files instead of reading them, lets the OS
+        page very large files in and out instead of copying them through
+        read buffers
+
+    The body has a known length, so it is sent with a Content-Length header
+    rather than chunked.
+    """
+
+    def __init__(self, fields=None, files=None, progress=None, use_mmap=False,
+                 chunk_size=CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            self.boundary)
+        self.progress = progress
+        self.use_mmap = use_mmap
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+        self._parts = []
+        for name, value in sorted((fields or {}).items()):
+            self._parts.append(self._header(name) + b'\r\n' +
+                               _to_bytes(value) + b'\r\n')
+        for name, file_path in files or []:
+            filename = os.path.basename(file_path)
+            content_type = mimetypes.guess_type(filename)[0] or \
+                'application/octet-stream'
+            self._parts.append(
+                self._header(name, filename) +
+                _to_bytes('Content-Type: {}\r\n'.format(content_type)) +
+                b'\r\n')
+            self._parts.append((file_path, os.path.getsize(file_path)))
+            self._parts.append(b'\r\n')
+        self._parts.append(_to_bytes('--{}--\r\n'.format(self.boundary)))
+
+        self.len = sum(len(part) if isinstance(part, bytes) else part[1]
+                       for part in self._parts)
+        self._iter = self._generate()
+        self._buffer = b''
+
+    def _header(self, name, filename=None):
+        disposition = u'form-data; name="{}"'.format(name)
+        if filename is not None:
+            disposition += u'; filename="{}"'.format(filename)
+        return _to_bytes(u'--{}\r\nContent-Disposition: {}\r\n'.format(
+            self.boundary, disposition))
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _generate(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            file_path, size = part
+            with open(file_path, 'rb') as file_data:
+                if self.use_mmap and size:
+                    mapped = mmap.mmap(file_data.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+                    try:
+                        for offset in range(0, size, self.chunk_size):
+                            yield mapped[offset:offset + self.chunk_size]
+                    finally:
+                        mapped.close()
+                else:
+                    while True:
+                        chunk = file_data.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+
+    def read(self, size=-1):
+        """Read up to `size` bytes of the body, everything left if -1"""
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            chunk = next(self._iter, None)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+
+        data = b''.join(chunks)
+        if size >= 0:
+            data, self._buffer = data[:size], data[size:]
+        else:
+            self._buffer = b''
+
+        self.bytes_read += len(data)
+        if self.progress is not None and data:
+            self.progress(self.bytes_read, self.len)
+        return data
+
+    def close(self):
+        self._iter.close()
@@ -1,7 +1,27 @@
+import hashlib
+import itertools
+import logging
+import os
 import requests
+import threading
+import time
+import warnings
 
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from onapie.cache import CacheEntry
+from onapie.codec import get_codec
+from onapie.compression import DEFLATE, GZIP, IDENTITY, accept_encoding
+from onapie.compression import negotiate
 from onapie.exceptions import ApiException
 from onapie.exceptions import ClientException
+from onapie.metrics import DecodeProfiler, RequestEvent, path_template
+from onapie.retry import THROTTLE_STATUSES, RetryPolicy, TokenBucket
+from onapie.retry import rate_limiters, replayable
+from onapie.streaming import iter_json_array
+from onapie.transport import get_transport
+from onapie.uploads import MultipartEncoder
 
 
 try:
@@ -10,6 +30,136 @@ except ImportError:
     from urlparse import urlparse  # NOQA
 
 
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_WORKERS = 10
+
+# Keyword arguments read by `Connection`
+CONNECTION_OPTIONS = ('timeout', 'read_timeout', 'ssl_verify', 'cache',
+                      'json_backend', 'retry_policy', 'rate_limit',
+                      'transport', 'pool_connections', 'pool_maxsize',
+                      'max_retries', 'compression', 'hooks',
+                      'profile_decode', 'user_agent')
+
+
+class BatchResult(namedtuple('BatchResult', ['key', 'result', 'error'])):
+    """Outcome of a single call in a batch
+
+    `error` holds the exception raised for `key`, in which case `result` is
+    None.
+    """
+    __slots__ = ()
+
+
+def iter_concurrently(func, keys, max_workers=DEFAULT_WORKERS):
+    """Call `func(key)` for every key on a bounded thread pool
+
+    Yields a `BatchResult` per key in completion order. Failures are
+    reported on their result instead of aborting the batch, and no more than
+    twice `max_workers` keys are queued at a time so `keys` can be a long
+    lazy iterable.
+    """
+    keys = iter(keys)
+    with ThreadPoolExecutor(max_workers) as executor:
+        pending = {}
+
+        def submit(count):
+            for key in itertools.islice(keys, count):
+                pending[executor.submit(func, key)] = key
+
+        submit(max_workers * 2)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield BatchResult(key, future.result(), None)
+                else:
+                    yield BatchResult(key, None, error)
+            submit(len(done))
+
+
+class BulkResult(namedtuple('BulkResult', ['succeeded', 'failed'])):
+    """Outcome of a bulk operation
+
+    `succeeded` lists the keys that went through and `failed` holds a
+    `BatchResult` with the error of every key that didn't.
+    """
+    __slots__ = ()
+
+
+def unique(keys):
+    """Yield keys in order, skipping any seen before"""
+    seen = set()
+    for key in keys:
+        if key not in seen:
+            seen.add(key)
+            yield key
+
+
+def run_bulk(func, keys, max_workers=DEFAULT_WORKERS):
+    """Call `func(key)` once for every distinct key on a bounded thread
+    pool and collect the outcome as a `BulkResult`"""
+    succeeded = []
+    failed = []
+    for result in iter_concurrently(func, unique(keys), max_workers):
+        if result.error is None:
+            succeeded.append(result.key)
+        else:
+            failed.append(result)
+    return BulkResult(succeeded, failed)
+
+
+def _retry_count(response):
+    """Number of retries urllib3 made for a response"""
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return len(getattr(retries, 'history', None) or ())
+
+
+def _wire_bytes(response):
+    """Bytes of the response body read off the connection, before
+    decompression, None if the transport can't tell"""
+    tell = getattr(getattr(response, 'raw', None), 'tell', None)
+    try:
+        return tell() if tell is not None else None
+    except Exception:
+        return None
+
+
+def build_url(url, path):
+    """Join an API path onto the scheme and host of a parsed url, absolute
+    urls are returned as they are"""
+    if path.startswith(('http://', 'https://')):
+        return path
+    if not path.startswith('/'):
+        path = u'/{}'.format(path)
+
+    return u'{}://{}{}'.format(url.scheme, url.netloc, path)
+
+
+def is_other_host(url, target):
+    """Whether `target`, as built by `build_url`, is off the host of the
+    parsed `url`"""
+    return urlparse(target).netloc != url.netloc
+
+
+def raise_for_status(response):
+    """Map HTTP error responses to onapie exceptions
+
+    Raises `ClientException` for 4xx responses and `ApiException` for any
+    other non 2xx/3xx response, otherwise returns the response.
+    """
+    if 400 <= response.status_code < 500:
+        raise ClientException(None, response)
+
+    if not 200 <= response.status_code < 400:
+        raise ApiException(None, response)
+
+    return response
+
+
 class Connection(object):
 
     def __init__(self, url, **kwargs):
@@ -23,49 +173,328 @@ class Connection(object):
         self.timeout = kwargs.get('timeout', 20)
         self.read_timeout = kwargs.get('read_timeout', 180)
         self.verify = bool(kwargs.get('ssl_verify', True))
-        retries = kwargs.get('max_retries', 5)
-
-        self.session = requests.Session()
+        self.cache = kwargs.get('cache', None)
+        self.codec = get_codec(kwargs.get('json_backend', None))
+        self.retry_policy = kwargs.get('retry_policy', RetryPolicy())
+        rate_limit = kwargs.get('rate_limit', None)
+        if rate_limit is None or isinstance(rate_limit, TokenBucket):
+            self.rate_limiter = rate_limit
+        else:
+            self.rate_limiter = rate_limiters.get(self.url.netloc, rate_limit)
+        self.transport = get_transport(
+            kwargs.get('transport', None),
+            pool_connections=kwargs.get('pool_connections', 10),
+            pool_maxsize=kwargs.get('pool_maxsize', DEFAULT_WORKERS),
+            max_retries=kwargs.get('max_retries', 5), verify=self.verify,
+            timeout=(self.timeout, self.read_timeout))
+        self.session = self.transport.session
+        self.content_encodings = negotiate(
+            kwargs.get('compression', None),
+            getattr(self.transport, 'content_encodings', (GZIP, DEFLATE)))
 
-        self.session.mount("https://",
-                           requests.adapters.HTTPAdapter(max_retries=retries))
-        self.session.mount("http://", requests.adapters.HTTPAdapter(
-            requests.adapters.HTTPAdapter(max_retries=retries)))
+        self.hooks = list(kwargs.get('hooks', []))
+        self.decode_profiler = DecodeProfiler() \
+            if kwargs.get('profile_decode', False) else None
+        self._local = threading.local()
 
         self.user_agent = kwargs.get('user_agent', 'python-json2xlsclient')
-        self.set_header('user_agent', self.user_agent)
+        self.set_header('User-Agent', self.user_agent)
+        self.set_header('Accept-Encoding',
+                        accept_encoding(self.content_encodings))
 
     def set_header(self, key, value):
+        """Send a header with every request, on top of the transport's
+        defaults"""
         self.headers[key] = value
-        self.session.headers = self.headers
+        self.session.headers[key] = value
 
     def _request(self, *args, **kwargs):
-        return self.session.request(*args, **kwargs)
+        return self.transport.request(*args, **kwargs)
+
+    def close(self):
+        """Close the transport and its pooled connections"""
+        self.transport.close()
+
+    def _send(self, *args, **kwargs):
+        """Make a single attempt at a request, paced by the rate limiter"""
+        if self.rate_limiter is None:
+            return self._request(*args, **kwargs)
+
+        self.rate_limiter.acquire()
+        response = self._request(*args, **kwargs)
+        if response.status_code in THROTTLE_STATUSES:
+            self.rate_limiter.throttled()
+        else:
+            self.rate_limiter.succeeded()
+        return response
 
     def request(self, method, path, data=None, files=None, headers=None,
                 **extras):
         headers = headers or {}
+        url = build_url(self.url, path)
+        if is_other_host(self.url, url):
+            # API credentials stay with the API host
+            headers = dict(headers, Authorization=None)
+
+        cache_key = entry = None
+        # Authenticated responses hold credentials, e.g. the api_token
+        if self.cache is not None and method == 'GET' and \
+                not extras.get('stream') and extras.get('auth') is None:
+            cache_key = u'{}\n{}'.format(
+                headers.get('Authorization',
+                            self.headers.get('Authorization', u'')), url)
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                headers = dict(headers, **entry.conditional_headers())
+
+        event = RequestEvent(method, url, path_template(path))
+        start = time.time()
+        attempt = 0
+        while True:
+            try:
+                response = self._send(
+                    method, url,
+                    headers=headers, data=data, files=files,
+                    verify=self.verify,
+                    timeout=(self.timeout, self.read_timeout), **extras)
+            except Exception as e:
+                event.error = e
+                event.retries = attempt
+                event.elapsed = time.time() - start
+                self._emit(event)
+                raise
+
+            policy = self.retry_policy
+            if policy is None or files is not None or \
+                    not replayable(data) or \
+                    not policy.should_retry(method, response, attempt):
+                break
+            delay = policy.delay(response, attempt)
+            logger.debug(u'Retrying %s %s after %s in %.2fs', method, url,
+                         response.status_code, delay)
+            response.close()
+            policy.sleep(delay)
+            attempt += 1
+
+        event.status = response.status_code
+        event.ttfb = response.elapsed.total_seconds()
+        event.retries = attempt + _retry_count(response)
+
+        if extras.get('stream'):
+            self.last_response = response
+            self._instrument_stream(response, event, start)
+            if 200 <= response.status_code < 400:
+                return response
+            # Nobody gets an error response to close. Read its short body
+            # first, so the event counts it before being emitted and the
+            # exception keeps it
+            try:
+                response.content
+            finally:
+                response.close()
+            return raise_for_status(response)
+
+        event.bytes = len(response.content)
+        event.wire_bytes = _wire_bytes(response)
+        if cache_key is not None:
+            response = self._cache_response(cache_key, entry, response)
+        self.last_response = response
+        event.elapsed = time.time() - start
+        self._emit(event)
 
-        if not path.startswith('/'):
-            path = u'/{}'.format(path)
+        return raise_for_status(response)
 
-        self.last_response = self._request(
-            method,
-            u'{}://{}{}'.format(self.url.scheme, self.url.netloc, path),
-            headers=headers, data=data, files=files, verify=self.verify,
-            timeout=(self.timeout, self.read_timeout), **extras)
+    @property
+    def last_response(self):
+        """The last response received by the calling thread"""
+        return getattr(self._local, 'last_response', None)
 
-        if 400 <= self.last_response.status_code < 500:
-            raise ClientException(None, self.last_response)
+    @last_response.setter
+    def last_response(self, response):
+        self._local.last_response = response
 
-        if not 200 <= self.last_response.status_code < 400:
-            raise ApiException(None, self.last_response)
+    def add_hook(self, hook):
+        """Call `hook(event)` with a `onapie.metrics.RequestEvent` after
+        every request"""
+        self.hooks.append(hook)
 
-        return self.last_response
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _emit(self, event):
+        # Hooks may remove themselves
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception:
+                logger.exception(u'Request hook %r failed', hook)
+
+    def _instrument_stream(self, response, event, start):
+        """Count streamed bytes and emit the event once the body has been
+        read or the response closed"""
+        iter_content = response.iter_content
+        close = response.close
+        done = []
+
+        def finish():
+            if not done:
+                done.append(True)
+                event.wire_bytes = _wire_bytes(response)
+                event.elapsed = time.time() - start
+                self._emit(event)
+
+        def counting_iter_content(chunk_size=1, decode_unicode=False):
+            try:
+                for chunk in iter_content(chunk_size, decode_unicode):
+                    event.bytes += len(chunk)
+                    yield chunk
+            except Exception as e:
+                event.error = e
+                raise
+            finish()
+
+        def closing():
+            close()
+            finish()
+
+        response.iter_content = counting_iter_content
+        response.close = closing
+
+    def decode_json(self, response):
+        """Decode the JSON body of a response straight from its bytes"""
+        if self.decode_profiler is not None:
+            return self.decode_profiler.run(self.codec.loads,
+                                            response.content)
+        return self.codec.loads(response.content)
+
+    def _cache_response(self, key, entry, response):
+        if entry is not None and response.status_code == 304:
+            self.cache.record_hit()
+            cached = requests.models.Response()
+            cached.status_code = entry.status_code
+            cached.reason = entry.reason
+            cached.headers = requests.structures.CaseInsensitiveDict(
+                entry.headers)
+            cached.encoding = entry.encoding
+            cached._content = entry.content
+            cached.url = response.url
+            cached.from_cache = True
+            return cached
+
+        self.cache.record_miss()
+        if response.status_code == 200:
+            new_entry = CacheEntry.from_response(response)
+            if new_entry is not None:
+                self.cache.set(key, new_entry)
+        elif entry is not None:
+            self.cache.delete(key)
+
+        return response
 
     def get(self, path, headers=None, **extras):
         return self.request('GET', path, None, None, headers, **extras)
 
+    def iter_json(self, path, headers=None, chunk_size=CHUNK_SIZE, **extras):
+        """GET a JSON array and decode its elements as the body streams in
+
+        The request is made straight away so that HTTP errors are raised
+        here, the returned generator only reads and decodes the body.
+        """
+        response = self.get(path, headers, stream=True, **extras)
+        return self._iter_json_response(response, chunk_size)
+
+    def _iter_json_response(self, response, chunk_size):
+        try:
+            for item in iter_json_array(response.iter_content(chunk_size),
+                                        response.encoding or 'utf-8'):
+                yield item
+        finally:
+            response.close()
+
+    def download(self, path, dest, headers=None, chunk_size=CHUNK_SIZE,
+                 max_resumes=3, resume=False, **extras):
+        """Stream a response body to a file, returns the bytes written
+
+        Raw bytes are written as they arrive so the body is never held in
+        memory. If the connection drops mid-way the download is resumed from
+        the last byte written with a Range request, up to `max_resumes`
+        times. Servers that ignore the Range header get the file restarted.
+
+        .. attribute:: dest
+
+            A file path or a writable binary file object
+
+        .. attribute:: resume
+
+            Optional. Append to an existing partial download at the `dest`
+            path instead of starting over
+        """
+        if hasattr(dest, 'write'):
+            return self._download_to(path, dest, 0, headers, chunk_size,
+                                     max_resumes, **extras)
+
+        offset = 0
+        if resume and os.path.exists(dest):
+            offset = os.path.getsize(dest)
+        with open(dest, 'ab' if offset else 'wb') as file_data:
+            return self._download_to(path, file_data, offset, headers,
+                                     chunk_size, max_resumes, **extras)
+
+    def _download_to(self, path, file_data, offset, headers, chunk_size,
+                     max_resumes, **extras):
+        start = file_data.tell() - offset
+        written = offset
+        resumes = 0
+        validator = None
+        while True:
+            request_headers = dict(headers or {})
+            if written:
+                # Offsets count decompressed bytes, so resume the
+                # uncompressed representation
+                request_headers['Range'] = 'bytes={}-'.format(written)
+                request_headers['Accept-Encoding'] = IDENTITY
+                # Get the whole body again if it changed in the meantime
+                if validator is not None:
+                    request_headers['If-Range'] = validator
+            try:
+                response = self.get(path, request_headers, stream=True,
+                                    **extras)
+            except ClientException as e:
+                # Nothing left to fetch, the file is already complete
+                if written and e.api_response is not None and \
+                        e.api_response.status_code == 416:
+                    return written
+                raise
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError):
+                resumes += 1
+                if not written or resumes > max_resumes:
+                    raise
+                continue
+
+            etag = response.headers.get('ETag')
+            if etag is not None and not etag.startswith('W/'):
+                validator = etag
+            elif response.headers.get('Last-Modified') is not None:
+                validator = response.headers['Last-Modified']
+
+            try:
+                if written and response.status_code != 206:
+                    file_data.seek(start)
+                    file_data.truncate()
+                    written = 0
+                for chunk in response.iter_content(chunk_size):
+                    file_data.write(chunk)
+                    written += len(chunk)
+                return written
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError):
+                resumes += 1
+                if resumes > max_resumes:
+                    raise
+            finally:
+                response.close()
+
     def post(self, url_path, file_path=None, payload=None, headers=None,
              **extras):
         return self._request_with_body(
@@ -85,25 +514,118 @@ class Connection(object):
         return self.request('DELETE', url_path)
 
     def _request_with_body(self, method, url_path, file_path=None,
-                           payload=None, headers=None, **extras):
-        if method not in ['POST', 'PUT']:
-            raise ClientException(u'method arg must either be a POST or PUT!')
+                           payload=None, headers=None, file_field='xls_file',
+                           progress=None, use_mmap=False, **extras):
+        """Send a request with a form payload and/or a file upload
+
+        Files are streamed from disk as a multipart body, pass `progress` to
+        be called with `(bytes_sent, total_bytes)` as it goes and
+        `use_mmap` to memory map the file instead of reading it.
+        """
+        if method not in ['POST', 'PUT', 'PATCH']:
+            raise ClientException(
+                u'method arg must either be a POST, PUT or PATCH!')
+
+        if file_path is None:
+            return self.request(method, url_path, payload, None, headers,
+                                **extras)
+
+        fields = payload if isinstance(payload, dict) else None
+        body = MultipartEncoder(fields, [(file_field, file_path)], progress,
+                                use_mmap)
+        headers = dict(headers or {})
+        headers['Content-Type'] = body.content_type
+        try:
+            return self.request(method, url_path, body, None, headers,
+                                **extras)
+        finally:
+            body.close()
+
+
+def _freeze(value):
+    """A hashable stand in for a connection option"""
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        pass
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return id(value)
+
+
+def _fingerprint(credentials):
+    """A digest of credentials, so passwords aren't kept in keys"""
+    if credentials is None:
+        return None
+    return hashlib.sha256(repr(credentials).encode('utf-8')).hexdigest()
+
+
+class ConnectionRegistry(object):
+    """Hands out one `Connection` per (scheme, host, credentials, options)
 
-        if file_path is not None:
-            file_data = open(file_path, 'rb')
-            fdata = file_data.read()
-            file_data.close()
+    Clients talking to the same server with the same credentials and
+    connection options share a session and its pool of keep-alive
+    connections, while clients for other servers, accounts or options get
+    their own, so their auth headers never mix. Safe to use from multiple
+    threads.
+    """
 
-        return self.request(method, url_path, payload, headers, fdata,
-                            **extras)
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, credentials=None, **kwargs):
+        """Return the connection for `url`, `credentials` and the
+        `CONNECTION_OPTIONS` in `kwargs`, creating it with `kwargs` if this
+        is the first request for it
+
+        .. attribute:: credentials
+
+            Optional. Anything identifying the account, e.g. the api token
+            or a (username, password) tuple. Only a digest of it is kept
+        """
+        parsed = urlparse(url)
+        options = tuple(sorted((name, _freeze(kwargs[name]))
+                               for name in CONNECTION_OPTIONS
+                               if name in kwargs))
+        key = (parsed.scheme, parsed.netloc, _fingerprint(credentials),
+               options)
+
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = self._connections[key] = Connection(url, **kwargs)
+
+        return conn
+
+    def clear(self):
+        """Forget all connections and close their sessions"""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+
+        for conn in connections:
+            conn.close()
+
+
+connections = ConnectionRegistry()
 
 
 class ConnectionSingleton(Connection):
-    """The singleton implementation of our connection object"""
+    """The singleton implementation of our connection object
+
+    Deprecated, every instance shares one session and headers whatever the
+    server or credentials. Use `Connection` or a `ConnectionRegistry`.
+    """
     _instance = None
 
     def __new__(cls, *args, **kwargs):
+        warnings.warn('ConnectionSingleton is deprecated, use Connection or '
+                      'ConnectionRegistry', DeprecationWarning, stacklevel=2)
         if not cls._instance:
             cls._instance = \
-                super(Connection, cls).__new__(cls, *args, **kwargs)
+                super(Connection, cls).__new__(cls)
         return cls._instance
@@ -1,15 +1,94 @@
-from onapie.exceptions import ClientException
-import json
+from onapie.exceptions import ApiException, ClientException
+from onapie.exports import EXPORT_FORMATS, ExportJob, poll_delay
+from onapie.utils import DEFAULT_WORKERS, BatchResult, iter_concurrently
+from onapie.utils import run_bulk, unique
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import heapq
+import itertools
+import os
+import posixpath
+import time
+import warnings
+
+try:
+    from urllib.parse import urlencode  # NOQA
+except ImportError:
+    from urllib import urlencode  # NOQA
+
+
+class XlsFormsPaths(object):
+    """Endpoints and request paths shared by the sync and async forms
+    managers"""
+
+    def __init__(self, conn, api_entrypoint, exports_entrypoint=None,
+                 metadata_entrypoint=None):
+        self.conn = conn
+        self.forms_ep = api_entrypoint
+        if exports_entrypoint is not None:
+            warnings.warn('exports_entrypoint is unused and deprecated, '
+                          'exports are started under the forms endpoint '
+                          'and downloaded from the url the job reports',
+                          DeprecationWarning, stacklevel=2)
+        self.metadata_ep = metadata_entrypoint or posixpath.join(
+            posixpath.dirname(api_entrypoint.rstrip('/')), 'metadata')
+
+    def _list_path(self, owner=None):
+        query = self.forms_ep
 
+        if owner is not None:
+            query = '{}?owner={}'.format(query, owner)
 
-class XlsFormsManager(object):
+        return query
 
-    def __init__(self, conn, api_entrypoint, exports_entrypoint=None):
-        self.conn = conn
-        self.forms_ep = api_entrypoint
-        self.exports_ep = 'exports'
+    def _get_path(self, pk, representation=None, tag_args=()):
+        path = '{}/{}'.format(self.forms_ep, pk)
+
+        if representation is not None:
+            if representation not in ['json', 'xml', 'xls', 'csv']:
+                raise ClientException(
+                    'Invalid representation:- {}. Options are '
+                    'json, csv, xml or xls'.format(representation))
+            path = '{}/form.{}'.format(path, representation)
+
+        if any(tag_args):
+            tags = tag_args[0]
+            for tag in tag_args[1:]:
+                tags = '{},{}'.format(tags, tag)
+
+            path = '{}?tags={}'.format(path, tags)
+
+        return path
 
-    def create(self, xls_path=None, xls_url=None, owner=None):
+    def _export_path(self, pk, data_format=None):
+        path = '{}/{}'.format(self.forms_ep, pk)
+        if data_format is not None:
+            if data_format not in ['json', 'xml', 'xls', 'csv']:
+                raise ClientException(
+                    'Invalid representation:- {}. Options are '
+                    'json, csv, xml or xls'.format(data_format))
+            path = '{}.{}'.format(path, data_format)
+
+        return path
+
+    def _export_async_path(self, pk, params):
+        return '{}/{}/export_async?{}'.format(
+            self.forms_ep, pk, urlencode(sorted(params.items())))
+
+    @staticmethod
+    def _check_export(job, started, timeout):
+        if job.failed:
+            raise ApiException(u'Export of form {} failed: {}'.format(
+                job.pk, job.error))
+        if not job.done and timeout is not None and \
+                time.time() - started > timeout:
+            raise ApiException(
+                u'Export of form {} did not finish within {}s'.format(
+                    job.pk, timeout))
+
+
+class XlsFormsManager(XlsFormsPaths):
+
+    def create(self, xls_path=None, xls_url=None, owner=None, progress=None):
         """Uploads an XLSForm
 
         .. attribute::xls_path
@@ -24,14 +103,46 @@ class XlsFormsManager(object):
 
             Optional. username to the target account (Optional)
             TODO(kazikubwa@gmail.com): pass owner to the REST api?
+
+        .. attribute::progress
+
+            Optional. Called with `(bytes_sent, total_bytes)` while the file
+            at xls_path is streamed to the server
         """
         if (xls_path is None) == (xls_url is None):
             raise ClientException(u'You must provide a path or a url '
                                   'for creation. The two args are '
                                   'mutually exclusive!')
 
-        return json.loads(self.conn.post(self.forms_ep,
-                                         xls_path, xls_url).text)
+        extras = {}
+        if progress is not None:
+            extras['progress'] = progress
+
+        return self.conn.decode_json(
+            self.conn.post(self.forms_ep, xls_path, xls_url, **extras))
+
+    def add_media(self, pk, file_path, progress=None, use_mmap=False):
+        """Uploads a media file to be used by a form
+
+        The file is streamed from disk, so its size doesn't affect memory
+        use.
+
+        .. attribute::progress
+
+            Optional. Called with `(bytes_sent, total_bytes)` during the
+            upload
+
+        .. attribute::use_mmap
+
+            Optional. Memory map the file instead of reading it, for very
+            large files
+        """
+        payload = {'xform': pk, 'data_type': 'media',
+                   'data_value': os.path.basename(file_path)}
+
+        return self.conn.decode_json(self.conn.post(
+            self.metadata_ep, file_path, payload, file_field='data_file',
+            progress=progress, use_mmap=use_mmap))
 
     def list(self, owner=None):
         """Returns a list of forms
@@ -40,47 +151,183 @@ class XlsFormsManager(object):
 
             Optional. Get forms by owner username
         """
-        query = self.forms_ep
-
-        if owner is not None:
-            query = '{}?owner={}'.format(query, owner)
-
-        return json.loads(
-            self.conn.get(query).text)
+        return self.conn.decode_json(
+            self.conn.get(self._list_path(owner)))
 
     def get(self, pk, representation=None, *tag_args):
         """Get Form Information or representation"""
-        path = '{}/{}'.format(self.forms_ep, pk)
-
-        if representation is not None:
-            if representation not in ['json', 'xml', 'xls', 'csv']:
-                raise ClientException(
-                    'Invalid representation:- {}. Options are '
-                    'json, csv, xml or xls'.format(representation))
-            path = '{}/form.{}'.format(path, representation)
-
-        if any(tag_args):
-            tags = tag_args[0]
-            for tag in tag_args[1:]:
-                tags = '{},{}'.format(tags, tag)
-
-            path = '{}?tags={}'.format(path, tags)
+        path = self._get_path(pk, representation, tag_args)
 
         if representation and representation != 'json':
             return self.conn.get(path).text
         else:
-            return json.loads(self.conn.get(path).text)
+            return self.conn.decode_json(self.conn.get(path))
+
+    def get_many(self, pks, representation=None, max_workers=DEFAULT_WORKERS):
+        """Get information or a representation of several forms concurrently
+
+        Yields a `BatchResult(pk, form, error)` for every pk as soon as its
+        request completes. A failed request sets `error` instead of
+        aborting the batch.
+        """
+        return iter_concurrently(
+            lambda pk: self.get(pk, representation), pks, max_workers)
 
     def export(self, pk, data_format=None):
-        path = '{}/{}'.format(self.forms_ep, pk)
-        if data_format is not None:
-            if data_format not in ['json', 'xml', 'xls', 'csv']:
-                raise ClientException(
-                    'Invalid representation:- {}. Options are '
-                    'json, csv, xml or xls'.format(data_format))
-            path = '{}.{}'.format(path, data_format)
+        return self.conn.get(self._export_path(pk, data_format)).text
+
+    def export_to(self, pk, data_format, dest, max_resumes=3, resume=False):
+        """Stream an export to a file, returns the number of bytes written
+
+        Unlike `export` the raw bytes are written in chunks, so binary xls
+        exports stay intact and memory use doesn't grow with the export.
+        Dropped connections are resumed with Range requests.
+
+        .. attribute:: dest
+
+            A file path or a writable binary file object
+
+        .. attribute:: max_resumes
+
+            Optional. How many times to resume after a dropped connection
 
-        return self.conn.get(path).text
+        .. attribute:: resume
+
+            Optional. Continue a partial download already at the dest path
+        """
+        return self.conn.download(self._export_path(pk, data_format), dest,
+                                  max_resumes=max_resumes, resume=resume)
+
+    # Export jobs
+    def start_export(self, pk, data_format, **options):
+        """Start building an export on the server, returns its
+        `ExportJob`
+
+        .. attribute:: options
+
+            Optional. Export options passed through to the API, e.g.
+            `remove_group_name=True`
+        """
+        if data_format not in EXPORT_FORMATS:
+            raise ClientException(
+                'Invalid export format:- {}. Options are {}'.format(
+                    data_format, ', '.join(EXPORT_FORMATS)))
+        job = ExportJob(pk, data_format)
+        params = dict(options, format=data_format)
+        return job.update(self.conn.decode_json(
+            self.conn.get(self._export_async_path(pk, params))))
+
+    def poll_export(self, job):
+        """Refresh the status of an export job, returns the job"""
+        job.polls += 1
+        return job.update(self.conn.decode_json(self.conn.get(
+            self._export_async_path(job.pk, {'format': job.data_format,
+                                             'job_uuid': job.job_uuid}))))
+
+    def wait_export(self, job, timeout=None, poll_interval=1.0,
+                    max_poll_interval=30.0):
+        """Poll an export job until it's done, backing off between polls
+
+        Raises `ApiException` if the job fails or is still running after
+        `timeout` seconds.
+        """
+        started = time.time()
+        while True:
+            self._check_export(job, started, timeout)
+            if job.succeeded:
+                return job
+            time.sleep(poll_delay(job.polls, poll_interval,
+                                  max_poll_interval))
+            self.poll_export(job)
+
+    def download_export(self, job, dest, max_resumes=3):
+        """Stream a finished export to a file path or binary file object,
+        returns the number of bytes written"""
+        return self.conn.download(job.download_path(self.conn.url.netloc),
+                                  dest, max_resumes=max_resumes)
+
+    def export_async(self, pk, data_format, dest, timeout=None, **options):
+        """Export a form through an export job and stream it to `dest`,
+        returns the number of bytes written
+
+        Unlike `export_to` this works for exports too large for the server
+        to build within a single request.
+        """
+        job = self.wait_export(self.start_export(pk, data_format, **options),
+                               timeout)
+        return self.download_export(job, dest)
+
+    def export_many(self, pks, data_format, dest_dir,
+                    max_workers=DEFAULT_WORKERS, timeout=None,
+                    poll_interval=1.0, max_poll_interval=30.0, **options):
+        """Export many forms at once to `dest_dir/<pk>.<data_format>`
+
+        Every job is started up front and polled from a single schedule,
+        each at its own backed off interval, with requests and downloads
+        sharing a pool of `max_workers` threads. Each export is downloaded
+        as soon as it's ready, so the whole batch takes about as long as the
+        slowest export rather than the sum of all of them.
+
+        Yields a `BatchResult(pk, path, error)` per distinct pk as its
+        download completes. A failed or timed out job sets `error` instead
+        of aborting the batch.
+        """
+        started = time.time()
+        sequence = itertools.count()
+        schedule = []
+        with ThreadPoolExecutor(max_workers) as executor:
+            pending = {}
+            for pk in unique(pks):
+                future = executor.submit(self.start_export, pk, data_format,
+                                         **options)
+                pending[future] = pk
+
+            while pending or schedule:
+                now = time.time()
+                while schedule and schedule[0][0] <= now:
+                    job = heapq.heappop(schedule)[2]
+                    pending[executor.submit(self.poll_export, job)] = job.pk
+
+                if not pending:
+                    time.sleep(schedule[0][0] - now)
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED,
+                               timeout=schedule[0][0] - now
+                               if schedule else None)
+
+                for future in done:
+                    pk = pending.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        yield BatchResult(pk, None, error)
+                        continue
+
+                    result = future.result()
+                    if not isinstance(result, ExportJob):
+                        yield BatchResult(pk, result, None)
+                        continue
+                    try:
+                        self._check_export(result, started, timeout)
+                    except ApiException as e:
+                        yield BatchResult(pk, None, e)
+                        continue
+
+                    if result.succeeded:
+                        pending[executor.submit(
+                            self._download_export_to, result,
+                            dest_dir)] = pk
+                    else:
+                        heapq.heappush(schedule, (
+                            time.time() + poll_delay(
+                                result.polls, poll_interval,
+                                max_poll_interval),
+                            next(sequence), result))
+
+    def _download_export_to(self, job, dest_dir):
+        path = os.path.join(dest_dir, '{}.{}'.format(job.pk,
+                                                     job.data_format))
+        self.download_export(job, path)
+        return path
 
     def update(self, pk, uuid, description, owner, public, public_data):
         """Update Form"""
@@ -89,19 +336,20 @@ class XlsFormsManager(object):
                 '&public={}&public_data={}').format(uuid, description, owner,
                                                     public, public_data)
 
-        return json.loads(self.conn.put('{}/{}'.format(self.forms_ep, pk),
-                          None, form).text)
+        return self.conn.decode_json(
+            self.conn.put('{}/{}'.format(self.forms_ep, pk), None, form))
 
     def patch(self, pk, **kwargs):
         """Update Form Properties"""
 
-        args = '{}={}'.format(*kwargs.items()[0])
-        for key, value in kwargs.items()[1:]:
+        items = sorted(kwargs.items())
+        args = '{}={}'.format(*items[0])
+        for key, value in items[1:]:
             args = '{}&{}={}'.format(args, key, value)
 
-        return json.loads(
+        return self.conn.decode_json(
             self.conn.patch('{}/{}'.format(self.forms_ep, pk),
-                            None, args).text)
+                            None, args))
 
     def delete(self, pk):
         """Deletes your form"""
@@ -116,32 +364,50 @@ class XlsFormsManager(object):
     def get_tags(self, pk):
         """Get list of Tags for a specific Form"""
 
-        return json.loads(
-            self.conn.get('{}/{}/labels'.format(self.forms_ep, pk)).text)
+        return self.conn.decode_json(
+            self.conn.get('{}/{}/labels'.format(self.forms_ep, pk)))
 
     def set_tag(self, pk, *tag_args):
         """Tag forms"""
 
-        tags = json.dumps({'tags': tag_args})
-
-        return json.loads(
+        return self.conn.decode_json(
             self.conn.post('{}/{}/labels'.format(self.forms_ep, pk),
-                           tags).text)
+                           payload={'tags': ','.join(tag_args)}))
+
+    def bulk_tag(self, pks, tags, max_workers=DEFAULT_WORKERS):
+        """Add `tags` to many forms, one request per distinct form with up
+        to `max_workers` in flight. Returns a `BulkResult` of the pks
+        tagged and the failures"""
+        tags = list(unique(tags))
+        return run_bulk(lambda pk: self.set_tag(pk, *tags), pks,
+                        max_workers)
+
+    def bulk_untag(self, pks, tags, max_workers=DEFAULT_WORKERS):
+        """Remove `tags` from many forms, keyed by `(pk, tag)` pairs in the
+        returned `BulkResult`"""
+        tags = list(unique(tags))
+        pairs = ((pk, tag) for pk in unique(pks) for tag in tags)
+        return run_bulk(lambda pair: self.remove_tag(*pair), pairs,
+                        max_workers)
 
     def remove_tag(self, pk, tag):
         """Removes a tag"""
 
-        return json.loads(
+        return self.conn.decode_json(
             self.conn.delete('{}/{}/labels/{}'.format(self.forms_ep,
-                                                      pk, tag)).text)
+                                                      pk, tag)))
 
     def get_webformlink(self, pk):
-        return json.loads(
-            self.conn.get('{}/{}/enketo'.format(self.forms_ep, pk)).text)
+        return self.conn.decode_json(
+            self.conn.get('{}/{}/enketo'.format(self.forms_ep, pk)))
 
-    def get_formdata(self, pk, export_format):
-        # TODO: Implement when API behaves
-        raise ClientException('This has not Implemented.')
+    def get_formdata(self, pk, export_format, timeout=None):
+        """Export a form's data through an export job, returns the export
+        body. Prefer `export_async` to stream large exports to disk"""
+        job = self.wait_export(self.start_export(pk, export_format),
+                               timeout)
+        return self.conn.get(job.download_path(
+            self.conn.url.netloc)).content
 
     def share(self, pk, username, role):
         """Share a form with a specific user"""
@@ -151,13 +417,13 @@ class XlsFormsManager(object):
         if role in ['readonly', 'dataentry', 'editor', 'manager']:
             payload['role'] = role
 
-        return json.loads(
+        return self.conn.decode_json(
             self.conn.post('{}/{}/share'.format(self.forms_ep, pk),
-                           payload).text)
+                           payload))
 
     def clone_to_user(self, pk, username):
         """Clone a form to a specific user account"""
 
-        return json.loads(
+        return self.conn.decode_json(
             self.conn.post('{}/{}/clone'.format(self.forms_ep, pk),
-                           'username={}'.format(username)).text)
+                           'username={}'.format(username)))
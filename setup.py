@@ -21,4 +21,11 @@ setup(name='onapie',
       include_package_data=True,
       zip_safe=False,
       test_suite='onapie',
-      install_requires=['requests'],)
+      install_requires=['requests', 'futures; python_version < "3"'],
+      extras_require={
+          'async': ['aiohttp'],
+          'compression': ['brotli', 'zstandard'],
+          'fast': ['orjson'],
+          'http2': ['httpx[http2]'],
+          'pandas': ['numpy', 'pandas'],
+      },)
@@ -0,0 +1,142 @@
+from onapie.aggregate import Distribution, LocalStats
+from onapie.exceptions import ClientException
+from onapie.ona_schema import OnaForm
+from onapie.sync import SQLiteStore
+import mock
+import unittest
+
+
+SCHEMA = {
+    'name': 'survey',
+    'id_string': 'survey',
+    'children': [
+        {'name': 'age', 'type': 'integer'},
+        {'name': 'weight', 'type': 'decimal'},
+        {'name': 'district', 'type': 'select one',
+         'children': [{'name': 'north'}, {'name': 'south'}]},
+        {'name': 'water', 'type': 'text'},
+        {'name': 'location', 'type': 'geopoint'},
+        {'name': 'children', 'type': 'repeat', 'children': [
+            {'name': 'child_age', 'type': 'integer'}]},
+    ]
+}
+
+RECORDS = [
+    {'_id': 1, 'age': '20', 'weight': '60.5', 'district': 'north',
+     'water': 'well'},
+    {'_id': 2, 'age': '30', 'weight': '70', 'district': 'south',
+     'water': 'tap'},
+    {'_id': 3, 'age': '30', 'district': 'north', 'water': 'tap'},
+    {'_id': 4, 'age': 'n/a', 'weight': '80', 'district': 'west'},
+]
+
+
+class DistributionTestCase(unittest.TestCase):
+
+    def test_methods(self):
+        distribution = Distribution({1: 2, 3: 1, 10: 1})
+        self.assertEqual(distribution.stats(), {
+            'mean': 3.75, 'median': 2.0, 'mode': 1, 'min': 1, 'max': 10,
+            'range': 9})
+
+        distribution.subtract({1: 2})
+        self.assertEqual(distribution.median(), 6.5)
+        self.assertEqual(sorted(distribution.counts), [3, 10])
+
+    def test_empty(self):
+        self.assertEqual(set(Distribution().stats().values()), set([None]))
+
+    def test_mode_ties_pick_the_smallest(self):
+        self.assertEqual(Distribution({5: 2, 2: 2, 9: 1}).mode(), 2)
+
+
+class LocalStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(LocalStatsTestCase, self).setUp()
+        self.stats = LocalStats(OnaForm(SCHEMA))
+        self.assertEqual(self.stats.upsert(1, RECORDS), (4, 0))
+
+    def test_columns_leave_out_repeats_and_geopoints(self):
+        self.assertEqual(list(self.stats.columns),
+                         ['age', 'weight', 'district', 'water'])
+
+    def test_get_matches_the_server_shape(self):
+        self.assertEqual(self.stats.get('mean'),
+                         {'age': 80 / 3.0, 'weight': 210.5 / 3})
+        self.assertEqual(self.stats.get('range'), {'age': 10, 'weight': 19.5})
+        self.assertEqual(self.stats.get()['age'], {
+            'mean': 80 / 3.0, 'median': 30.0, 'mode': 30, 'min': 20,
+            'max': 30, 'range': 10})
+
+        with self.assertRaises(ClientException):
+            self.stats.get('variance')
+
+    def test_upsert_replaces_edited_submissions(self):
+        self.assertEqual(self.stats.upsert(1, [
+            {'_id': 3, 'age': '90', 'district': 'south'},
+            {'_id': 5, 'age': '40'}, {'_id': 5, 'age': '50'}]), (1, 1))
+
+        self.assertEqual(len(self.stats), 5)
+        self.assertEqual(self.stats.get('median'),
+                         {'age': 40.0, 'weight': 70})
+        self.assertEqual(self.stats.group_by('district'), [
+            {'district': 'north', 'count': 1},
+            {'district': 'south', 'count': 2},
+            {'district': 'west', 'count': 1}])
+
+    def test_delete(self):
+        self.assertEqual(self.stats.delete(1, [1, 2, 99]), 2)
+        self.assertEqual(self.stats.get('mean'), {'age': 30, 'weight': 80})
+
+        self.stats.delete(1, [3, 4])
+        self.assertEqual(self.stats.get(), {})
+
+    def test_results_are_cached_until_submissions_change(self):
+        first = self.stats.get()
+        self.assertIs(self.stats.get(), first)
+
+        self.stats.upsert(1, [{'_id': 6, 'age': '60'}])
+        self.assertIsNot(self.stats.get(), first)
+        self.assertEqual(self.stats.get()['age']['max'], 60)
+
+    def test_group_by_with_stats(self):
+        self.assertEqual(self.stats.group_by('water', 'age', 'mean'), [
+            {'water': 'tap', 'count': 2, 'age': 30},
+            {'water': 'well', 'count': 1, 'age': 20}])
+
+        north = self.stats.group_by('district', 'weight')[0]
+        self.assertEqual(north['count'], 1)
+        self.assertEqual(north['weight']['mean'], 60.5)
+
+        with self.assertRaises(ClientException):
+            self.stats.group_by('age', 'water')
+        with self.assertRaises(ClientException):
+            self.stats.group_by('children/child_age')
+
+    def test_crosstab(self):
+        self.assertEqual(self.stats.crosstab('district', 'water'), {
+            'north': {'tap': 1, 'well': 1}, 'south': {'tap': 1}})
+
+    def test_fields_limit_the_columns_kept(self):
+        stats = LocalStats(OnaForm(SCHEMA), fields=['age'])
+        stats.upsert(1, RECORDS)
+        self.assertEqual(list(stats.columns), ['age'])
+        self.assertEqual(list(stats.get()), ['age'])
+
+    def test_sync_into_stats_and_a_store(self):
+        store = SQLiteStore(':memory:')
+        data_manager = mock.Mock()
+        data_manager.sync.side_effect = \
+            lambda pk, target: target.upsert(pk, RECORDS[:2])
+
+        stats = LocalStats(OnaForm(SCHEMA))
+        stats.refresh(data_manager, 1, store)
+        self.assertEqual(store.count(1), 2)
+        self.assertEqual(stats.get('mode'), {'age': 20, 'weight': 60.5})
+
+        loaded = LocalStats.from_store(store, 1, OnaForm(SCHEMA))
+        self.assertEqual(loaded.get(), stats.get())
+
+        stats.set_checkpoint(1, 'now')
+        self.assertEqual(stats.get_checkpoint(1), 'now')
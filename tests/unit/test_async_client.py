@@ -0,0 +1,136 @@
+from onapie.exceptions import ApiException, ClientException
+from tests.utils import StubServer
+import json
+import unittest
+
+try:
+    import asyncio
+    from onapie.async_client import AsyncClient, AsyncConnection
+except (ImportError, SyntaxError):
+    AsyncClient = None
+
+
+CATALOG = {'forms': 'http://host/api/v1/forms',
+           'data': 'http://host/api/v1/data',
+           'stats': 'http://host/api/v1/stats'}
+
+
+@unittest.skipIf(AsyncClient is None, 'aiohttp is not installed')
+class AsyncClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(AsyncClientTestCase, self).setUp()
+        self.routes = {
+            '/api/v1/': (200, json.dumps(CATALOG)),
+            '/api/v1/forms/1': (200, '{"formid": 1}'),
+            '/api/v1/forms/1/form.xml': (200, '<h:html/>'),
+            '/api/v1/forms?owner=bob': (200, '[{"formid": 1}]'),
+            '/api/v1/data/1': (200, '[{"_id": 1}, {"_id": 2}]'),
+            '/api/v1/data/1?page=1&page_size=2': (
+                200, '[{"_id": 1}, {"_id": 2}]'),
+            '/api/v1/data/1?page=2&page_size=2': (200, '[{"_id": 3}]'),
+            '/api/v1/stats/1?method=mean': (200, '{"age": 30}'),
+            '/api/v1/forms/2': (500, '{}'),
+            '/api/v1/forms/1/export_async?format=csv': (
+                200, '{"job_status": "SUCCESS", '
+                '"export_url": "/api/v1/export/1.csv"}'),
+            '/api/v1/export/1.csv': (200, 'a,b\n'),
+        }
+
+    def run_client(self, coro_fn, **kwargs):
+        async def runner(server):
+            async with AsyncClient(server.url, **kwargs) as client:
+                return await coro_fn(client)
+
+        with StubServer(self.routes) as server:
+            self.server = server
+            return asyncio.run(runner(server))
+
+    def test_fetches_catalog_and_sets_token(self):
+        async def calls(client):
+            return await client.forms.get(1)
+
+        self.assertEqual(self.run_client(calls, api_token='t0k3n'),
+                         {'formid': 1})
+        method, path, headers = self.server.requests[-1]
+        self.assertEqual((method, path), ('GET', '/api/v1/forms/1'))
+        self.assertEqual(headers['Authorization'], 'Token t0k3n')
+
+    def test_managers_build_the_same_urls(self):
+        async def calls(client):
+            return await asyncio.gather(
+                client.forms.list('bob'), client.forms.get(1, 'xml'),
+                client.data.get(1), client.stats.get(1, 'mean'))
+
+        self.assertEqual(self.run_client(calls), [
+            [{'formid': 1}], '<h:html/>', [{'_id': 1}, {'_id': 2}],
+            {'age': 30}])
+
+    def test_iter_walks_pages(self):
+        async def calls(client):
+            return [r['_id'] async for r in client.data.iter(1, 2)]
+
+        self.assertEqual(self.run_client(calls), [1, 2, 3])
+
+    def test_error_mapping(self):
+        async def client_error(client):
+            await client.forms.get(404)
+
+        async def api_error(client):
+            await client.forms.get(2)
+
+        with self.assertRaises(ClientException):
+            self.run_client(client_error)
+        with self.assertRaises(ApiException) as ctx:
+            self.run_client(api_error)
+        self.assertNotIsInstance(ctx.exception, ClientException)
+
+    def test_concurrent_requests_are_bounded_per_host(self):
+        async def calls(client):
+            results = await asyncio.gather(
+                *[client.data.get(1) for _ in range(50)])
+            return results, client.conn.session.connector.limit_per_host
+
+        results, limit = self.run_client(calls, max_connections_per_host=4)
+        self.assertEqual(len(results), 50)
+        self.assertEqual(limit, 4)
+
+    def test_get_many_reports_failures_per_pk(self):
+        async def calls(client):
+            return [r async for r in client.forms.get_many([1, 2, 3])]
+
+        results = dict((r.key, r) for r in self.run_client(calls))
+        self.assertEqual(results[1].result, {'formid': 1})
+        self.assertIsInstance(results[2].error, ApiException)
+        self.assertIsInstance(results[3].error, ClientException)
+
+    def test_get_formdata_through_export_job(self):
+        async def calls(client):
+            return await client.forms.get_formdata(1, 'csv')
+
+        self.assertEqual(self.run_client(calls), b'a,b\n')
+        self.assertEqual(self.server.requests[-1][1], '/api/v1/export/1.csv')
+
+    def test_well_known_endpoints_without_catalog(self):
+        async def calls(client):
+            return await client.forms.get(1)
+
+        self.assertEqual(self.run_client(calls, fetch_catalog=False),
+                         {'formid': 1})
+        method, path, headers = self.server.requests[-1]
+        self.assertEqual([p for _, p, _ in self.server.requests],
+                         ['/api/v1/forms/1'])
+        self.assertEqual(headers['User-Agent'], 'python-json2xlsclient')
+
+    def test_sync_only_methods_are_not_inherited(self):
+        client = AsyncClient('http://host', fetch_catalog=False)
+        for name in ('query', 'sync', 'get_frame', 'iter_parallel',
+                     'bulk_tag', 'bulk_untag'):
+            self.assertFalse(hasattr(client.data, name), name)
+        for name in ('add_media', 'export_to', 'download_export',
+                     'export_async', 'export_many', 'bulk_tag'):
+            self.assertFalse(hasattr(client.forms, name), name)
+
+    def test_unsupported_protocol(self):
+        with self.assertRaises(ClientException):
+            AsyncConnection('ftp://host')
@@ -0,0 +1,128 @@
+from onapie.cache import CacheEntry, FileCache, MemoryCache
+from onapie.utils import Connection
+from requests.auth import HTTPBasicAuth
+from tests.utils import StubServer
+import mock
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+def make_entry(content=b'{}', etag='"v1"'):
+    return CacheEntry(200, 'OK', {'ETag': etag}, 'utf-8', content)
+
+
+class MemoryCacheTestCase(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', make_entry())
+        cache.set('b', make_entry())
+        cache.get('a')
+        cache.set('c', make_entry())
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_evicts_by_size(self):
+        cache = MemoryCache(max_bytes=10)
+        cache.set('a', make_entry(b'12345'))
+        cache.set('b', make_entry(b'123456'))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 1)
+
+    def test_expires_after_ttl(self):
+        cache = MemoryCache(ttl=60)
+        cache.set('a', make_entry())
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get('a'))
+
+
+class FileCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(FileCacheTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(FileCacheTestCase, self).tearDown()
+
+    def test_round_trip_across_instances(self):
+        FileCache(self.directory).set('a', make_entry(b'[1, 2]'))
+        entry = FileCache(self.directory).get('a')
+
+        self.assertEqual(entry.content, b'[1, 2]')
+        self.assertEqual(entry.conditional_headers(),
+                         {'If-None-Match': '"v1"'})
+
+    def test_header_lookups_ignore_case(self):
+        response = mock.Mock(status_code=200, reason='OK', encoding='utf-8',
+                             content=b'{}', headers={'etag': '"v2"'})
+        FileCache(self.directory).set('a', CacheEntry.from_response(response))
+        entry = FileCache(self.directory).get('a')
+
+        self.assertEqual(entry.conditional_headers(),
+                         {'If-None-Match': '"v2"'})
+        self.assertEqual(entry.headers['ETag'], '"v2"')
+
+    def test_authenticated_responses_are_not_stored(self):
+        routes = {'/api/v1/user': (200, '{"api_token": "s3cr3t"}',
+                                   {'ETag': '"v1"'})}
+        cache = FileCache(self.directory)
+
+        with StubServer(routes) as server:
+            conn = Connection(server.url, cache=cache)
+            conn.get('/api/v1/user', auth=HTTPBasicAuth('bob', 'pw'))
+
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(cache.stats['misses'], 0)
+
+    def test_evicts_past_max_entries(self):
+        cache = FileCache(self.directory, max_entries=2)
+        for key in ['a', 'b', 'c']:
+            cache.set(key, make_entry())
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expires_after_ttl(self):
+        cache = FileCache(self.directory, ttl=60)
+        cache.set('a', make_entry())
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get('a'))
+
+
+class ConnectionCacheTestCase(unittest.TestCase):
+
+    def test_serves_cached_body_on_not_modified(self):
+        routes = {'/api/v1/forms/1/form.json': (
+            200, '{"name": "form"}', {'ETag': '"v1"'})}
+        cache = MemoryCache()
+
+        with StubServer(routes) as server:
+            conn = Connection(server.url, cache=cache)
+            first = conn.get('/api/v1/forms/1/form.json')
+            second = conn.get('/api/v1/forms/1/form.json')
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.text, first.text)
+        self.assertTrue(second.from_cache)
+        self.assertEqual(server.requests[1][2]['If-None-Match'], '"v1"')
+        self.assertEqual(cache.stats,
+                         {'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_cache_is_keyed_by_credentials(self):
+        routes = {'/api/v1/': (200, '{}', {'ETag': '"v1"'})}
+
+        with StubServer(routes) as server:
+            conn = Connection(server.url, cache=MemoryCache())
+            conn.get('/api/v1/', {'Authorization': 'Token a'})
+            conn.get('/api/v1/', {'Authorization': 'Token b'})
+
+        self.assertNotIn('If-None-Match', server.requests[1][2])
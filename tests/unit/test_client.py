@@ -0,0 +1,225 @@
+from onapie.cache import SessionFile
+from onapie.client import Client
+from onapie.exceptions import ClientException
+from onapie.metrics import MetricsCollector
+from onapie.utils import ConnectionRegistry
+from tests.utils import StubServer
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ClientTestCase, self).setUp()
+        self.registry = ConnectionRegistry()
+
+    def tearDown(self):
+        self.registry.clear()
+        super(ClientTestCase, self).tearDown()
+
+    def test_clients_with_different_tokens_do_not_share_auth(self):
+        client1 = Client('https://api.ona.io', api_token='token1',
+                         fetch_catalog=False, registry=self.registry)
+        client2 = Client('https://api.ona.io', api_token='token2',
+                         fetch_catalog=False, registry=self.registry)
+
+        self.assertIsNot(client1.conn, client2.conn)
+        self.assertEqual(client1.conn.session.headers['Authorization'],
+                         'Token token1')
+        self.assertEqual(client2.conn.session.headers['Authorization'],
+                         'Token token2')
+
+    def test_clients_with_same_token_share_connection(self):
+        client1 = Client('https://api.ona.io', api_token='token1',
+                         fetch_catalog=False, registry=self.registry)
+        client2 = Client('https://api.ona.io', api_token='token1',
+                         fetch_catalog=False, registry=self.registry)
+
+        self.assertIs(client1.conn, client2.conn)
+
+    def test_tokens_set_later_stay_with_their_client(self):
+        client1 = Client('https://api.ona.io', fetch_catalog=False,
+                         registry=self.registry)
+        client2 = Client('https://api.ona.io', fetch_catalog=False,
+                         registry=self.registry)
+        client1.set_api_token('SECRET')
+
+        self.assertIsNot(client1.conn, client2.conn)
+        self.assertEqual(client1.conn.session.headers['Authorization'],
+                         'Token SECRET')
+        self.assertNotIn('Authorization', client2.conn.session.headers)
+
+    def test_switching_connection_keeps_hooks_and_headers(self):
+        client = Client('https://api.ona.io', fetch_catalog=False,
+                        registry=self.registry)
+        hook = mock.Mock()
+        client.conn.add_hook(hook)
+        client.conn.set_header('X-Trace', 'abc')
+        client.set_api_token('SECRET')
+
+        self.assertIn(hook, client.conn.hooks)
+        self.assertEqual(client.conn.session.headers['X-Trace'], 'abc')
+
+
+CATALOG = json.dumps({
+    'forms': 'https://api.ona.io/api/v1/forms',
+    'data': 'https://api.ona.io/api/v1/data',
+    'stats': 'https://api.ona.io/api/v1/stats'})
+
+
+class LazyClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(LazyClientTestCase, self).setUp()
+        self.registry = ConnectionRegistry()
+        self.tmp = tempfile.mkdtemp()
+        self.session_path = os.path.join(self.tmp, 'session.json')
+        self.server = StubServer({
+            '/api/v1/': (200, CATALOG),
+            '/api/v1/user': (200, '{"api_token": "token1"}'),
+            '/api/v1/forms/1': (200, '{"formid": 1}')})
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        self.registry.clear()
+        shutil.rmtree(self.tmp)
+        super(LazyClientTestCase, self).tearDown()
+
+    def client(self, **kwargs):
+        kwargs.setdefault('username', 'bob')
+        kwargs.setdefault('password', 'secret')
+        kwargs.setdefault('registry', self.registry)
+        return Client(self.server.url, **kwargs)
+
+    def paths(self):
+        return [path for _, path, _ in self.server.requests]
+
+    def test_construction_makes_no_requests(self):
+        client = self.client()
+        self.assertEqual(self.server.requests, [])
+
+        self.assertEqual(client.forms.get(1), {'formid': 1})
+        self.assertEqual(self.paths(),
+                         ['/api/v1/user', '/api/v1/', '/api/v1/forms/1'])
+        self.assertEqual(self.server.requests[-1][2]['Authorization'],
+                         'Token token1')
+
+        client.data
+        client.stats
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_login_keeps_the_connection(self):
+        client = self.client()
+        conn = client.conn
+        collector = MetricsCollector()
+        conn.add_hook(collector)
+        conn.set_header('X-Trace', 'abc')
+        forms = client.forms
+        forms.get(1)
+
+        self.assertIs(client.conn, conn)
+        self.assertIs(forms.conn, conn)
+        self.assertEqual(collector.endpoints(), [
+            'GET /api/v1/', 'GET /api/v1/forms/{id}', 'GET /api/v1/user'])
+        self.assertEqual([headers.get('X-Trace')
+                          for _, _, headers in self.server.requests],
+                         ['abc'] * 3)
+
+    def test_eager_client(self):
+        client = self.client(lazy=False)
+        self.assertEqual(self.paths(), ['/api/v1/user', '/api/v1/'])
+        self.assertEqual(client.forms.forms_ep, '/api/v1/forms')
+
+    def test_session_file_skips_auth_and_catalog(self):
+        self.client(session_file=self.session_path).forms
+        self.assertEqual(os.stat(self.session_path).st_mode & 0o777, 0o600)
+        del self.server.requests[:]
+
+        client = self.client(registry=ConnectionRegistry(),
+                             session_file=self.session_path)
+        self.assertEqual(client.forms.get(1), {'formid': 1})
+        self.assertEqual(self.paths(), ['/api/v1/forms/1'])
+        self.assertEqual(self.server.requests[0][2]['Authorization'],
+                         'Token token1')
+
+    def test_session_file_holds_no_password(self):
+        client = self.client(session_file=self.session_path)
+        client.forms
+        with open(self.session_path) as session_file:
+            sessions = json.load(session_file)
+        self.assertEqual(list(sessions), [client.session_key])
+        self.assertNotIn('secret', json.dumps(sessions))
+
+    def test_session_token_check_is_dropped_once_confirmed(self):
+        self.client(session_file=self.session_path).forms
+        clients = [self.client(session_file=self.session_path)
+                   for _ in range(5)]
+        for client in clients:
+            client.login()
+        self.assertEqual(len(clients[0].conn.hooks), 5)
+
+        clients[0].forms.get(1)
+        self.assertEqual(clients[0].conn.hooks, [])
+
+    def test_rejected_session_token_is_replaced(self):
+        SessionFile(self.session_path).set(
+            self.client().session_key, api_token='stale',
+            catalog=json.loads(CATALOG))
+        self.server.routes['/api/v1/forms/1'] = lambda headers: (
+            (401, '{}') if headers['Authorization'] == 'Token stale'
+            else (200, '{"formid": 1}'))
+
+        client = self.client(session_file=self.session_path)
+        with self.assertRaises(ClientException):
+            client.forms.get(1)
+        self.assertEqual(client.api_token, 'token1')
+        self.assertEqual(SessionFile(self.session_path).get(
+            client.session_key)['api_token'], 'token1')
+
+        self.assertEqual(client.forms.get(1), {'formid': 1})
+        self.assertEqual(self.paths(), ['/api/v1/forms/1', '/api/v1/user',
+                                        '/api/v1/forms/1'])
+        self.assertEqual(client.conn.hooks, [])
+
+    def test_rejected_token_is_replaced_once_per_connection(self):
+        SessionFile(self.session_path).set(
+            self.client().session_key, api_token='stale',
+            catalog=json.loads(CATALOG))
+        self.server.routes['/api/v1/forms/1'] = lambda headers: (
+            (401, '{}') if headers['Authorization'] == 'Token stale'
+            else (200, '{"formid": 1}'))
+        clients = [self.client(session_file=self.session_path)
+                   for _ in range(3)]
+        for client in clients:
+            client.login()
+
+        with self.assertRaises(ClientException):
+            clients[0].forms.get(1)
+        self.assertEqual(self.paths().count('/api/v1/user'), 1)
+        self.assertEqual([c.api_token for c in clients], ['token1'] * 3)
+        self.assertEqual(clients[0].conn.hooks, [])
+
+    def test_expired_session_is_fetched_again(self):
+        self.client(session_file=self.session_path).forms
+        del self.server.requests[:]
+
+        session_file = SessionFile(self.session_path, ttl=-1)
+        self.client(session_file=session_file,
+                    registry=ConnectionRegistry()).forms
+        self.assertEqual(self.paths(), ['/api/v1/user', '/api/v1/'])
+
+    def test_well_known_endpoints_without_catalog(self):
+        client = self.client(api_token='token1', fetch_catalog=False)
+        self.assertEqual(client.data.data_ep, '/api/v1/data')
+        self.assertEqual(self.server.requests, [])
+
+        del self.server.routes['/api/v1/']
+        client = self.client(api_token='token2')
+        self.assertEqual(client.stats.stats_ep, '/api/v1/stats')
+        self.assertEqual(self.paths(), ['/api/v1/'])
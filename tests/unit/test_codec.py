@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from onapie import codec
+from onapie.utils import Connection
+from tests.utils import MockResponse
+import unittest
+
+
+class CodecTestCase(unittest.TestCase):
+
+    def test_every_installed_backend_decodes_bytes_and_text(self):
+        document = u'{"name": "Zoë", "ages": [1, 2.5, null, true]}'
+        expected = {u'name': u'Zoë', u'ages': [1, 2.5, None, True]}
+        for name in codec.CODECS:
+            backend = codec.get_codec(name)
+            self.assertEqual(backend.loads(document.encode('utf-8')),
+                             expected, name)
+            self.assertEqual(backend.loads(document), expected, name)
+            with self.assertRaises(ValueError):
+                backend.loads(b'{"name": ')
+
+    def test_prefers_the_fastest_backend(self):
+        expected = next(name for name in codec.PREFERENCE
+                        if name in codec.CODECS)
+        self.assertEqual(codec.get_codec().name, expected)
+
+    def test_dumps_is_stable_across_backends(self):
+        for name in codec.CODECS:
+            self.assertEqual(codec.get_codec(name).dumps({'a': [1]}),
+                             '{"a": [1]}')
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            codec.get_codec('simdjson-nope')
+
+    def test_connection_decodes_response_bytes(self):
+        conn = Connection('http://mock_host', json_backend='json')
+        self.assertEqual(conn.codec.name, 'json')
+        self.assertEqual(conn.decode_json(MockResponse(200, 'OK', u'["é"]')),
+                         [u'é'])
@@ -0,0 +1,117 @@
+from onapie.columns import CATEGORY, DATE, DATETIME, FLOAT, INTEGER, OBJECT
+from onapie.columns import ColumnBuilder, iter_column_batches, parse_timestamp
+from onapie.columns import to_columns, value_fields
+from onapie.data import DataManager
+from onapie.ona_schema import OnaForm
+from onapie.utils import Connection
+import mock
+import unittest
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+SCHEMA = {
+    'name': 'survey',
+    'id_string': 'survey',
+    'children': [
+        {'name': 'age', 'type': 'integer'},
+        {'name': 'weight', 'type': 'decimal'},
+        {'name': 'dob', 'type': 'date'},
+        {'name': 'gender', 'type': 'select one',
+         'children': [{'name': 'male'}, {'name': 'female'}]},
+        {'name': 'details', 'type': 'group', 'children': [
+            {'name': 'comment', 'type': 'text'},
+            {'name': 'location', 'type': 'geopoint'}]},
+        {'name': 'children', 'type': 'repeat', 'children': [
+            {'name': 'child_name', 'type': 'text'}]},
+    ]
+}
+
+RECORDS = [
+    {'_id': 1, '_submission_time': '2015-01-01T10:00:00',
+     'age': '25', 'weight': '60.5', 'dob': '1990-01-01', 'gender': 'female',
+     'details/comment': 'ok', 'details/location': '-1.2 36.8 1700 5',
+     'children': [{'children/child_name': 'a'}]},
+    {'_id': 2, '_submission_time': '2015-01-02T10:00:00+03:00',
+     'age': 'n/a', 'gender': 'other'},
+]
+
+
+class ParseTimestampTestCase(unittest.TestCase):
+
+    def test_parses_dates_and_offsets(self):
+        self.assertEqual(parse_timestamp('1970-01-02'), 86400)
+        self.assertEqual(parse_timestamp('1970-01-01T03:00:00.500+03:00'),
+                         0.5)
+        self.assertEqual(parse_timestamp('1970-01-01T00:01:00Z'), 60)
+        self.assertIsNone(parse_timestamp('yesterday'))
+
+
+class ValueFieldsTestCase(unittest.TestCase):
+
+    def test_skips_groups_repeats_and_their_fields(self):
+        self.assertEqual(
+            [field['xpath'] for field in value_fields(OnaForm(SCHEMA))],
+            ['age', 'weight', 'dob', 'gender', 'details/comment',
+             'details/location'])
+
+
+class ToColumnsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ToColumnsTestCase, self).setUp()
+        self.columns = to_columns(OnaForm(SCHEMA), RECORDS)
+
+    def test_column_kinds(self):
+        kinds = dict((name, c.kind) for name, c in self.columns.items())
+        self.assertEqual(kinds, {
+            '_id': INTEGER, '_submission_time': DATETIME, 'age': INTEGER,
+            'weight': FLOAT, 'dob': DATE, 'gender': CATEGORY,
+            'details/comment': OBJECT,
+            'details/_location_latitude': FLOAT,
+            'details/_location_longitude': FLOAT,
+            'details/_location_altitude': FLOAT,
+            'details/_location_precision': FLOAT})
+
+    def test_values(self):
+        self.assertEqual(self.columns['age'].to_list(), [25, None])
+        self.assertEqual(self.columns['weight'].to_list(), [60.5, None])
+        self.assertEqual(self.columns['details/_location_latitude']
+                         .to_list(), [-1.2, None])
+        self.assertEqual(self.columns['_submission_time'].to_list(),
+                         [1420106400, 1420182000])
+
+    def test_categories_extend_with_unseen_values(self):
+        gender = self.columns['gender']
+        self.assertEqual(gender.categories, ['male', 'female', 'other'])
+        self.assertEqual(list(gender.data), [1, 2])
+        self.assertEqual(gender.to_list(), ['female', 'other'])
+
+    def test_batches(self):
+        batches = list(iter_column_batches(OnaForm(SCHEMA), RECORDS * 3, 4))
+        self.assertEqual([len(b['_id']) for b in batches], [4, 2])
+
+
+@unittest.skipIf(pandas is None, 'pandas is not installed')
+class GetFrameTestCase(unittest.TestCase):
+
+    def test_get_frame_dtypes(self):
+        datamgr = DataManager(Connection('http://mock_host'), '/data')
+        with mock.patch.object(datamgr, 'iter',
+                               return_value=iter(RECORDS)) as mock_iter:
+            frame = datamgr.get_frame('pk', OnaForm(SCHEMA))
+
+        args = mock_iter.call_args[0]
+        self.assertEqual(args[:2], ('pk', 1000))
+        self.assertEqual(args[2].projection,
+                         ColumnBuilder(OnaForm(SCHEMA)).xpaths())
+        self.assertEqual(str(frame['age'].dtype), 'Int64')
+        self.assertEqual(str(frame['weight'].dtype), 'float64')
+        self.assertEqual(str(frame['gender'].dtype), 'category')
+        self.assertEqual(str(frame['_submission_time'].dtype),
+                         'datetime64[ms, UTC]')
+        self.assertTrue(frame['dob'].isnull()[1])
+        self.assertEqual(frame['age'].sum(), 25)
@@ -0,0 +1,107 @@
+from onapie.compression import accept_encoding, negotiate
+from onapie.metrics import MetricsCollector
+from onapie.utils import Connection
+from tests.utils import StubServer
+import gzip
+import io
+import json
+import unittest
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import httpx  # NOQA
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+RECORDS = [{'_id': i, 'name': 'respondent', 'district': 'north'}
+           for i in range(1000)]
+BODY = json.dumps(RECORDS).encode('utf-8')
+
+
+def gzipped(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class NegotiateTestCase(unittest.TestCase):
+
+    def test_accept_encoding(self):
+        self.assertEqual(accept_encoding(('br', 'gzip', 'deflate')),
+                         'br, gzip;q=0.9, deflate;q=0.8')
+        self.assertEqual(accept_encoding(()), 'identity')
+
+    def test_negotiate(self):
+        supported = ('br', 'gzip', 'deflate')
+        self.assertEqual(negotiate(None, supported), supported)
+        self.assertEqual(negotiate('gzip', supported), ('gzip',))
+        self.assertEqual(negotiate(['zstd', 'gzip'], supported), ('gzip',))
+        self.assertEqual(negotiate(False, supported), ())
+
+        with self.assertRaises(ValueError):
+            negotiate(['lzma'], supported)
+
+
+class ConnectionCompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ConnectionCompressionTestCase, self).setUp()
+        self.routes = {
+            '/gzip': (200, gzipped(BODY), {'Content-Encoding': 'gzip'}),
+            '/deflate': (200, zlib.compress(BODY),
+                         {'Content-Encoding': 'deflate'}),
+        }
+        if brotli is not None:
+            self.routes['/br'] = (200, brotli.compress(BODY),
+                                  {'Content-Encoding': 'br'})
+        if zstandard is not None:
+            self.routes['/zstd'] = (
+                200, zstandard.ZstdCompressor().compress(BODY),
+                {'Content-Encoding': 'zstd'})
+
+    def test_offers_what_the_transport_decodes(self):
+        conn = Connection('http://host', compression=['zstd', 'gzip'])
+        self.assertEqual(conn.session.headers['Accept-Encoding'], 'gzip')
+
+        conn = Connection('http://host', compression=False)
+        self.assertEqual(conn.session.headers['Accept-Encoding'], 'identity')
+
+    def test_set_header_keeps_the_defaults(self):
+        conn = Connection('http://host', user_agent='onapie-tests')
+        conn.set_header('Authorization', 'Token t0k3n')
+        self.assertEqual(conn.session.headers['User-Agent'], 'onapie-tests')
+        self.assertIn('gzip', conn.session.headers['Accept-Encoding'])
+        self.assertEqual(conn.session.headers['Accept'], '*/*')
+
+    def check_decodes(self, transport=None):
+        metrics = MetricsCollector()
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url, hooks=[metrics],
+                              transport=transport)
+            for path in sorted(self.routes):
+                self.assertEqual(conn.decode_json(conn.get(path)), RECORDS)
+                self.assertEqual(list(conn.iter_json(path, chunk_size=256)),
+                                 RECORDS)
+
+        self.assertIn('gzip', server.requests[0][2]['Accept-Encoding'])
+        for path, (_, body, _) in self.routes.items():
+            summary = metrics.summary()['GET {}'.format(path)]
+            self.assertEqual(summary['bytes'], 2 * len(BODY))
+            self.assertEqual(summary['wire_bytes'], 2 * len(body))
+            self.assertGreater(summary['compression_ratio'], 5)
+
+    def test_decodes_and_reports_wire_bytes(self):
+        self.routes.pop('/zstd', None)
+        self.check_decodes()
+
+    @unittest.skipIf(zstandard is None, 'httpx or zstandard not installed')
+    def test_decodes_zstd_over_httpx(self):
+        self.check_decodes('httpx')
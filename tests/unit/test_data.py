@@ -1,5 +1,7 @@
 from onapie.data import DataManager
-from onapie.utils import ConnectionSingleton
+from onapie.exceptions import ClientException
+from onapie.query import DataQuery
+from onapie.utils import Connection
 from tests.utils import MockResponse
 import mock
 import unittest
@@ -9,15 +11,16 @@ mock_http_call = mock.Mock()
 mock_http_call.return_value = MockResponse(200, 'OK', '{}')
 
 
-@mock.patch.multiple(ConnectionSingleton,
+@mock.patch.multiple(Connection,
                      get=mock_http_call,
+                     post=mock_http_call,
                      delete=mock_http_call)
 class DataManagerTestCase(unittest.TestCase):
 
     def setUp(self):
         super(DataManagerTestCase, self).setUp()
         self.path = '/some/path'
-        self.conn = ConnectionSingleton('http://mock_host')
+        self.conn = Connection('http://mock_host')
         self.datamgr = DataManager(self.conn, self.path)
 
     def test_list_all_endpoints_call(self):
@@ -39,12 +42,43 @@ class DataManagerTestCase(unittest.TestCase):
     def test_get_data_by_query_call(self):
         self.datamgr.get('pk', None, foo1='bar1', foo2='bar2')
         self.conn.get.assert_called_with(
-            '%s/pk?query={"foo1": "bar1", "foo2": "bar2"}' % (self.path))
+            '{}/pk?query=%7B%22foo1%22%3A+%22bar1%22%2C+%22foo2%22%3A+'
+            '%22bar2%22%7D'.format(self.path))
 
     def test_get_data_by_tag_call(self):
         self.datamgr.get('pk', None, 'foo1', 'bar1', 'foo2', 'bar2')
         self.conn.get.assert_called_with(
-            '{}/pk?tags=foo1,bar1,foo2,bar2'.format(self.path))
+            '{}/pk?tags=foo1%2Cbar1%2Cfoo2%2Cbar2'.format(self.path))
+
+    def test_get_many_call(self):
+        results = list(self.datamgr.get_many(['pk1', 'pk2'], foo1='bar1'))
+        self.assertEqual(sorted(r.key for r in results), ['pk1', 'pk2'])
+        self.conn.get.assert_any_call(
+            '{}/pk2?query=%7B%22foo1%22%3A+%22bar1%22%7D'.format(self.path))
+
+    def test_query_call(self):
+        self.datamgr.query('pk', DataQuery().fields('_id').slice(10, 5))
+        self.conn.get.assert_called_with(
+            '{}/pk?fields=%5B%22_id%22%5D&start=10&limit=5'.format(self.path))
+
+    def test_set_tag_call(self):
+        self.datamgr.set_tag('pk', 'data_id', 'foo', 'bar')
+        self.conn.post.assert_called_with(
+            '{}/pk/data_id/labels'.format(self.path),
+            payload={'tags': 'foo,bar'})
+
+    def test_bulk_tag_and_untag(self):
+        result = self.datamgr.bulk_tag('pk', [1, 2, 2, 3], ['foo'])
+        self.assertEqual(sorted(result.succeeded), [1, 2, 3])
+        self.assertEqual(result.failed, [])
+        self.conn.post.assert_any_call(
+            '{}/pk/2/labels'.format(self.path), payload={'tags': 'foo'})
+
+        result = self.datamgr.bulk_untag('pk', [1, 1], ['foo', 'bar'])
+        self.assertEqual(sorted(result.succeeded),
+                         [(1, 'bar'), (1, 'foo')])
+        self.conn.delete.assert_any_call(
+            '{}/pk/1/labels/bar'.format(self.path))
 
     def test_delete_data_tag_call(self):
         self.datamgr.delete_tag('pk', 'data_id', 'tag')
@@ -56,3 +90,60 @@ class DataManagerTestCase(unittest.TestCase):
         self.datamgr.get_enketo_editlink('pk', 'dataid', return_url)
         self.conn.delete.assert_called_with(
             '{}/pk/dataid/enketo?return_url={}'.format(self.path, return_url))
+
+
+class DataManagerIterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(DataManagerIterTestCase, self).setUp()
+        self.path = '/some/path'
+        self.conn = Connection('http://mock_host')
+        self.datamgr = DataManager(self.conn, self.path)
+
+    def test_iter_walks_pages(self):
+        pages = [MockResponse(200, 'OK', '[{"_id": 1}, {"_id": 2}]'),
+                 MockResponse(200, 'OK', '[{"_id": 3}]')]
+        with mock.patch.object(self.conn, 'get',
+                               side_effect=pages) as mock_get:
+            records = list(self.datamgr.iter('pk', page_size=2))
+
+        self.assertEqual([r['_id'] for r in records], [1, 2, 3])
+        mock_get.assert_has_calls([
+            mock.call('{}/pk?page=1&page_size=2'.format(self.path),
+                      None, stream=True),
+            mock.call('{}/pk?page=2&page_size=2'.format(self.path),
+                      None, stream=True)])
+
+    def test_iter_stops_on_page_not_found(self):
+        pages = [MockResponse(200, 'OK', '[{"_id": 1}]'),
+                 ClientException(None, MockResponse(404, 'Not Found'))]
+        with mock.patch.object(self.conn, 'get', side_effect=pages):
+            records = list(self.datamgr.iter('pk', page_size=1))
+
+        self.assertEqual(records, [{'_id': 1}])
+
+    def test_iter_raises_on_first_page_error(self):
+        pages = [ClientException(None, MockResponse(404, 'Not Found'))]
+        with mock.patch.object(self.conn, 'get', side_effect=pages):
+            with self.assertRaises(ClientException):
+                list(self.datamgr.iter('pk'))
+
+    def test_iter_with_query_and_tags(self):
+        pages = [MockResponse(200, 'OK', '[]')]
+        with mock.patch.object(self.conn, 'get',
+                               side_effect=pages) as mock_get:
+            list(self.datamgr.iter('pk', 10, {'foo': 'bar'}, ['t1', 't2']))
+
+        mock_get.assert_called_with(
+            '{}/pk?query=%7B%22foo%22%3A+%22bar%22%7D&tags=t1%2Ct2'
+            '&page=1&page_size=10'.format(self.path), None, stream=True)
+
+    def test_iter_without_pagination(self):
+        pages = [MockResponse(200, 'OK', '[{"_id": 1}, {"_id": 2}]')]
+        with mock.patch.object(self.conn, 'get',
+                               side_effect=pages) as mock_get:
+            records = list(self.datamgr.iter('pk', None, tags=['t1']))
+
+        self.assertEqual(records, [{'_id': 1}, {'_id': 2}])
+        mock_get.assert_called_once_with(
+            '{}/pk?tags=t1'.format(self.path), None, stream=True)
@@ -0,0 +1,198 @@
+from onapie.exceptions import ClientException
+from onapie.exports import ExportJob
+from onapie.utils import Connection
+from onapie.xlsforms import XlsFormsManager
+from tests.utils import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+
+CONTENT = os.urandom(1024 * 1024)
+REBUILT = os.urandom(1024 * 1024)
+
+
+class FlakyExportServer(object):
+    """Serves CONTENT at any path, dropping the first `drops` connections
+    half way through the body and honouring Range requests unless
+    `ranges` is False
+
+    Range requests are answered by closing the connection `refusals`
+    times. With `rebuild` the export changes to REBUILT, with a new ETag,
+    after the first response.
+    """
+
+    def __init__(self, drops=1, ranges=True, refusals=0, rebuild=False):
+        self.drops = drops
+        self.refusals = refusals
+        self.ranges = []
+        self.encodings = []
+        self.if_ranges = []
+        self.authorizations = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                start = 0
+                range_header = self.headers.get('Range')
+                if_range = self.headers.get('If-Range')
+                content, etag = CONTENT, '"v1"'
+                if rebuild and server.ranges:
+                    content, etag = REBUILT, '"v2"'
+                server.ranges.append(range_header)
+                server.encodings.append(self.headers.get('Accept-Encoding'))
+                server.if_ranges.append(if_range)
+                server.authorizations.append(
+                    self.headers.get('Authorization'))
+                if range_header and server.refusals:
+                    server.refusals -= 1
+                    self.close_connection = True
+                    return
+                if if_range is not None and if_range != etag:
+                    range_header = None
+                if range_header and ranges:
+                    start = int(range_header.split('=')[1].rstrip('-'))
+                    if start >= len(CONTENT):
+                        self.send_response(416)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                else:
+                    self.send_response(200)
+                body = content[start:]
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if server.drops:
+                    server.drops -= 1
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DownloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(DownloadTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.dest = os.path.join(self.directory, 'export.xls')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(DownloadTestCase, self).tearDown()
+
+    def serve(self, **kwargs):
+        server = FlakyExportServer(**kwargs)
+        self.addCleanup(server.close)
+        return server
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as dest:
+            return dest.read()
+
+    def test_resumes_with_range_after_dropped_connection(self):
+        server = self.serve(drops=2)
+        xlsmgr = XlsFormsManager(Connection(server.url), '/api/v1/forms')
+        written = xlsmgr.export_to('pk', 'xls', self.dest)
+
+        self.assertEqual(written, len(CONTENT))
+        self.assertEqual(self.read_dest(), CONTENT)
+        self.assertIsNone(server.ranges[0])
+        # Only whole chunks are written, a partial chunk is fetched again
+        offset = int(server.ranges[1].split('=')[1].rstrip('-'))
+        self.assertTrue(0 < offset <= len(CONTENT) // 2)
+
+    def test_exports_on_another_host(self):
+        server = self.serve(drops=0)
+        conn = Connection('http://127.0.0.1:1')
+        conn.set_header('Authorization', 'Token t0k3n')
+        job = ExportJob(1, 'xls', 'uuid', 'SUCCESS',
+                        server.url + '/export.xls?signature=abc')
+        written = XlsFormsManager(conn, '/api/v1/forms').download_export(
+            job, self.dest)
+
+        self.assertEqual(written, len(CONTENT))
+        # The API token isn't handed to the storage host
+        self.assertEqual(server.authorizations, [None])
+
+    def test_restarts_when_the_export_changes(self):
+        server = self.serve(drops=1, rebuild=True)
+        written = Connection(server.url).download('/export.xls', self.dest)
+
+        self.assertEqual(server.if_ranges, [None, '"v1"'])
+        self.assertEqual(written, len(REBUILT))
+        self.assertEqual(self.read_dest(), REBUILT)
+
+    def test_retries_failed_resume_requests(self):
+        server = self.serve(drops=1, refusals=2)
+        written = Connection(server.url, max_retries=0).download(
+            '/export.xls', self.dest)
+
+        self.assertEqual(written, len(CONTENT))
+        self.assertEqual(self.read_dest(), CONTENT)
+        self.assertEqual(len(server.ranges), 4)
+
+    def test_restarts_when_server_ignores_range(self):
+        server = self.serve(drops=1, ranges=False)
+        dest = io.BytesIO(b'header')
+        dest.seek(0, io.SEEK_END)
+        written = Connection(server.url).download('/export.xls', dest)
+
+        self.assertEqual(written, len(CONTENT))
+        self.assertEqual(dest.getvalue(), b'header' + CONTENT)
+
+    def test_gives_up_after_max_resumes(self):
+        server = self.serve(drops=3)
+        with self.assertRaises(Exception):
+            Connection(server.url).download('/export.xls', self.dest,
+                                            max_resumes=1)
+
+    def test_resume_partial_file(self):
+        with open(self.dest, 'wb') as dest:
+            dest.write(CONTENT[:1000])
+        server = self.serve(drops=0)
+        written = Connection(server.url).download('/export.xls', self.dest,
+                                                  resume=True)
+
+        self.assertEqual(written, len(CONTENT))
+        self.assertEqual(self.read_dest(), CONTENT)
+        self.assertEqual(server.ranges, ['bytes=1000-'])
+        # Range offsets are into the uncompressed body
+        self.assertEqual(server.encodings, ['identity'])
+
+    def test_resume_complete_file(self):
+        with open(self.dest, 'wb') as dest:
+            dest.write(CONTENT)
+        server = self.serve(drops=0)
+        self.assertEqual(Connection(server.url).download(
+            '/export.xls', self.dest, resume=True), len(CONTENT))
+
+    def test_http_errors_are_raised(self):
+        server = self.serve(drops=0)
+        with self.assertRaises(ClientException):
+            Connection(server.url).download('/export.xls', self.dest,
+                                            {'Range': 'bytes=999999999-'})
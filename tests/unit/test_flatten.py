@@ -0,0 +1,109 @@
+from onapie.flatten import Flattener, iter_flat_batches
+from onapie.ona_schema import OnaForm
+import unittest
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+SCHEMA = {
+    'name': 'household',
+    'id_string': 'household',
+    'children': [
+        {'name': 'district', 'type': 'select one',
+         'children': [{'name': 'north'}, {'name': 'south'}]},
+        {'name': 'intro', 'type': 'note'},
+        {'name': 'head', 'type': 'group', 'children': [
+            {'name': 'name', 'type': 'text'},
+            {'name': 'members', 'type': 'repeat', 'children': [
+                {'name': 'name', 'type': 'text'},
+                {'name': 'details', 'type': 'group', 'children': [
+                    {'name': 'age', 'type': 'integer'}]},
+                {'name': 'visits', 'type': 'repeat', 'children': [
+                    {'name': 'date', 'type': 'date'}]}]}]},
+        {'name': 'crops', 'type': 'repeat', 'children': [
+            {'name': 'crop', 'type': 'text'}]},
+    ]
+}
+
+MEMBERS = 'head/members'
+VISITS = 'head/members/visits'
+
+RECORDS = [
+    {'_id': 1, '_submission_time': '2015-01-01T10:00:00',
+     'district': 'north', 'head/name': 'Amina',
+     MEMBERS: [
+         {'head/members/name': 'Juma', 'head/members/details/age': '7',
+          VISITS: [{'head/members/visits/date': '2015-01-02'},
+                   {'head/members/visits/date': '2015-02-02'}]},
+         {'head/members/name': 'Neema',
+          VISITS: [{'head/members/visits/date': '2015-03-02'}]}],
+     'crops': [{'crops/crop': 'maize'}]},
+    {'_id': 2, 'district': 'south',
+     MEMBERS: [{'head/members/name': 'Baraka'}]},
+]
+
+
+class FlattenerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(FlattenerTestCase, self).setUp()
+        self.flattener = Flattener(OnaForm(SCHEMA))
+
+    def test_plan(self):
+        self.assertEqual(self.flattener.tables,
+                         ['household', MEMBERS, VISITS, 'crops'])
+        self.assertEqual(self.flattener.columns['household'], (
+            '_id', '_submission_time', 'district', 'head/name'))
+        self.assertEqual(self.flattener.columns[MEMBERS], (
+            '_id', '_index', '_parent_index', 'head/members/name',
+            'head/members/details/age'))
+        self.assertEqual(self.flattener.xpaths(), [
+            '_id', '_submission_time', 'district', 'head/name', MEMBERS,
+            'crops'])
+
+    def test_flatten(self):
+        tables = self.flattener.flatten(RECORDS)
+        self.assertEqual(tables['household'], [
+            (1, '2015-01-01T10:00:00', 'north', 'Amina'),
+            (2, None, 'south', None)])
+        self.assertEqual(tables[MEMBERS], [
+            (1, 1, None, 'Juma', '7'), (1, 2, None, 'Neema', None),
+            (2, 1, None, 'Baraka', None)])
+        # Visits point at the member they were nested in
+        self.assertEqual(tables[VISITS], [
+            (1, 1, 1, '2015-01-02'), (1, 2, 1, '2015-02-02'),
+            (1, 3, 2, '2015-03-02')])
+        self.assertEqual(tables['crops'], [(1, 1, None, 'maize')])
+
+    def test_fields_drop_empty_repeats(self):
+        flattener = Flattener(OnaForm(SCHEMA), fields=[
+            'district', 'head/members/visits/date'], include_meta=False)
+        self.assertEqual(flattener.columns, {
+            'household': ('_id', 'district'),
+            MEMBERS: ('_id', '_index', '_parent_index'),
+            VISITS: ('_id', '_index', '_parent_index',
+                     'head/members/visits/date')})
+
+        tables = flattener.flatten(RECORDS)
+        self.assertEqual(tables[MEMBERS][1], (1, 2, None))
+        self.assertEqual(len(tables[VISITS]), 3)
+
+    def test_iter_flat_batches(self):
+        batches = list(iter_flat_batches(OnaForm(SCHEMA), iter(RECORDS),
+                                         batch_size=1))
+        self.assertEqual([len(b[MEMBERS]) for b in batches], [2, 1])
+        # Indexes count within a submission, so batches don't shift them
+        self.assertEqual(batches[1][MEMBERS][0][:2], (2, 1))
+
+    @unittest.skipIf(pandas is None, 'pandas is not installed')
+    def test_to_frames(self):
+        frames = self.flattener.to_frames(self.flattener.flatten(RECORDS))
+        members = frames[MEMBERS]
+        self.assertEqual(list(members.columns),
+                         list(self.flattener.columns[MEMBERS]))
+        joined = members.merge(frames['household'], on='_id')
+        self.assertEqual(list(joined['district']),
+                         ['north', 'north', 'south'])
@@ -0,0 +1,135 @@
+from onapie.exceptions import ClientException
+from onapie.metrics import MetricsCollector, RequestEvent, path_template
+from onapie.metrics import percentile
+from onapie.utils import Connection
+from tests.utils import StubServer
+import threading
+import unittest
+
+
+class PathTemplateTestCase(unittest.TestCase):
+
+    def test_replaces_ids_and_query_values(self):
+        self.assertEqual(path_template('/api/v1/data/12/345'),
+                         '/api/v1/data/{id}/{id}')
+        self.assertEqual(
+            path_template('/api/v1/data/12?page_size=10&page=2&query=x'),
+            '/api/v1/data/{id}?page&page_size&query')
+        self.assertEqual(path_template('/api/v1/forms/1/form.json'),
+                         '/api/v1/forms/{id}/form.json')
+        self.assertEqual(
+            path_template('/api/v1/forms/4b2bce1c9fe1476c8a0a5b1a4f0f3a1d'),
+            '/api/v1/forms/{id}')
+
+
+class MetricsCollectorTestCase(unittest.TestCase):
+
+    def test_percentile(self):
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertEqual(percentile([1, 2], 50), 1.5)
+        self.assertIsNone(percentile([], 50))
+
+    def test_aggregates_per_endpoint(self):
+        metrics = MetricsCollector()
+        for elapsed in [0.1, 0.2, 0.3, 0.4]:
+            metrics(RequestEvent('GET', 'url', '/data/{id}', 200, 100,
+                                 0.05, elapsed))
+        metrics(RequestEvent('GET', 'url', '/data/{id}', 500, 0, 0.05, 1.0,
+                             retries=2))
+        metrics(RequestEvent('GET', 'url', '/forms', 200, 10, 0.01, 0.01))
+
+        summary = metrics.summary()
+        data = summary['GET /data/{id}']
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(data['errors'], 1)
+        self.assertEqual(data['retries'], 2)
+        self.assertEqual(data['bytes'], 400)
+        self.assertEqual(data['elapsed']['p50'], 0.3)
+        self.assertEqual(data['elapsed']['max'], 1.0)
+        self.assertEqual(data['histogram']['0.5'], 2)
+        self.assertEqual(metrics.slowest(1), [('GET /data/{id}', 0.76)])
+        self.assertEqual(metrics.endpoints(),
+                         ['GET /data/{id}', 'GET /forms'])
+
+
+class ConnectionHooksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ConnectionHooksTestCase, self).setUp()
+        self.events = []
+        self.routes = {'/api/v1/data/1?page=1': (200, '[{"_id": 1}]')}
+
+    def test_reports_completed_requests(self):
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url, hooks=[self.events.append])
+            conn.get('/api/v1/data/1?page=1')
+
+        event, = self.events
+        self.assertEqual(event.endpoint, 'GET /api/v1/data/{id}?page')
+        self.assertEqual((event.status, event.bytes, event.retries),
+                         (200, 12, 0))
+        self.assertIsNone(event.error)
+        self.assertTrue(0 <= event.ttfb <= event.elapsed)
+
+    def test_reports_streamed_requests_once_read(self):
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url)
+            conn.add_hook(self.events.append)
+            records = conn.iter_json('/api/v1/data/1?page=1')
+            self.assertEqual(self.events, [])
+            self.assertEqual(list(records), [{'_id': 1}])
+
+        event, = self.events
+        self.assertEqual(event.bytes, 12)
+
+    def test_reports_failed_requests(self):
+        metrics = MetricsCollector()
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url, hooks=[metrics])
+            with self.assertRaises(ClientException):
+                conn.get('/api/v1/missing')
+
+        self.assertEqual(metrics.summary()['GET /api/v1/missing']['errors'],
+                         1)
+
+    def test_reports_failed_streamed_requests(self):
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url, hooks=[self.events.append])
+            with self.assertRaises(ClientException) as context:
+                conn.iter_json('/api/v1/missing')
+
+        event, = self.events
+        self.assertEqual((event.status, event.bytes), (404, 23))
+        self.assertEqual(context.exception.api_response.content,
+                         b'{"detail": "Not found"}')
+
+    def test_broken_hook_does_not_break_requests(self):
+        def broken(event):
+            raise ValueError()
+
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url, hooks=[broken])
+            self.assertEqual(conn.get('/api/v1/data/1?page=1').status_code,
+                             200)
+
+    def test_last_response_is_per_thread(self):
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url)
+            conn.get('/api/v1/data/1?page=1')
+            seen = []
+            thread = threading.Thread(
+                target=lambda: seen.append(conn.last_response))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(conn.last_response.status_code, 200)
+        self.assertEqual(seen, [None])
+
+    def test_decode_profiler(self):
+        with StubServer(self.routes) as server:
+            conn = Connection(server.url, profile_decode=True)
+            self.assertEqual(conn.decode_json(
+                conn.get('/api/v1/data/1?page=1')), [{'_id': 1}])
+
+        self.assertEqual(conn.decode_profiler.calls, 1)
+        self.assertGreater(conn.decode_profiler.stats().total_calls, 0)
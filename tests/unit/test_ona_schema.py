@@ -3,6 +3,35 @@ import unittest
 from onapie.ona_schema import OnaSchemaNode, OnaForm
 
 
+SCHEMA = {
+    OnaSchemaNode.NAME: 'personnel_form',
+    OnaSchemaNode.LABEL: 'Personnel',
+    OnaSchemaNode.ID_STRING: 'personnel_form',
+    OnaSchemaNode.CHILDREN: [
+        {
+            OnaSchemaNode.NAME: 'personal_details',
+            OnaSchemaNode.TYPE: 'group',
+            OnaSchemaNode.CHILDREN: [
+                {OnaSchemaNode.NAME: 'first_name',
+                 OnaSchemaNode.TYPE: 'text'},
+                {OnaSchemaNode.NAME: 'gender',
+                 OnaSchemaNode.TYPE: 'select one',
+                 OnaSchemaNode.CHILDREN: [{OnaSchemaNode.NAME: 'male'},
+                                          {OnaSchemaNode.NAME: 'female'}]},
+            ]
+        },
+        {OnaSchemaNode.NAME: 'age', OnaSchemaNode.TYPE: 'integer'},
+        {
+            OnaSchemaNode.NAME: 'children',
+            OnaSchemaNode.TYPE: 'repeat',
+            OnaSchemaNode.CHILDREN: [
+                {OnaSchemaNode.NAME: 'age', OnaSchemaNode.TYPE: 'integer'},
+            ]
+        },
+    ]
+}
+
+
 class TestOnaSchemaNode(unittest.TestCase):
     def test_sets_xpath_to_name_if_parents_is_none(self):
         node = OnaSchemaNode({OnaSchemaNode.NAME: 'age'})
@@ -50,3 +79,46 @@ class TestOnaForm(unittest.TestCase):
             'personal_details/first_name',
             'personal_details/last_name',
         ]))
+
+    def test_one_node_per_field_shared_with_the_tree(self):
+        form = OnaForm(SCHEMA)
+        group = form.children[0]
+
+        self.assertIs(group, form['personal_details'])
+        self.assertIs(group.children[1], form['personal_details/gender'])
+        self.assertEqual(group.children[1].xpath, 'personal_details/gender')
+
+    def test_select_choices_are_not_fields(self):
+        form = OnaForm(SCHEMA)
+        self.assertFalse(form.has_field('personal_details/gender/male'))
+        self.assertEqual(form['personal_details/gender'].children,
+                         [{OnaSchemaNode.NAME: 'male'},
+                          {OnaSchemaNode.NAME: 'female'}])
+
+    def test_fields_are_not_shared_between_forms(self):
+        form = OnaForm(SCHEMA)
+        other = OnaForm({OnaSchemaNode.NAME: 'other',
+                         OnaSchemaNode.CHILDREN: []})
+        self.assertEqual(len(form.fields()), 6)
+        self.assertEqual(other.fields(), [])
+
+    def test_indexes(self):
+        form = OnaForm(SCHEMA)
+        self.assertEqual([f.xpath for f in form.fields_by_name('age')],
+                         ['age', 'children/age'])
+        self.assertEqual([f.xpath for f in form.fields_by_type('integer')],
+                         ['age', 'children/age'])
+        self.assertEqual(
+            [f.xpath for f in form.fields_by_type('repeat', 'group')],
+            ['personal_details', 'children'])
+        self.assertIs(form.group_of('personal_details/gender'),
+                      form['personal_details'])
+        self.assertIsNone(form.group_of('age'))
+        self.assertIs(form.repeat_of('children/age'), form['children'])
+        self.assertIsNone(form.repeat_of('personal_details/gender'))
+
+    def test_attribute_access(self):
+        form = OnaForm(SCHEMA)
+        self.assertEqual(form.id_string, 'personnel_form')
+        self.assertEqual(form.label(), 'Personnel')
+        self.assertFalse(hasattr(form['age'], 'label_text'))
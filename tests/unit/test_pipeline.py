@@ -0,0 +1,142 @@
+from onapie import pipeline
+from onapie.data import DataManager
+from onapie.exceptions import ClientException
+from onapie.ona_schema import OnaForm
+from onapie.utils import Connection
+from tests.unit.test_ona_schema import SCHEMA
+from tests.utils import MockResponse
+import json
+import mock
+import unittest
+
+
+try:
+    from urllib.parse import parse_qs, urlparse  # NOQA
+except ImportError:
+    from urlparse import parse_qs, urlparse  # NOQA
+
+
+def page(start, count):
+    return json.dumps([{'_id': i, 'age': str(i)}
+                       for i in range(start, start + count)]).encode('utf-8')
+
+
+def parse_backend(content):
+    return 0, pipeline._codec.name
+
+
+class IterPipelinedTestCase(unittest.TestCase):
+
+    def test_pages_come_back_in_order(self):
+        pages = dict((n, page((n - 1) * 3, 3)) for n in range(1, 6))
+        pages[6] = page(15, 1)
+        fetched = []
+
+        def fetch(n):
+            fetched.append(n)
+            return pages.get(n)
+
+        batches = list(pipeline.iter_pipelined(
+            fetch, pipeline.parse_records, 3, processes=2))
+        self.assertEqual([r['_id'] for batch in batches for r in batch],
+                         list(range(16)))
+        self.assertLessEqual(max(fetched), 7)
+
+    def test_stops_when_fetch_runs_out(self):
+        pages = {1: page(0, 2), 2: page(2, 2)}
+        batches = list(pipeline.iter_pipelined(
+            pages.get, pipeline.parse_records, 2, processes=1))
+        self.assertEqual(len(batches), 2)
+
+    def test_stops_fetching_after_an_empty_page(self):
+        fetched = []
+
+        def fetch(n):
+            fetched.append(n)
+            return page(0, 2) if n == 1 else b'[]'
+
+        batches = list(pipeline.iter_pipelined(
+            fetch, pipeline.parse_records, 2, processes=2, prefetch=8))
+        self.assertEqual(len(batches), 1)
+        # Only the page in flight when the empty one arrived is fetched
+        self.assertLessEqual(max(fetched), 3)
+
+    def test_page_size_is_required(self):
+        for page_size in (None, 0):
+            with self.assertRaises(ValueError):
+                next(pipeline.iter_pipelined(
+                    {1: page(0, 2)}.get, pipeline.parse_records, page_size))
+
+    def test_workers_decode_with_the_chosen_backend(self):
+        self.assertEqual(list(pipeline.iter_pipelined(
+            {1: page(0, 1)}.get, parse_backend, 2, processes=1,
+            json_backend='json')), ['json'])
+
+    def test_worker_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            list(pipeline.iter_pipelined(
+                {1: b'not json'}.get, pipeline.parse_records, 2,
+                processes=1))
+
+
+class DataManagerIterParallelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(DataManagerIterParallelTestCase, self).setUp()
+        self.conn = Connection('http://mock_host')
+        self.datamgr = DataManager(self.conn, '/data')
+        self.form = OnaForm(SCHEMA)
+
+    def get(self, path):
+        if 'page=1&' in path:
+            return MockResponse(200, 'OK', page(0, 2).decode('utf-8'))
+        if 'page=2&' in path:
+            return MockResponse(200, 'OK', page(2, 1).decode('utf-8'))
+        raise ClientException(None, MockResponse(404, 'Not Found'))
+
+    def test_tuples(self):
+        with mock.patch.object(self.conn, 'get', side_effect=self.get) as m:
+            rows = list(self.datamgr.iter_parallel(
+                'pk', self.form, 2, output='tuples', processes=1))
+
+        xpaths = ['_id', '_submission_time', 'personal_details/first_name',
+                  'personal_details/gender', 'age']
+        self.assertEqual(rows, [(i, None, None, None, str(i))
+                                for i in range(3)])
+        params = parse_qs(urlparse(m.call_args_list[0][0][0]).query)
+        self.assertEqual(json.loads(params['fields'][0]), xpaths)
+
+    def test_columns(self):
+        with mock.patch.object(self.conn, 'get', side_effect=self.get):
+            batches = list(self.datamgr.iter_parallel(
+                'pk', self.form, 2, output='columns', processes=1))
+
+        self.assertEqual([b['age'].to_list() for b in batches],
+                         [[0, 1], [2]])
+
+    def test_flat(self):
+        with mock.patch.object(self.conn, 'get', side_effect=self.get) as m:
+            batches = list(self.datamgr.iter_parallel(
+                'pk', self.form, 2, output='flat', processes=1))
+
+        self.assertEqual([len(b['personnel_form']) for b in batches], [2, 1])
+        self.assertEqual(list(batches[0]),
+                         ['personnel_form', 'children'])
+        params = parse_qs(urlparse(m.call_args_list[0][0][0]).query)
+        self.assertIn('children', json.loads(params['fields'][0]))
+
+    def test_workers_use_the_connection_backend(self):
+        datamgr = DataManager(Connection('http://mock_host',
+                                         json_backend='json'), '/data')
+        with mock.patch.object(pipeline, 'iter_pipelined',
+                               return_value=iter([])) as mock_pipelined:
+            list(datamgr.iter_parallel('pk'))
+        self.assertEqual(mock_pipelined.call_args[0][-1], 'json')
+
+    def test_invalid_output(self):
+        with self.assertRaises(ClientException):
+            self.datamgr.iter_parallel('pk', output='rows')
+        with self.assertRaises(ClientException):
+            self.datamgr.iter_parallel('pk', output='columns')
+        with self.assertRaises(ClientException):
+            self.datamgr.iter_parallel('pk', page_size=None)
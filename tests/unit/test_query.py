@@ -0,0 +1,67 @@
+from datetime import date
+from onapie.exceptions import ClientException
+from onapie.ona_schema import OnaForm
+from onapie.query import DataQuery
+from tests.unit.test_ona_schema import SCHEMA
+import json
+import unittest
+
+
+try:
+    from urllib.parse import parse_qsl  # NOQA
+except ImportError:
+    from urlparse import parse_qsl  # NOQA
+
+
+class DataQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(DataQueryTestCase, self).setUp()
+        self.form = OnaForm(SCHEMA)
+
+    def test_params(self):
+        query = DataQuery(self.form) \
+            .fields('_id', 'personal_details/first_name') \
+            .where({'age': {'$gte': 18}}) \
+            .where(age={'$lt': 65}) \
+            .between('_submission_time', date(2015, 1, 1)) \
+            .sort('age', descending=True).sort('_id') \
+            .tags('t1', 't2') \
+            .slice(20, 10)
+        params = query.params()
+        self.assertEqual([name for name, _ in params],
+                         ['query', 'fields', 'sort', 'tags', 'start',
+                          'limit'])
+        params = dict(params)
+        self.assertEqual(json.loads(params['query']), {
+            'age': {'$gte': 18, '$lt': 65},
+            '_submission_time': {'$gte': '2015-01-01'}})
+        self.assertEqual(json.loads(params['fields']),
+                         ['_id', 'personal_details/first_name'])
+        self.assertEqual(params['sort'], '{"age": -1, "_id": 1}')
+        self.assertEqual(params['tags'], 't1,t2')
+        self.assertEqual((params['start'], params['limit']), (20, 10))
+
+    def test_urlencode_round_trips(self):
+        query = DataQuery().where({'name': 'a&b=c #1'})
+        self.assertEqual(dict(parse_qsl(query.urlencode())),
+                         {'query': '{"name": "a&b=c #1"}'})
+
+    def test_unknown_fields_are_rejected(self):
+        query = DataQuery(self.form).fields('age', 'first_name') \
+            .where({'$or': [{'personal_details/gender': 'male'},
+                            {'height': {'$gt': 1}}]}) \
+            .sort('_submission_time')
+        with self.assertRaises(ClientException) as cm:
+            query.params()
+        self.assertIn('first_name, height', str(cm.exception))
+
+    def test_no_validation_without_form(self):
+        self.assertEqual(DataQuery().fields('anything').params(),
+                         [('fields', '["anything"]')])
+
+    def test_where_leaves_conditions_untouched(self):
+        condition = {'$gte': 18}
+        query = DataQuery().where(age=condition).where(age={'$lt': 65})
+        self.assertEqual(query.query, {'age': {'$gte': 18, '$lt': 65}})
+        self.assertEqual(condition, {'$gte': 18})
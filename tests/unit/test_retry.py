@@ -0,0 +1,149 @@
+from datetime import timedelta
+from email.utils import formatdate
+from onapie.exceptions import ApiException, ClientException
+from onapie.retry import RetryPolicy, TokenBucket, parse_retry_after
+from onapie.retry import rate_limiters
+from onapie.uploads import MultipartEncoder
+from onapie.utils import Connection
+import io
+import mock
+import requests
+import time
+import unittest
+
+
+def make_response(status_code, headers=None):
+    response = requests.models.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = b'{}'
+    response.raw = io.BytesIO()
+    response.elapsed = timedelta(0)
+    return response
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        now = time.time()
+        self.assertAlmostEqual(
+            parse_retry_after(formatdate(now + 30, usegmt=True), now), 30,
+            delta=1)
+        self.assertEqual(
+            parse_retry_after(formatdate(now - 30, usegmt=True), now), 0)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_should_retry(self):
+        policy = RetryPolicy(total=2)
+        self.assertTrue(policy.should_retry('GET', make_response(503), 0))
+        self.assertFalse(policy.should_retry('GET', make_response(503), 2))
+        self.assertFalse(policy.should_retry('GET', make_response(500), 0))
+        self.assertFalse(policy.should_retry('POST', make_response(503), 0))
+        self.assertTrue(policy.should_retry('POST', make_response(429), 0))
+
+    def test_backoff_is_exponential_and_bounded(self):
+        policy = RetryPolicy(backoff_factor=1, max_backoff=10, jitter=False)
+        self.assertEqual([policy.backoff(n) for n in range(5)],
+                         [1, 2, 4, 8, 10])
+        policy.jitter = True
+        for n in range(5):
+            self.assertTrue(0 <= policy.backoff(n) <= min(10, 2 ** n))
+
+    def test_retry_after_takes_precedence(self):
+        policy = RetryPolicy(max_backoff=60, jitter=False)
+        self.assertEqual(
+            policy.delay(make_response(429, {'Retry-After': '7'}), 0), 7)
+        self.assertEqual(
+            policy.delay(make_response(429, {'Retry-After': '600'}), 0), 60)
+        self.assertEqual(policy.delay(make_response(503), 1), 1)
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_blocks_once_burst_is_spent(self):
+        bucket = TokenBucket(rate=50, capacity=2)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertGreater(bucket.acquire(), 0)
+
+    def test_adapts_rate(self):
+        bucket = TokenBucket(rate=10, min_rate=1, max_rate=12, increase=1,
+                             decrease=0.5)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        for _ in range(10):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 12)
+        for _ in range(10):
+            bucket.throttled()
+        self.assertEqual(bucket.rate, 1)
+
+
+class ConnectionRetryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ConnectionRetryTestCase, self).setUp()
+        self.policy = RetryPolicy(total=3)
+        self.policy.sleep = mock.Mock()
+        self.conn = Connection('http://localhost:8000',
+                               retry_policy=self.policy)
+        self.conn._request = mock.Mock()
+
+    def test_retries_until_success(self):
+        self.conn._request.side_effect = [
+            make_response(503), make_response(429, {'Retry-After': '2'}),
+            make_response(200)]
+        events = []
+        self.conn.add_hook(events.append)
+
+        response = self.conn.get('/api/v1/data/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.conn._request.call_count, 3)
+        self.assertEqual(self.policy.sleep.call_args_list[1],
+                         mock.call(2.0))
+        self.assertEqual(events[0].retries, 2)
+
+    def test_gives_up_after_total(self):
+        self.conn._request.return_value = make_response(503)
+        self.assertRaises(ApiException, self.conn.get, '/api/v1/data/1')
+        self.assertEqual(self.conn._request.call_count, 4)
+
+    def test_streamed_bodies_are_not_retried(self):
+        self.conn._request.return_value = make_response(429)
+        body = MultipartEncoder(fields={'a': 'b'})
+        self.assertRaises(ClientException, self.conn.request, 'PUT',
+                          '/api/v1/forms/1', body)
+        self.assertEqual(self.conn._request.call_count, 1)
+
+    def test_retries_can_be_disabled(self):
+        self.conn.retry_policy = None
+        self.conn._request.return_value = make_response(503)
+        self.assertRaises(ApiException, self.conn.get, '/api/v1/data/1')
+        self.assertEqual(self.conn._request.call_count, 1)
+
+
+class ConnectionRateLimitTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        rate_limiters.clear()
+        super(ConnectionRateLimitTestCase, self).tearDown()
+
+    def test_limiter_is_shared_per_host(self):
+        first = Connection('http://localhost:8000', rate_limit=5)
+        second = Connection('http://localhost:8000', rate_limit=5)
+        other = Connection('http://example.com', rate_limit=5)
+        self.assertIs(first.rate_limiter, second.rate_limiter)
+        self.assertIsNot(first.rate_limiter, other.rate_limiter)
+        self.assertIsNone(Connection('http://localhost:8000').rate_limiter)
+
+    def test_throttling_slows_the_limiter(self):
+        conn = Connection('http://localhost:8000', rate_limit=100,
+                          retry_policy=None)
+        conn._request = mock.Mock(side_effect=[make_response(200),
+                                               make_response(429)])
+        conn.get('/api/v1/data/1')
+        self.assertEqual(conn.rate_limiter.rate, 100.5)
+        self.assertRaises(ClientException, conn.get, '/api/v1/data/1')
+        self.assertEqual(conn.rate_limiter.rate, 50.25)
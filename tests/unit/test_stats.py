@@ -1,5 +1,5 @@
 from onapie.stats import StatsManager
-from onapie.utils import ConnectionSingleton
+from onapie.utils import Connection
 from tests.utils import MockResponse
 import mock
 import unittest
@@ -10,7 +10,7 @@ class StatsMethodsTestCase(unittest.TestCase):
     def setUp(self):
         super(StatsMethodsTestCase, self).setUp()
         self.stats_path = '/some/path'
-        self.conn = ConnectionSingleton('http://mock_host')
+        self.conn = Connection('http://mock_host')
         self.sm = StatsManager(self.conn, self.stats_path)
 
     def test_get(self):
@@ -24,3 +24,15 @@ class StatsMethodsTestCase(unittest.TestCase):
             self.sm.get('test_pk', 'methodX')
             mock_get.assert_called_with(
                 '{}/test_pk?method=methodX'.format(self.stats_path))
+
+    def test_get_many(self):
+        with mock.patch.object(self.sm.conn, 'get',
+                               return_value=MockResponse(200, 'Success',
+                                                         '{}')) as mock_get:
+            results = list(self.sm.get_many(['pk1', 'pk2'], 'methodX'))
+
+        self.assertEqual(sorted(r.key for r in results), ['pk1', 'pk2'])
+        mock_get.assert_any_call(
+            '{}/pk1?method=methodX'.format(self.stats_path))
+        mock_get.assert_any_call(
+            '{}/pk2?method=methodX'.format(self.stats_path))
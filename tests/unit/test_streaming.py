@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from onapie.exceptions import ClientException
+from onapie.streaming import iter_json_array
+from onapie.utils import Connection
+from tests.utils import StubServer
+import json
+import unittest
+
+
+class IterJsonArrayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(IterJsonArrayTestCase, self).setUp()
+        self.records = [{u'name': u'h\xe9llo ☃', u'values': [1, 2.5]},
+                        12345, u'text', True, None, [], {}]
+        self.doc = json.dumps(self.records, ensure_ascii=False)\
+            .encode('utf-8')
+
+    def test_yields_elements_across_any_chunk_boundary(self):
+        for size in range(1, len(self.doc) + 1):
+            chunks = [self.doc[i:i + size]
+                      for i in range(0, len(self.doc), size)]
+            self.assertEqual(list(iter_json_array(chunks)), self.records)
+
+    def test_yields_before_stream_ends(self):
+        def chunks():
+            yield b'[{"_id": 1}, '
+            raise AssertionError('Read past the first element')
+
+        self.assertEqual(next(iter_json_array(chunks())), {u'_id': 1})
+
+    def test_accepts_text_chunks(self):
+        self.assertEqual(list(iter_json_array([u' [ 1 ,', u' 2 ] '])),
+                         [1, 2])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([b'[]'])), [])
+
+    def test_non_array_document_is_yielded_whole(self):
+        self.assertEqual(list(iter_json_array([b'{"detail"', b': "x"}'])),
+                         [{u'detail': u'x'}])
+
+    def test_malformed_documents(self):
+        for doc in [b'', b'[1 2]', b'[1,', b'[{"a":']:
+            with self.assertRaises(ValueError):
+                list(iter_json_array([doc]))
+
+
+class ConnectionIterJsonTestCase(unittest.TestCase):
+
+    def test_error_responses_are_closed(self):
+        with StubServer({}) as server:
+            conn = Connection(server.url)
+            with self.assertRaises(ClientException) as context:
+                conn.iter_json('/api/v1/data/1?page=9')
+
+        self.assertTrue(conn.last_response.raw.closed)
+        self.assertEqual(context.exception.api_response.status_code, 404)
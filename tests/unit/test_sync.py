@@ -0,0 +1,203 @@
+from onapie.data import DataManager
+from onapie.exceptions import ClientException
+from onapie.ona_schema import OnaForm
+from onapie.query import DataQuery
+from onapie.sync import IndexedSQLiteStore, SQLiteStore
+from onapie.utils import Connection
+from tests.unit.test_ona_schema import SCHEMA
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+
+RECORDS = [
+    {'_id': 1, 'age': '30', 'personal_details/gender': 'male',
+     'children': [{'children/age': '3'}]},
+    {'_id': 2, 'age': '8', 'personal_details/gender': 'female'},
+    {'_id': 3, 'age': '20', 'personal_details/gender': 'female'},
+    {'_id': 4, 'personal_details/gender': 'male'},
+]
+
+
+class SQLiteStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(SQLiteStoreTestCase, self).setUp()
+        self.store = SQLiteStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+        super(SQLiteStoreTestCase, self).tearDown()
+
+    def test_checkpoints(self):
+        self.assertIsNone(self.store.get_checkpoint(1))
+        self.store.set_checkpoint(1, '2015-01-01T00:00:00')
+        self.store.set_checkpoint(2, 42)
+        self.assertEqual(self.store.get_checkpoint(1), '2015-01-01T00:00:00')
+        self.assertEqual(self.store.get_checkpoint(2), 42)
+
+    def test_upsert_and_delete(self):
+        self.assertEqual(self.store.upsert(1, [{'_id': 1}, {'_id': 2}]),
+                         (2, 0))
+        self.assertEqual(self.store.upsert(1, [{'_id': 2, 'a': 'b'}]),
+                         (0, 1))
+        self.assertEqual(self.store.get(1, 2), {'_id': 2, 'a': 'b'})
+        self.assertEqual(self.store.delete(1, [1, 3]), 1)
+        self.assertEqual(list(self.store.iter_records(1)),
+                         [{'_id': 2, 'a': 'b'}])
+        self.assertEqual(self.store.count(2), 0)
+
+
+class DataManagerSyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(DataManagerSyncTestCase, self).setUp()
+        self.datamgr = DataManager(Connection('http://mock_host'), '/data')
+        self.store = SQLiteStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+        super(DataManagerSyncTestCase, self).tearDown()
+
+    def test_first_sync_fetches_everything(self):
+        records = [{'_id': 1, '_date_modified': '2015-01-02'},
+                   {'_id': 2, '_date_modified': '2015-01-01'}]
+        with mock.patch.object(self.datamgr, 'iter',
+                               return_value=iter(records)) as mock_iter:
+            summary = self.datamgr.sync('pk', self.store, page_size=1)
+
+        mock_iter.assert_called_once_with('pk', 1, None)
+        self.assertEqual(summary, {'created': 2, 'updated': 0,
+                                   'deleted': 0, 'checkpoint': '2015-01-02'})
+        self.assertEqual(self.store.get_checkpoint('pk'), '2015-01-02')
+
+    def test_sync_requests_changes_since_checkpoint(self):
+        self.store.set_checkpoint('pk', '2015-01-02')
+        self.store.upsert('pk', [{'_id': 1}, {'_id': 2}])
+        records = [{'_id': 1, '_date_modified': '2015-01-03', 'edit': 1},
+                   {'_id': 2, '_date_modified': '2015-01-04',
+                    '_deleted_at': '2015-01-04'},
+                   {'_id': 3, '_date_modified': '2015-01-03'}]
+        with mock.patch.object(self.datamgr, 'iter',
+                               return_value=iter(records)) as mock_iter:
+            summary = self.datamgr.sync('pk', self.store)
+
+        mock_iter.assert_called_once_with(
+            'pk', 1000, {'_date_modified': {'$gte': '2015-01-02'}})
+        self.assertEqual(summary, {'created': 1, 'updated': 1,
+                                   'deleted': 1, 'checkpoint': '2015-01-04'})
+        self.assertEqual(self.store.get('pk', 1)['edit'], 1)
+        self.assertIsNone(self.store.get('pk', 2))
+
+    def test_sync_includes_submissions_at_the_checkpoint(self):
+        self.store.set_checkpoint('pk', '2015-01-02')
+        self.store.upsert('pk', [{'_id': 1, '_date_modified': '2015-01-02'}])
+        # Submission 2 was modified in the same second as the checkpoint
+        # but after the previous sync
+        records = [{'_id': 1, '_date_modified': '2015-01-02'},
+                   {'_id': 2, '_date_modified': '2015-01-02'}]
+        with mock.patch.object(self.datamgr, 'iter',
+                               return_value=iter(records)):
+            summary = self.datamgr.sync('pk', self.store)
+
+        self.assertEqual(summary, {'created': 1, 'updated': 0,
+                                   'deleted': 0, 'checkpoint': '2015-01-02'})
+        self.assertIsNotNone(self.store.get('pk', 2))
+
+    def test_sync_without_changes_reports_nothing(self):
+        self.store.set_checkpoint('pk', '2015-01-02')
+        record = {'_id': 1, '_date_modified': '2015-01-02'}
+        self.store.upsert('pk', [record])
+        with mock.patch.object(self.datamgr, 'iter',
+                               return_value=iter([record])):
+            summary = self.datamgr.sync('pk', self.store)
+
+        self.assertEqual(summary, {'created': 0, 'updated': 0,
+                                   'deleted': 0, 'checkpoint': '2015-01-02'})
+
+    def test_failed_sync_keeps_checkpoint(self):
+        self.store.set_checkpoint('pk', 5)
+
+        def records():
+            yield {'_id': 6}
+            raise IOError('Connection dropped')
+
+        with mock.patch.object(self.datamgr, 'iter',
+                               return_value=records()):
+            with self.assertRaises(IOError):
+                self.datamgr.sync('pk', self.store, '_id')
+
+        self.assertEqual(self.store.get_checkpoint('pk'), 5)
+
+
+class IndexedSQLiteStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(IndexedSQLiteStoreTestCase, self).setUp()
+        self.store = IndexedSQLiteStore(':memory:')
+        self.store.upsert('pk', RECORDS[:2])
+        self.store.register('pk', OnaForm(SCHEMA), index=['age'])
+        self.store.upsert('pk', RECORDS[2:])
+
+    def tearDown(self):
+        self.store.close()
+        super(IndexedSQLiteStoreTestCase, self).tearDown()
+
+    def ids(self, records):
+        return [r['_id'] for r in records]
+
+    def test_typed_comparisons_use_the_index(self):
+        self.assertEqual(self.ids(self.store.find(
+            'pk', {'age': {'$gte': 9, '$lt': 40}}, sort=[('age', 1)])),
+            [3, 1])
+        plan = self.store.db.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM "fields:pk" WHERE age > 9'
+        ).fetchall()
+        self.assertIn('index:pk:age', str(plan))
+
+    def test_query_kwargs_and_operators(self):
+        self.assertEqual(self.ids(self.store.find(
+            'pk', **{'personal_details/gender': 'female'})), [2, 3])
+        self.assertEqual(self.ids(self.store.find(
+            'pk', {'$or': [{'age': {'$in': [30]}}, {'age': None}]})), [1, 4])
+        self.assertEqual(self.store.count_where('pk', age={'$exists': True}),
+                         3)
+
+    def test_fields_outside_columns_are_read_from_json(self):
+        self.assertEqual(self.ids(self.store.find(
+            'pk', {'children': {'$exists': True}})), [1])
+
+    def test_data_query(self):
+        query = DataQuery(OnaForm(SCHEMA)).fields('_id', 'age') \
+            .where(age={'$gt': 0}).sort('age', descending=True).slice(1, 1)
+        self.assertEqual(self.store.find('pk', query),
+                         [{'_id': 3, 'age': '20'}])
+
+    def test_edits_and_deletes_update_columns(self):
+        self.store.upsert('pk', [dict(RECORDS[1], age='50')])
+        self.store.delete('pk', [1])
+        self.assertEqual(self.ids(self.store.find(
+            'pk', {'age': {'$gt': 25}})), [2])
+
+    def test_unregistered_form(self):
+        with self.assertRaises(ClientException):
+            self.store.find('other')
+
+    def test_layout_survives_reopening(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'store.sqlite')
+        store = IndexedSQLiteStore(path)
+        store.upsert('pk', RECORDS)
+        store.register('pk', OnaForm(SCHEMA))
+        store.close()
+
+        store = IndexedSQLiteStore(path)
+        self.addCleanup(store.close)
+        self.assertEqual(store.count_where('pk', age={'$gt': 9}), 2)
+        with mock.patch.object(store, '_insert_rows') as mock_insert:
+            store.register('pk', OnaForm(SCHEMA), index=['age'])
+        self.assertFalse(mock_insert.called)
+        self.assertEqual(self.ids(store.find('pk', {'age': 8})), [2])
@@ -0,0 +1,157 @@
+from onapie.cache import MemoryCache
+from onapie.client import Client
+from onapie.exceptions import ApiException, ClientException
+from onapie.retry import RetryPolicy
+from onapie.transport import RequestsTransport, get_transport
+from onapie.utils import Connection, ConnectionRegistry
+from tests.utils import StubServer
+import hashlib
+import requests
+import socket
+import unittest
+
+try:
+    from onapie.transport import HTTPXTransport
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def digest_user(headers):
+    """Answer /api/v1/user behind digest auth for bob:secret"""
+    authorization = headers.get('Authorization') or ''
+    if not authorization.startswith('Digest '):
+        return (401, '{}', {'WWW-Authenticate':
+                            'Digest realm="ona", nonce="abc", qop="auth"'})
+
+    params = dict(part.strip().split('=', 1) for part in
+                  authorization[len('Digest '):].split(','))
+    params = dict((k, v.strip('"')) for k, v in params.items())
+
+    def md5(text):
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    expected = md5(':'.join([
+        md5('bob:ona:secret'), 'abc', params['nc'], params['cnonce'], 'auth',
+        md5('GET:' + params['uri'])]))
+    if params.get('username') != 'bob' or params['response'] != expected:
+        return 401, '{}'
+    return 200, '{"api_token": "t0k3n"}'
+
+
+class GetTransportTestCase(unittest.TestCase):
+
+    def test_default_is_requests(self):
+        transport = get_transport()
+        self.assertIsInstance(transport, RequestsTransport)
+        self.assertIs(Connection('http://host', transport=transport).session,
+                      transport.session)
+
+    def test_instances_pass_through(self):
+        transport = RequestsTransport()
+        self.assertIs(get_transport(transport), transport)
+
+    def test_unknown_name(self):
+        with self.assertRaises(ValueError):
+            get_transport('carrier-pigeon')
+
+
+@unittest.skipIf(httpx is None, 'httpx is not installed')
+class HTTPXTransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(HTTPXTransportTestCase, self).setUp()
+        self.routes = {
+            '/api/v1/forms/1': (200, '{"formid": 1}', {'ETag': '"v1"'}),
+            '/api/v1/data/1': (200, '[{"_id": 1}, {"_id": 2}]'),
+            '/api/v1/busy': (503, '{}'),
+        }
+
+    def connect(self, server, **kwargs):
+        return Connection(server.url, transport='httpx', **kwargs)
+
+    def test_names(self):
+        self.assertFalse(get_transport('httpx').http2)
+        self.assertTrue(get_transport('http2').http2)
+
+    def test_responses_look_like_requests(self):
+        with StubServer(self.routes) as server:
+            conn = self.connect(server)
+            response = conn.get('/api/v1/forms/1')
+            self.assertIsInstance(response, requests.Response)
+            self.assertEqual(conn.decode_json(response), {'formid': 1})
+            self.assertEqual(response.headers['etag'], '"v1"')
+            self.assertEqual(response.reason, 'OK')
+            self.assertEqual(
+                [d['_id'] for d in conn.iter_json('/api/v1/data/1',
+                                                  chunk_size=4)], [1, 2])
+
+            conn.post('/api/v1/data/1', payload={'tags': 'a,b'})
+            conn.close()
+
+        method, path, headers = server.requests[-1]
+        self.assertEqual((method, path), ('POST', '/api/v1/data/1'))
+        self.assertEqual(headers['Content-Type'],
+                         'application/x-www-form-urlencoded')
+
+    def test_same_error_mapping_and_retries(self):
+        with StubServer(self.routes) as server:
+            conn = self.connect(server, retry_policy=RetryPolicy(
+                total=2, backoff_factor=0))
+            with self.assertRaises(ClientException):
+                conn.get('/api/v1/missing')
+            with self.assertRaises(ApiException):
+                conn.get('/api/v1/busy')
+
+        self.assertEqual([p for _, p, _ in server.requests].count(
+            '/api/v1/busy'), 3)
+
+    def test_authenticate_and_revalidate(self):
+        self.routes['/api/v1/user'] = digest_user
+        with StubServer(self.routes) as server:
+            client = Client(server.url, username='bob', password='secret',
+                            fetch_catalog=False, transport='httpx',
+                            cache=MemoryCache(),
+                            registry=ConnectionRegistry())
+            self.assertEqual(client.login(), 't0k3n')
+            first = client.forms.get(1)
+            self.assertEqual(client.forms.get(1), first)
+            client.conn.close()
+
+        self.assertEqual(server.requests[-1][2]['If-None-Match'], '"v1"')
+        self.assertEqual(server.requests[-1][2]['Authorization'],
+                         'Token t0k3n')
+        self.assertEqual(client.conn.cache.stats['hits'], 1)
+
+    def test_unsupported_arguments(self):
+        transport = get_transport('httpx')
+        with self.assertRaises(TypeError):
+            transport.request('GET', 'http://host/', allow_redirects=False)
+        with self.assertRaises(TypeError):
+            transport.request('GET', 'http://host/', auth=object())
+        transport.close()
+
+    def test_per_request_verify(self):
+        transport = get_transport('httpx')
+        transport.session.headers['User-Agent'] = 'onapie-tests'
+        with StubServer(self.routes) as server:
+            transport.request('GET', server.url + '/api/v1/forms/1',
+                              verify=False)
+            transport.close()
+
+        self.assertEqual(set(transport._clients), set([True, False]))
+        headers = dict((k.lower(), v)
+                       for k, v in server.requests[0][2].items())
+        self.assertEqual(headers['user-agent'], 'onapie-tests')
+
+    def test_connection_errors_are_requests_errors(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        conn = Connection('http://127.0.0.1:{}'.format(port),
+                          transport=HTTPXTransport(http2=False,
+                                                   max_retries=0))
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            conn.get('/api/v1/forms')
@@ -0,0 +1,79 @@
+from email.parser import BytesParser
+from onapie.uploads import MultipartEncoder
+from onapie.utils import Connection
+from tests.utils import StubServer
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class MultipartEncoderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(MultipartEncoderTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'form.xls')
+        self.content = os.urandom(200 * 1024)
+        with open(self.file_path, 'wb') as file_data:
+            file_data.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(MultipartEncoderTestCase, self).tearDown()
+
+    def parse(self, encoder, body):
+        message = BytesParser().parsebytes(
+            b'Content-Type: ' + encoder.content_type.encode('ascii') +
+            b'\r\n\r\n' + body)
+        return dict((part.get_param('name', header='content-disposition'),
+                     part) for part in message.get_payload())
+
+    def test_body_is_valid_multipart(self):
+        encoder = MultipartEncoder({'xform': 1},
+                                   [('xls_file', self.file_path)])
+        body = encoder.read()
+        parts = self.parse(encoder, body)
+
+        self.assertEqual(len(body), len(encoder))
+        self.assertEqual(parts['xform'].get_payload(), '1')
+        self.assertEqual(parts['xls_file'].get_filename(), 'form.xls')
+        self.assertEqual(parts['xls_file'].get_payload(decode=True),
+                         self.content)
+
+    def test_reads_in_chunks_and_reports_progress(self):
+        calls = []
+        encoder = MultipartEncoder(
+            None, [('xls_file', self.file_path)],
+            lambda sent, total: calls.append((sent, total)),
+            chunk_size=4096)
+        chunks = list(encoder)
+
+        self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+        self.assertEqual(calls[-1], (len(encoder), len(encoder)))
+        self.assertEqual(len(calls), len(chunks))
+
+    def test_mmap_produces_the_same_body(self):
+        encoder = MultipartEncoder({'data_type': 'media'},
+                                   [('data_file', self.file_path)],
+                                   use_mmap=True, chunk_size=1000)
+        body = b''.join(iter(lambda: encoder.read(3000), b''))
+        parts = self.parse(encoder, body)
+
+        self.assertEqual(len(body), len(encoder))
+        self.assertEqual(parts['data_file'].get_payload(decode=True),
+                         self.content)
+
+    def test_connection_streams_upload(self):
+        calls = []
+        with StubServer({'/api/v1/forms': (201, '{}')}) as server:
+            conn = Connection(server.url)
+            conn.post('/api/v1/forms', self.file_path,
+                      progress=lambda sent, total: calls.append(sent))
+
+        method, path, headers = server.requests[0]
+        self.assertEqual((method, path), ('POST', '/api/v1/forms'))
+        self.assertTrue(headers['Content-Type'].startswith(
+            'multipart/form-data; boundary='))
+        self.assertEqual(int(headers['Content-Length']), calls[-1])
+        self.assertGreater(calls[-1], len(self.content))
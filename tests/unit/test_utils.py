@@ -0,0 +1,103 @@
+from onapie.utils import ConnectionRegistry, iter_concurrently
+import threading
+import time
+import unittest
+
+
+class IterConcurrentlyTestCase(unittest.TestCase):
+
+    def test_yields_a_result_per_key(self):
+        results = list(iter_concurrently(lambda key: key * 2, range(20), 4))
+        self.assertEqual(sorted(r.key for r in results), list(range(20)))
+        for result in results:
+            self.assertEqual(result.result, result.key * 2)
+            self.assertIsNone(result.error)
+
+    def test_failures_do_not_abort_the_batch(self):
+        def func(key):
+            if key % 2:
+                raise ValueError(key)
+            return key
+
+        results = dict((r.key, r) for r in iter_concurrently(func, range(6)))
+        self.assertEqual(len(results), 6)
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertIsNone(results[1].result)
+        self.assertEqual(results[2].result, 2)
+
+    def test_runs_calls_concurrently_within_bound(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def func(key):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        list(iter_concurrently(func, range(30), 5))
+        self.assertEqual(state['peak'], 5)
+
+    def test_consumes_keys_lazily(self):
+        consumed = []
+
+        def keys():
+            for key in range(100):
+                consumed.append(key)
+                yield key
+
+        results = iter_concurrently(lambda key: key, keys(), 2)
+        next(results)
+        self.assertLessEqual(len(consumed), 6)
+        results.close()
+
+
+class ConnectionRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ConnectionRegistryTestCase, self).setUp()
+        self.registry = ConnectionRegistry()
+
+    def tearDown(self):
+        self.registry.clear()
+        super(ConnectionRegistryTestCase, self).tearDown()
+
+    def test_reuses_connection_per_host_and_credentials(self):
+        conn = self.registry.get('https://api.ona.io', 'token1')
+        self.assertIs(self.registry.get('https://api.ona.io/api/v1/',
+                                        'token1'), conn)
+        self.assertIsNot(self.registry.get('https://api.ona.io', 'token2'),
+                         conn)
+        self.assertIsNot(self.registry.get('https://other.ona.io',
+                                           'token1'), conn)
+        self.assertIsNot(self.registry.get('http://api.ona.io', 'token1'),
+                         conn)
+
+    def test_connection_options_are_part_of_the_key(self):
+        conn = self.registry.get('https://api.ona.io', None)
+        other = self.registry.get('https://api.ona.io', None, timeout=1)
+        self.assertIsNot(other, conn)
+        self.assertEqual(other.timeout, 1)
+        self.assertIs(self.registry.get('https://api.ona.io', None,
+                                        timeout=1, lazy=False), other)
+
+    def test_keys_hold_no_passwords(self):
+        self.registry.get('https://api.ona.io', ('bob', 'secret'))
+        self.assertNotIn('secret', repr(list(self.registry._connections)))
+
+    def test_connections_do_not_share_headers(self):
+        conn1 = self.registry.get('https://api.ona.io', 'token1')
+        conn2 = self.registry.get('https://api.ona.io', 'token2')
+        conn1.set_header('Authorization', 'Token token1')
+        self.assertNotIn('Authorization', conn2.session.headers)
+
+    def test_pool_sizing_and_retries(self):
+        conn = self.registry.get('http://api.ona.io', None, pool_maxsize=32,
+                                 pool_connections=4, max_retries=3)
+        for url in ['http://api.ona.io', 'https://api.ona.io']:
+            adapter = conn.session.get_adapter(url)
+            self.assertEqual(adapter._pool_maxsize, 32)
+            self.assertEqual(adapter._pool_connections, 4)
+            self.assertEqual(adapter.max_retries.total, 3)
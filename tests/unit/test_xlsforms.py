@@ -3,8 +3,9 @@ import mock
 import unittest
 
 from onapie.xlsforms import XlsFormsManager
-from onapie.exceptions import ClientException
-from onapie.utils import ConnectionSingleton
+from onapie.exceptions import ApiException, ClientException
+from onapie.exports import ExportJob
+from onapie.utils import Connection
 from tests.utils import MockResponse
 from random import choice
 
@@ -15,7 +16,7 @@ mock_del_204_http_call = mock.Mock()
 mock_del_204_http_call.return_value = MockResponse(204, 'Deleted', '{}')
 
 
-@mock.patch.multiple(ConnectionSingleton,
+@mock.patch.multiple(Connection,
                      get=mock_http_call,
                      post=mock_http_call,
                      put=mock_http_call,
@@ -26,7 +27,7 @@ class XlsFormsManagerTestCase(unittest.TestCase):
     def setUp(self):
         super(XlsFormsManagerTestCase, self).setUp()
         self.path = '/some/path'
-        self.conn = ConnectionSingleton('http://mock_host')
+        self.conn = Connection('http://mock_host')
         self.xlsmgr = XlsFormsManager(self.conn, self.path)
 
     def test_create_mutually_exclusive_args(self):
@@ -44,6 +45,13 @@ class XlsFormsManagerTestCase(unittest.TestCase):
         self.xlsmgr.create(None, 'xls_url')
         self.conn.post.assert_called_with(self.path, None, 'xls_url')
 
+    def test_add_media_call(self):
+        self.xlsmgr.add_media('pk', '/tmp/media/logo.png')
+        self.conn.post.assert_called_with(
+            '/some/metadata', '/tmp/media/logo.png',
+            {'xform': 'pk', 'data_type': 'media', 'data_value': 'logo.png'},
+            file_field='data_file', progress=None, use_mmap=False)
+
     def test_list_call(self):
         self.xlsmgr.list()
         self.conn.get.assert_called_with(self.path)
@@ -56,6 +64,15 @@ class XlsFormsManagerTestCase(unittest.TestCase):
         self.xlsmgr.get('pk')
         self.conn.get.assert_called_with('{}/pk'.format(self.path))
 
+    def test_get_many_call(self):
+        results = dict((r.key, r) for r in self.xlsmgr.get_many(
+            ['pk1', 'pk2'], 'invalid_repr'))
+        self.assertEqual(sorted(results.keys()), ['pk1', 'pk2'])
+        self.assertIsInstance(results['pk1'].error, ClientException)
+
+        list(self.xlsmgr.get_many(['pk3'], 'xml'))
+        self.conn.get.assert_called_with('{}/pk3/form.xml'.format(self.path))
+
     def test_get_form_invalid_representation_exception(self):
         with self.assertRaises(ClientException):
             self.xlsmgr.get('pk', 'invalid_repr')
@@ -90,7 +107,7 @@ class XlsFormsManagerTestCase(unittest.TestCase):
                                            None, 'foo1=bar1&foo2=bar2')
 
     def test_delete_response_exception(self):
-        with mock.patch.object(ConnectionSingleton, 'delete', mock_http_call):
+        with mock.patch.object(Connection, 'delete', mock_http_call):
             with self.assertRaises(ClientException):
                 self.xlsmgr.delete('pk')
 
@@ -106,7 +123,31 @@ class XlsFormsManagerTestCase(unittest.TestCase):
         self.xlsmgr.set_tag('pk', 'foo1', 'bar1', 'foo2', 'bar2')
         self.conn.get.assert_called_with(
             '{}/pk/labels'.format(self.path),
-            json.dumps({'tags': ['foo1', 'bar1', 'foo2', 'bar2']}))
+            payload={'tags': 'foo1,bar1,foo2,bar2'})
+
+    def test_bulk_tag(self):
+        def post(path, **kwargs):
+            if path.startswith('{}/2/'.format(self.path)):
+                raise ClientException(None, MockResponse(404, 'Not Found'))
+            return MockResponse(201, 'Created', '[]')
+
+        with mock.patch.object(self.conn, 'post',
+                               side_effect=post) as mock_post:
+            result = self.xlsmgr.bulk_tag([1, 2, 1, 3], ['a', 'b', 'a'])
+
+        self.assertEqual(sorted(result.succeeded), [1, 3])
+        self.assertEqual([f.key for f in result.failed], [2])
+        self.assertIsInstance(result.failed[0].error, ClientException)
+        self.assertEqual(mock_post.call_count, 3)
+        mock_post.assert_any_call('{}/3/labels'.format(self.path),
+                                  payload={'tags': 'a,b'})
+
+    def test_bulk_untag(self):
+        result = self.xlsmgr.bulk_untag([1, 1, 2], ['a', 'b'])
+        self.assertEqual(sorted(result.succeeded),
+                         [(1, 'a'), (1, 'b'), (2, 'a'), (2, 'b')])
+        self.conn.delete.assert_any_call(
+            '{}/2/labels/b'.format(self.path))
 
     def test_remove_tag(self):
         self.xlsmgr.remove_tag('pk', 'foo1')
@@ -117,10 +158,104 @@ class XlsFormsManagerTestCase(unittest.TestCase):
         self.xlsmgr.get_webformlink('pk')
         self.conn.get.assert_called_with('{}/pk/enketo'.format(self.path))
 
-    def test_get_formdata(self):
-        # TODO implement when API behaves
+    def export_server(self, polls=None, failures=(), missing=()):
+        """Fake `get` of the export job API, where the job of form pk is
+        ready on its `polls[pk]`th status request"""
+        polls = dict(polls or {})
+        seen = {}
+
+        def get(path, *args, **kwargs):
+            if '/export/' in path:
+                return MockResponse(200, 'OK', 'a,b\n')
+            pk = int(path.split('/')[3])
+            if pk in missing:
+                raise ClientException(None, MockResponse(404, 'Not Found'))
+            if 'job_uuid' in path:
+                seen[pk] = seen.get(pk, 0) + 1
+
+            if pk in failures:
+                body = {'job_status': 'FAILURE', 'error': 'No data'}
+            elif seen.get(pk, 0) < polls.get(pk, 1):
+                body = {'job_uuid': 'uuid{}'.format(pk),
+                        'job_status': 'PENDING'}
+            else:
+                body = {'job_status': 'SUCCESS', 'export_url':
+                        'http://mock_host/some/export/{}.csv'.format(pk)}
+            return MockResponse(200, 'OK', json.dumps(body))
+
+        return mock.patch.object(self.conn, 'get', side_effect=get)
+
+    def test_exports_entrypoint_is_deprecated(self):
+        with mock.patch('onapie.xlsforms.warnings.warn') as mock_warn:
+            XlsFormsManager(self.conn, self.path, '/api/v1/export')
+        self.assertEqual(mock_warn.call_args[0][1], DeprecationWarning)
+
+    def test_download_path(self):
+        job = ExportJob(1, 'csv', export_url='http://mock_host/e/1.csv?x=1')
+        self.assertEqual(job.download_path('mock_host'), '/e/1.csv?x=1')
+        job.export_url = 'https://cdn.example.com/e/1.csv?sig=abc'
+        self.assertEqual(job.download_path('mock_host'), job.export_url)
+        job.export_url = '/e/1.csv'
+        self.assertEqual(job.download_path('mock_host'), '/e/1.csv')
+
+    def test_start_export(self):
+        with self.export_server() as mock_get:
+            job = self.xlsmgr.start_export(1, 'csv', remove_group_name=True)
+
+        mock_get.assert_called_with('{}/1/export_async?format=csv'
+                                    '&remove_group_name=True'.format(
+                                        self.path))
+        self.assertEqual(job.job_uuid, 'uuid1')
+        self.assertFalse(job.done)
+
         with self.assertRaises(ClientException):
-            self.xlsmgr.get_formdata('pk', 'export_format')
+            self.xlsmgr.start_export(1, 'pdf')
+
+    @mock.patch('onapie.xlsforms.time.sleep')
+    def test_get_formdata(self, mock_sleep):
+        with self.export_server({1: 3}) as mock_get:
+            self.assertEqual(self.xlsmgr.get_formdata(1, 'csv'), b'a,b\n')
+
+        mock_get.assert_any_call('{}/1/export_async?format=csv'
+                                 '&job_uuid=uuid1'.format(self.path))
+        mock_get.assert_called_with('/some/export/1.csv')
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list],
+                         [1.0, 1.5, 2.25])
+
+    def test_wait_export_failure(self):
+        with self.export_server(failures=[1]):
+            with self.assertRaises(ApiException) as ctx:
+                self.xlsmgr.wait_export(self.xlsmgr.start_export(1, 'csv'))
+        self.assertIn('No data', str(ctx.exception))
+
+    @mock.patch('onapie.xlsforms.time.sleep')
+    def test_wait_export_timeout(self, mock_sleep):
+        with self.export_server({1: 100}):
+            job = self.xlsmgr.start_export(1, 'csv')
+            with mock.patch('onapie.xlsforms.time.time',
+                            side_effect=[0, 0, 10]):
+                with self.assertRaises(ApiException):
+                    self.xlsmgr.wait_export(job, timeout=5)
+        self.assertEqual(job.polls, 1)
+
+    def test_export_many(self):
+        with self.export_server({1: 2, 2: 1}, failures=[3],
+                                missing=[4]) as mock_get, \
+                mock.patch.object(self.conn, 'download') as mock_download:
+            results = dict((r.key, r) for r in self.xlsmgr.export_many(
+                [1, 2, 3, 4, 1], 'csv', '/tmp/exports', poll_interval=0))
+
+        self.assertEqual(sorted(results), [1, 2, 3, 4])
+        self.assertEqual(results[1].result, '/tmp/exports/1.csv')
+        self.assertIsNone(results[2].error)
+        self.assertIsInstance(results[3].error, ApiException)
+        self.assertIsInstance(results[4].error, ClientException)
+        mock_download.assert_any_call('/some/export/1.csv',
+                                      '/tmp/exports/1.csv', max_resumes=3)
+        self.assertEqual(mock_download.call_count, 2)
+        # start and two polls for 1, start and a poll for 2
+        self.assertEqual(len([c for c in mock_get.call_args_list
+                              if '/1/' in c[0][0]]), 3)
 
     def test_share_call(self):
         self.xlsmgr.share('pk', 'username', 'role')
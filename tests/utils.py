@@ -1,6 +1,98 @@
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # NOQA
+    from socketserver import ThreadingMixIn  # NOQA
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # NOQA
+    from SocketServer import ThreadingMixIn  # NOQA
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
 class MockResponse(object):
 
     def __init__(self, status_code, reason=None, text=None):
         self.status_code = status_code
         self.reason = reason
         self.text = text
+        self.encoding = None
+
+    @property
+    def content(self):
+        return (self.text or '').encode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        content = self.content
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class StubServer(object):
+    """A local HTTP server answering from a dict of canned responses
+
+    `routes` maps a request path (including its query string) to a
+    `(status, body)` or `(status, body, headers)` tuple with a text or bytes
+    body, or to a callable taking the request headers and returning one.
+    Unknown paths get a 404. Requests whose If-None-Match matches the
+    route's ETag get a 304.
+    Requests are recorded in `requests` as `(method, path, headers)` tuples.
+    """
+
+    def __init__(self, routes=None):
+        self.routes = routes or {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                stub.requests.append((self.command, self.path,
+                                      dict(self.headers.items())))
+                route = stub.routes.get(
+                    self.path, (404, '{"detail": "Not found"}'))
+                if callable(route):
+                    route = route(self.headers)
+                status, body = route[:2]
+                headers = route[2] if len(route) > 2 else {}
+                etag = headers.get('ETag')
+                if etag is not None and \
+                        self.headers.get('If-None-Match') == etag:
+                    status, body = 304, ''
+                if not isinstance(body, bytes):
+                    body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()